@@ -0,0 +1,159 @@
+"""
+ASGI entry point of the prediction API.
+
+Serves the same `/` and `/predict` contract as `clientApp.py`, but the
+request body is received and the response sent on the event loop, while
+decoding, cleaning and scoring run in a bounded executor. A slow upload
+therefore only holds a coroutine, not a whole worker process. When more
+requests are in flight than the executor can run plus
+MEDIWATCH_ASGI_MAX_QUEUE waiting ones, new requests are answered with 503
+and a Retry-After header instead of piling up.
+
+Configuration (environment variables):
+    MEDIWATCH_MODEL_DIR       Promoted model directory, defaults to the one of the repository
+    MEDIWATCH_ASGI_EXECUTOR   'thread' (default) or 'process'
+    MEDIWATCH_ASGI_WORKERS    Size of the executor pool, defaults to the number of CPUs
+    MEDIWATCH_ASGI_MAX_QUEUE  Requests allowed to wait for the pool, defaults to 4 per pool slot
+    MEDIWATCH_MICRO_BATCH     1 to score the rows of concurrent pool threads in one model call
+                              (see model_inference/batching.py), useful with the thread executor
+
+Prometheus metrics are served on /metrics (see model_inference/metrics.py).
+With the process executor the pool processes only report their stage
+timings when PROMETHEUS_MULTIPROC_DIR is set, as gunicorn.conf.py does.
+
+Run with:
+    uvicorn asgiApp:app --host 0.0.0.0 --port 9003
+    gunicorn -k uvicorn.workers.UvicornWorker --workers=4 --bind 0.0.0.0:9003 asgiApp:app
+"""
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from fastapi.templating import Jinja2Templates
+from continuous_training.airflow_local.src.lib.csv_io import decode_csv_to_dataframe
+from continuous_training.airflow_local.src.model_inference.predict import DiabetesReadmissionPredictor
+from continuous_training.airflow_local.src.model_inference.metrics import (QUEUE_DEPTH, REQUEST_ROWS, record_error,
+                                                                         render_metrics, stage_timer, track_request)
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+EXECUTOR_KIND = os.getenv('MEDIWATCH_ASGI_EXECUTOR', 'thread')
+EXECUTOR_WORKERS = int(os.getenv('MEDIWATCH_ASGI_WORKERS', str(os.cpu_count() or 1)))
+MAX_QUEUE = int(os.getenv('MEDIWATCH_ASGI_MAX_QUEUE', str(4 * EXECUTOR_WORKERS)))
+
+MODEL_DIR = os.getenv('MEDIWATCH_MODEL_DIR', os.path.join(os.getcwd(), "continuous_training/airflow_local/src/models/best_model"))
+
+app = FastAPI()
+app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+templates = Jinja2Templates(directory='templates')
+
+# Predictor of this process, created on first use, in each pool process for the process executor
+_predictor = None
+
+
+def _get_predictor():
+    global _predictor
+    if _predictor is None:
+        _predictor = DiabetesReadmissionPredictor(model_dir=MODEL_DIR)
+    return _predictor
+
+
+def _predict_csv(csv_data):
+    """Decode, clean and score a base64 CSV payload. Runs in the executor."""
+    with stage_timer('decode'):
+        input_df = decode_csv_to_dataframe(csv_data)
+    REQUEST_ROWS.labels('/predict').observe(input_df.shape[0])
+    result = _get_predictor().prediction_diabetes_readmission(input_df)
+    return {"Hospital Readmission Prediction": result[0]["Hospital Readmission Prediction"]}
+
+
+class BoundedExecutor:
+    """
+    Executor with a limit on the number of jobs in flight.
+
+    Parameters:
+        kind (str): 'thread' or 'process'.
+        workers (int): Jobs run at the same time.
+        max_queue (int): Jobs allowed to wait for a free worker.
+
+    Attributes:
+        in_flight (int): Jobs running or waiting.
+        limit (int): Maximum value of in_flight, workers + max_queue.
+    """
+    def __init__(self, kind=EXECUTOR_KIND, workers=EXECUTOR_WORKERS, max_queue=MAX_QUEUE):
+        if kind == 'process':
+            self.pool = ProcessPoolExecutor(max_workers=workers)
+        elif kind == 'thread':
+            self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='predict')
+        else:
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.limit = workers + max_queue
+        self.in_flight = 0
+        logger.info(f"Scoring in a {kind} pool of {workers} workers, with up to {max_queue} queued requests")
+
+    def try_acquire(self):
+        # Only called from the event loop thread, no lock needed
+        if self.in_flight >= self.limit:
+            return False
+        self.in_flight += 1
+        QUEUE_DEPTH.labels('asgi_executor').inc()
+        return True
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool. try_acquire must have succeeded first."""
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+        finally:
+            self.in_flight -= 1
+            QUEUE_DEPTH.labels('asgi_executor').dec()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+executor = None
+
+
+@app.on_event('startup')
+async def start_executor():
+    global executor
+    executor = BoundedExecutor()
+
+
+@app.on_event('shutdown')
+async def stop_executor():
+    executor.shutdown()
+
+
+@app.get("/")
+async def home(request: Request):
+    return templates.TemplateResponse('index.html', {'request': request})
+
+
+@app.post("/predict")
+@track_request('/predict')
+async def predictRoute(request: Request):
+    try:
+        # Receiving the body only awaits the client, no pool worker is held meanwhile
+        payload = await request.json()
+        csv_data = payload['csv']
+    except Exception as e:
+        record_error('/predict', 'bad_request')
+        return JSONResponse({"error": f"Expected a JSON body with a base64 'csv' field: {e}"}, status_code=400)
+
+    if not executor.try_acquire():
+        logger.warning(f"Rejecting request, {executor.in_flight} requests already in flight")
+        record_error('/predict', 'server_busy')
+        return JSONResponse({"error": "Server busy, retry later"}, status_code=503, headers={'Retry-After': '1'})
+    result = await executor.run(_predict_csv, csv_data)
+    return JSONResponse(result)
+
+
+@app.get("/metrics")
+async def metricsRoute():
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
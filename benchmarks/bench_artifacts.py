@@ -0,0 +1,112 @@
+"""
+Benchmark of the model artifact formats.
+
+Fits a RandomForestClassifier (the largest model the trainer produces) on
+synthetic data, saves it as gzip (the previous format), uncompressed and,
+when the lz4 package is installed, lz4. Each artifact is then loaded in a
+fresh process with lib.artifacts.load_artifact, the way a gunicorn worker
+loads it, and the benchmark reports:
+
+- file size and dump time
+- load time
+- RSS of the process after loading, split into private memory (copied into
+  each worker) and file-backed shared memory (mapped once through the page
+  cache for every worker), from /proc/self/smaps_rollup on Linux
+
+Usage (from the repository root):
+    python -m benchmarks.bench_artifacts
+    python -m benchmarks.bench_artifacts --rows 100000 --trees 200 --repeat 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from continuous_training.airflow_local.src.lib.artifacts import dump_artifact
+
+FORMATS = {
+    'gzip': ('gzip', 3),
+    'uncompressed': 0,
+    'lz4': ('lz4', 3),
+}
+
+# Run in a fresh interpreter so the measurements only cover loading one artifact
+LOAD_SCRIPT = """
+import json, sys, time
+import numpy as np
+import sklearn.ensemble
+from continuous_training.airflow_local.src.lib.artifacts import load_artifact
+
+def smaps():
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line and not line.startswith('0'))
+    except OSError:
+        return {}
+    kib = lambda name: int(fields.get(name, '0 kB').split()[0])
+    return {'rss_mb': kib('Rss') / 1024,
+            'private_mb': (kib('Private_Clean') + kib('Private_Dirty')) / 1024,
+            'shared_file_mb': (kib('Rss') - kib('Anonymous')) / 1024}
+
+before = smaps()
+start = time.perf_counter()
+model = load_artifact(sys.argv[1])
+load_seconds = time.perf_counter() - start
+# Touch every tree so lazily mapped pages are counted
+model.predict(np.zeros((1, model.n_features_in_)))
+after = smaps()
+print(json.dumps({'load_seconds': load_seconds,
+                  **{key: round(after[key] - before.get(key, 0), 1) for key in after}}))
+"""
+
+
+def fit_model(rows, features, trees):
+    rng = np.random.default_rng(42)
+    X = rng.normal(size=(rows, features))
+    y = (X[:, 0] + rng.normal(scale=2.0, size=rows) > 1.5).astype(int)
+    return RandomForestClassifier(n_estimators=trees, random_state=42, n_jobs=-1).fit(X, y)
+
+
+def load_in_subprocess(path):
+    output = subprocess.run([sys.executable, '-c', LOAD_SCRIPT, path], check=True,
+                            capture_output=True, text=True, cwd=os.getcwd()).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--features', type=int, default=44)
+    parser.add_argument('--trees', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    model = fit_model(args.rows, args.features, args.trees)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, compress in FORMATS.items():
+            path = os.path.join(tmp_dir, f'model_{name}.joblib')
+            start = time.perf_counter()
+            try:
+                entry = dump_artifact(model, path, compress=compress)
+            except (ValueError, ImportError) as e:
+                # lz4 is optional
+                results[name] = {'skipped': str(e)}
+                continue
+            dump_seconds = time.perf_counter() - start
+
+            loads = [load_in_subprocess(path) for _ in range(args.repeat)]
+            best = min(loads, key=lambda load: load['load_seconds'])
+            results[name] = {'size_mb': round(entry['size'] / 2 ** 20, 2),
+                             'dump_seconds': round(dump_seconds, 3),
+                             **{key: round(value, 3) for key, value in best.items()}}
+
+    print(json.dumps({'rows': args.rows, 'trees': args.trees, 'formats': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
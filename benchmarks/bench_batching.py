@@ -0,0 +1,97 @@
+"""
+Throughput and latency of micro-batched scoring vs one model call per request.
+
+Each of --concurrency threads plays a request handler that scores --rows
+encoded rows at a time, --calls times, either directly
+(scaler.transform + model.predict per request) or through a MicroBatcher.
+The model is the promoted best model of --model-dir when given, otherwise a
+RandomForestClassifier and StandardScaler fitted on synthetic data.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_batching
+    python -m benchmarks.bench_batching --model-dir continuous_training/airflow_local/src/models/best_model \\
+        --concurrency 1 4 16 64 --max-wait-ms 5 --max-rows 512
+"""
+import argparse
+import json
+import threading
+import time
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import StandardScaler
+from continuous_training.airflow_local.src.model_inference.batching import MicroBatcher, score_features
+from continuous_training.airflow_local.src.model_inference.registry import LoadedArtifacts, ModelRegistry
+
+
+def synthetic_artifacts(features=44, rows=20000, trees=100):
+    rng = np.random.default_rng(42)
+    X = pd.DataFrame(rng.normal(size=(rows, features)), columns=[f'f{i}' for i in range(features)])
+    y = (X['f0'] + rng.normal(scale=2.0, size=rows) > 1.5).astype(int)
+    scaler = StandardScaler().fit(X)
+    model = RandomForestClassifier(n_estimators=trees, random_state=42).fit(scaler.transform(X), y)
+    return LoadedArtifacts(model=model, scaler=scaler, preprocessor=None, version='synthetic',
+                           loaded_at=time.time(), manifest=None), list(X.columns)
+
+
+def run(score, concurrency, calls, X):
+    latencies = []
+    lock = threading.Lock()
+
+    def handler():
+        local = []
+        for _ in range(calls):
+            start = time.perf_counter()
+            score(X)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=handler) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies)
+    return {
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'rows_per_second': round(len(latencies) * len(X) / elapsed, 1),
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 2),
+        'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model-dir', help="Directory with the promoted best model, synthetic when omitted")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--calls', type=int, default=50, help="Requests per handler thread")
+    parser.add_argument('--rows', type=int, default=10, help="Rows per request")
+    parser.add_argument('--max-rows', type=int, default=512)
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    if args.model_dir:
+        artifacts = ModelRegistry(args.model_dir).get()
+        columns = list(artifacts.scaler.feature_names_in_)
+    else:
+        artifacts, columns = synthetic_artifacts()
+    X = pd.DataFrame(np.random.default_rng(0).normal(size=(args.rows, len(columns))), columns=columns)
+
+    results = []
+    for concurrency in args.concurrency:
+        batcher = MicroBatcher(max_rows=args.max_rows, max_wait=args.max_wait_ms / 1000)
+        direct = run(lambda X: score_features(artifacts, X), concurrency, args.calls, X)
+        batched = run(lambda X: batcher.predict(artifacts, X), concurrency, args.calls, X)
+        batched['mean_batch_rows'] = round(batcher.rows / max(batcher.batches, 1), 1)
+        results.append({'concurrency': concurrency, 'direct': direct, 'micro_batched': batched})
+
+    print(json.dumps({'rows_per_request': args.rows, 'max_rows': args.max_rows,
+                      'max_wait_ms': args.max_wait_ms, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Load benchmark of the prediction API: Flask under gunicorn vs the ASGI app.
+
+Starts each server from the repository root (which must hold a trained model
+in continuous_training/airflow_local/src/models/best_model), posts
+test_data/test_data.csv to /predict from a number of concurrent clients and
+reports throughput, latency percentiles and 503s per concurrency level.
+
+With --slow-clients, that many extra connections upload their body a few
+bytes at a time for the whole run, the way a slow network link does. A sync
+gunicorn worker is blocked while it receives such a body, the ASGI app only
+holds a coroutine.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_serving
+    python -m benchmarks.bench_serving --servers asgi --concurrency 1 8 32 --requests 200 --slow-clients 4
+"""
+import argparse
+import base64
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+
+SERVERS = {
+    'flask': [sys.executable, '-m', 'gunicorn', '--workers={workers}', '--bind', '127.0.0.1:{port}', 'clientApp:app'],
+    'asgi': [sys.executable, '-m', 'gunicorn', '-k', 'uvicorn.workers.UvicornWorker', '--workers={workers}',
+             '--bind', '127.0.0.1:{port}', 'asgiApp:app'],
+}
+
+
+def wait_for_port(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server did not start listening on port {port}")
+
+
+def slow_upload(port, body, stop, bytes_per_second=200):
+    """Upload body to /predict a few bytes at a time until stop is set."""
+    while not stop.is_set():
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=30) as sock:
+                sock.sendall((f"POST /predict HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                              f"Content-Length: {len(body)}\r\n\r\n").encode())
+                for start in range(0, len(body), 20):
+                    if stop.is_set():
+                        return
+                    sock.sendall(body[start:start + 20])
+                    time.sleep(20 / bytes_per_second)
+                sock.recv(65536)
+        except OSError:
+            time.sleep(0.1)
+
+
+def run_level(url, payload, concurrency, total, timeout=10):
+    def one(_):
+        start = time.perf_counter()
+        try:
+            status = requests.post(url, json=payload, timeout=timeout).status_code
+        except requests.exceptions.RequestException:
+            # Counted as a timeout, e.g. every worker is busy receiving slow uploads
+            status = None
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, status in results if status == 200])
+    return {
+        'concurrency': concurrency,
+        'requests_per_second': round(total / elapsed, 1),
+        'ok': int(len(latencies)),
+        'rejected_503': sum(1 for _, status in results if status == 503),
+        'timeouts': sum(1 for _, status in results if status is None),
+        'errors': sum(1 for _, status in results if status not in (200, 503, None)),
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 1) if len(latencies) else None,
+        'p95_ms': round(float(np.percentile(latencies, 95)) * 1000, 1) if len(latencies) else None,
+    }
+
+
+def bench_server(name, args, payload):
+    port = args.port
+    command = [part.format(workers=args.workers, port=port) for part in SERVERS[name]]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    stop = threading.Event()
+    try:
+        wait_for_port(port)
+        url = f"http://127.0.0.1:{port}/predict"
+        # Warm up every worker so model loading is not measured
+        run_level(url, payload, args.workers, 4 * args.workers)
+
+        body = json.dumps(payload).encode()
+        slow_threads = [threading.Thread(target=slow_upload, args=(port, body, stop), daemon=True)
+                        for _ in range(args.slow_clients)]
+        for thread in slow_threads:
+            thread.start()
+        time.sleep(0.5 if slow_threads else 0)
+
+        return [run_level(url, payload, concurrency, args.requests, args.timeout) for concurrency in args.concurrency]
+    finally:
+        stop.set()
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', nargs='+', default=list(SERVERS), choices=list(SERVERS))
+    parser.add_argument('--workers', type=int, default=4, help="Server worker processes")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument('--slow-clients', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=10, help="Client timeout per request in seconds")
+    parser.add_argument('--csv', default='test_data/test_data.csv')
+    parser.add_argument('--port', type=int, default=9103)
+    args = parser.parse_args()
+
+    with open(args.csv, 'rb') as f:
+        payload = {'csv': base64.b64encode(f.read()).decode()}
+
+    results = {name: bench_server(name, args, payload) for name in args.servers}
+    print(json.dumps({'workers': args.workers, 'slow_clients': args.slow_clients, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Import-time regression check of the serving entry points.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter for
+each serving module and fails (exit code 1) when:
+
+- a training or monitoring package is imported (Evidently, LazyPredict,
+  TensorFlow, torch, transformers, matplotlib, seaborn, plotly), or
+- the cumulative import time exceeds --budget seconds.
+
+The slowest top-level imports are printed, so a regression points at its
+cause.
+
+Usage (from the repository root):
+    python -m benchmarks.check_import_time
+    python -m benchmarks.check_import_time --modules clientApp --budget 3
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+
+SERVING_MODULES = ['clientApp', 'asgiApp']
+
+FORBIDDEN_PACKAGES = {'evidently', 'lazypredict', 'tensorflow', 'torch', 'transformers',
+                      'matplotlib', 'seaborn', 'plotly'}
+
+_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def import_profile(module):
+    """Return (cumulative microseconds, nesting level, name) of every import made by importing module."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True).stderr
+    profile = []
+    for line in stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            profile.append((int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+    return profile
+
+
+def check(module, budget):
+    profile = import_profile(module)
+    total = next(us for us, _, name in profile if name == module) / 1e6
+    forbidden = sorted({name.split('.')[0] for _, _, name in profile} & FORBIDDEN_PACKAGES)
+    slowest = sorted(((us, name) for us, level, name in profile if level == 1), reverse=True)[:8]
+    return {
+        'module': module,
+        'seconds': round(total, 3),
+        'budget_seconds': budget,
+        'forbidden_imports': forbidden,
+        'slowest': {name: round(us / 1e6, 3) for us, name in slowest},
+        'ok': total <= budget and not forbidden,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', nargs='+', default=SERVING_MODULES)
+    parser.add_argument('--budget', type=float, default=5.0, help="Maximum import time in seconds")
+    args = parser.parse_args()
+
+    results = [check(module, args.budget) for module in args.modules]
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if all(result['ok'] for result in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""
+End-to-end benchmark suite of cleaning, training, prediction and the /predict route.
+
+For each size (1k, 100k or 10m rows) a synthetic diabetic_data.csv-shaped
+dataset is generated (see benchmarks/synthetic.py) and the suite measures:
+
+- clean:   clean.clean_data on the whole dataset, fitting the preprocessor
+- train:   DiabetesReadmissionTrainer.train_and_evaluate_model with a fast
+           subset of the LazyPredict candidates (--candidates)
+- predict: DiabetesReadmissionPredictor.prediction_diabetes_readmission on
+           the whole dataset, with the model trained above
+- route:   /predict of clientApp under gunicorn, posting --route-rows rows per
+           request from --concurrency clients, with the model trained above
+
+Each benchmark runs in a fresh process and reports wall time, rows per second
+and the peak RSS of the measured step (Linux resets the peak through
+/proc/self/clear_refs, elsewhere it is the peak of the whole process), plus
+the largest peak RSS of its child processes. For the route, rows per second
+counts the rows of successful requests and the peak RSS is the largest of the
+gunicorn workers.
+
+The results are saved to benchmarks/results/<commit>.json (with a -dirty
+suffix for uncommitted changes) together with the library versions, and
+--compare prints the ratio of each measure to an earlier result file.
+
+The 10m size needs tens of GB of memory for the in-memory steps, it is not run
+by default.
+
+Usage (from the repository root):
+    python -m benchmarks.suite
+    python -m benchmarks.suite --sizes 1k 100k 10m --benchmarks clean predict
+    python -m benchmarks.suite --compare benchmarks/results/3f2a9c1.json
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+SIZES = {'1k': 1000, '100k': 100000, '10m': 10000000}
+BENCHMARKS = ['clean', 'train', 'predict', 'route']
+# Quick LazyPredict candidates, Logistic Regression and Random Forest are always trained
+FAST_CANDIDATES = ['DecisionTreeClassifier', 'GaussianNB', 'RidgeClassifier', 'BernoulliNB']
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_mb(pid='self'):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid != 'self':
+        return None
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def measure(fn, rows):
+    """Run fn once and return its wall time, throughput, peak RSS and the peak RSS of its child processes."""
+    import resource
+    _reset_peak_rss()
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    # The trainer fits its candidates in worker processes
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {
+        'seconds': round(seconds, 3),
+        'rows': rows,
+        'rows_per_second': round(rows / seconds, 1),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'children_peak_rss_mb': round(children_peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+    }
+
+
+def bench_clean(args):
+    import pandas as pd
+    from continuous_training.airflow_local.src.data_cleaning.clean import clean
+    from continuous_training.airflow_local.src.data_cleaning.common import PROFILE_OFF
+    df = pd.read_csv(args.data)
+    return measure(lambda: clean(df=df, profile_level=PROFILE_OFF).clean_data(), df.shape[0])
+
+
+def bench_train(args):
+    from continuous_training.airflow_local.src.model_training import train
+    # Measure cold training, the prepared data cache would otherwise skip the cleaning
+    shutil.rmtree(os.path.join(os.path.dirname(args.data), '.clean_cache'), ignore_errors=True)
+    shutil.rmtree(args.model_root, ignore_errors=True)
+    os.makedirs(args.model_root)
+    excluded = [name for name, _ in train.CLASSIFIERS if name not in args.candidates]
+    trainer = train.DiabetesReadmissionTrainer(args.data, None, args.model_root, n_workers=1, top_k=1,
+                                               excluded_candidates=excluded)
+    result = measure(trainer.train_and_evaluate_model, args.rows)
+    with open(os.path.join(args.model_root, 'best_model', 'candidate_search.json')) as f:
+        result['best_model'] = json.load(f).get('best_model')
+    return result
+
+
+def _clear_new_data(args):
+    # Stored encounters are skipped by the new data store and the prediction log, start empty on every run
+    shutil.rmtree(os.path.join(os.path.dirname(args.model_root), 'new_data'), ignore_errors=True)
+
+
+def bench_predict(args):
+    import pandas as pd
+    from continuous_training.airflow_local.src.model_inference.predict import DiabetesReadmissionPredictor
+    _clear_new_data(args)
+    df = pd.read_csv(args.data)
+    predictor = DiabetesReadmissionPredictor(model_dir=os.path.join(args.model_root, 'best_model'),
+                                             prediction_cache=False)
+    # Load the model outside of the measurement, like a warm worker
+    predictor.registry.get()
+    return measure(lambda: predictor.prediction_diabetes_readmission(df), df.shape[0])
+
+
+def _worker_pids(pid):
+    pids = []
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return pids
+
+
+def bench_route(args):
+    import pandas as pd
+    from benchmarks.bench_serving import run_level, wait_for_port
+    _clear_new_data(args)
+    sample = pd.read_csv(args.data, nrows=args.route_rows)
+    payload = {'csv': base64.b64encode(sample.to_csv(index=False).encode()).decode()}
+    env = dict(os.environ, MEDIWATCH_MODEL_DIR=os.path.join(args.model_root, 'best_model'),
+               MEDIWATCH_PREDICTION_CACHE='0', PROMETHEUS_MULTIPROC_DIR=os.path.join(args.model_root, 'metrics'))
+    command = [sys.executable, '-m', 'gunicorn', f'--workers={args.workers}', '--bind', f'127.0.0.1:{args.port}',
+               'clientApp:app']
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(args.port)
+        url = f'http://127.0.0.1:{args.port}/predict'
+        # Warm up every worker so model loading is not measured
+        run_level(url, payload, args.workers, 4 * args.workers, timeout=120)
+        levels = []
+        for concurrency in args.concurrency:
+            start = time.perf_counter()
+            level = run_level(url, payload, concurrency, args.requests, timeout=120)
+            level['rows_per_second'] = round(level['ok'] * sample.shape[0] / (time.perf_counter() - start), 1)
+            levels.append(level)
+        worker_peaks = [_peak_rss_mb(pid) for pid in _worker_pids(server.pid)]
+        worker_peaks = [peak for peak in worker_peaks if peak is not None]
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        'rows_per_request': sample.shape[0],
+        'workers': args.workers,
+        'levels': levels,
+        'peak_rss_mb': round(max(worker_peaks), 1) if worker_peaks else None,
+    }
+
+
+RUNNERS = {'clean': bench_clean, 'train': bench_train, 'predict': bench_predict, 'route': bench_route}
+
+
+def run_in_subprocess(name, data, rows, model_root, args):
+    """Run one benchmark in a fresh interpreter and return its result."""
+    command = [sys.executable, '-m', 'benchmarks.suite', '--run-one', name, '--data', data, '--rows', str(rows),
+               '--model-root', model_root, '--workers', str(args.workers), '--port', str(args.port),
+               '--route-rows', str(args.route_rows), '--requests', str(args.requests),
+               '--concurrency', *map(str, args.concurrency), '--candidates', *args.candidates]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'failed'}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f"{commit}-dirty" if dirty else commit
+
+
+def environment():
+    import numpy
+    import pandas
+    import sklearn
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': numpy.__version__,
+        'pandas': pandas.__version__,
+        'scikit-learn': sklearn.__version__,
+    }
+
+
+def compare(results, baseline):
+    """Print the ratio of the seconds and peak RSS of each benchmark to the baseline."""
+    print(f"Compared with {baseline['commit']} (ratio > 1 is slower or larger):")
+    for size, benchmarks in results['results'].items():
+        for name, result in benchmarks.items():
+            previous = baseline['results'].get(size, {}).get(name)
+            if not previous or 'error' in result or 'error' in previous:
+                continue
+            if name == 'route':
+                current_rate = [level['rows_per_second'] for level in result['levels']]
+                previous_rate = [level['rows_per_second'] for level in previous['levels']]
+                ratios = [round(p / c, 2) if c else None for c, p in zip(current_rate, previous_rate)]
+                print(f"  {size:>5} {name:<8} time per row x{ratios}")
+            else:
+                print(f"  {size:>5} {name:<8} time x{result['seconds'] / previous['seconds']:.2f}  "
+                      f"peak RSS x{result['peak_rss_mb'] / previous['peak_rss_mb']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['1k', '100k'], choices=list(SIZES))
+    parser.add_argument('--benchmarks', nargs='+', default=BENCHMARKS, choices=BENCHMARKS)
+    parser.add_argument('--candidates', nargs='+', default=FAST_CANDIDATES,
+                        help="LazyPredict classifiers trained next to Logistic Regression and Random Forest")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'mediwatch_bench'),
+                        help="Synthetic datasets and trained models")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn workers of the route benchmark")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--requests', type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument('--route-rows', type=int, default=100, help="Rows per /predict request")
+    parser.add_argument('--port', type=int, default=9104)
+    parser.add_argument('--output', help="Result file, benchmarks/results/<commit>.json by default")
+    parser.add_argument('--compare', help="Earlier result file to compare with")
+    # Internal: run a single benchmark in this process
+    parser.add_argument('--run-one', choices=BENCHMARKS, help=argparse.SUPPRESS)
+    parser.add_argument('--data', help=argparse.SUPPRESS)
+    parser.add_argument('--rows', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--model-root', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        import logging
+        logging.disable(logging.WARNING)
+        print(json.dumps(RUNNERS[args.run_one](args)))
+        return
+
+    from benchmarks.synthetic import synthetic_dataset
+    commit = git_revision()
+    results = {'commit': commit, 'created_at': datetime.now().isoformat(timespec='seconds'),
+               'environment': environment(), 'results': {}}
+    for size in args.sizes:
+        rows = SIZES[size]
+        data = synthetic_dataset(os.path.join(args.workdir, 'data'), rows)
+        model_root = os.path.join(args.workdir, size, 'models')
+        results['results'][size] = {}
+        for name in args.benchmarks:
+            print(f"Running {name} on {size} rows ...", file=sys.stderr)
+            results['results'][size][name] = run_in_subprocess(name, data, rows, model_root, args)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Saved to {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
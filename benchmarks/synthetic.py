@@ -0,0 +1,81 @@
+"""
+Synthetic diabetic_data.csv-shaped datasets of any size.
+
+Every column is sampled independently from its empirical distribution in the
+bundled diabetic_data.csv, so the schema, the categories, the '?' markers and
+the share of rows dropped by cleaning match the real data. encounter_id is
+unique and patient_nbr repeats at about the real rate (0.7 patients per
+encounter). Rows are generated and written in chunks, so a 10M-row file
+never has to fit in memory.
+
+The files are cached by size and seed in the data directory.
+
+Usage (from the repository root):
+    python -m benchmarks.synthetic --rows 100000 --out /tmp/diabetic_100k.csv
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from benchmarks.bench_clean import load_dataset
+
+# Patients per encounter in diabetic_data.csv (71518 / 101766)
+PATIENTS_PER_ENCOUNTER = 0.7
+CHUNK_ROWS = 250000
+
+
+def generate_chunk(source_df, rows, rng, first_encounter_id, patients):
+    columns = {}
+    for col in source_df.columns:
+        values = source_df[col].to_numpy()
+        columns[col] = values[rng.integers(0, len(values), rows)]
+    columns['encounter_id'] = np.arange(first_encounter_id, first_encounter_id + rows)
+    columns['patient_nbr'] = rng.integers(1, patients + 1, rows)
+    return pd.DataFrame(columns, columns=source_df.columns)
+
+
+def write_synthetic_csv(path, rows, seed=42, source_df=None, chunk_rows=CHUNK_ROWS):
+    """
+    Write a synthetic dataset of the given number of rows to path.
+
+    Args:
+        path (str): Output CSV file, written to a temporary file and moved into place.
+        rows (int): Number of encounters.
+        seed (int): Seed of the random generator, the same seed gives the same file.
+        source_df (pandas.DataFrame, optional): Real data to sample from, the bundled dataset by default.
+        chunk_rows (int): Rows generated and written at a time.
+
+    Returns:
+        str: path
+    """
+    source_df = load_dataset() if source_df is None else source_df
+    rng = np.random.default_rng(seed)
+    patients = max(int(rows * PATIENTS_PER_ENCOUNTER), 1)
+    tmp_path = f"{path}.tmp"
+    for start in range(0, rows, chunk_rows):
+        chunk = generate_chunk(source_df, min(chunk_rows, rows - start), rng, start + 1, patients)
+        chunk.to_csv(tmp_path, mode='w' if start == 0 else 'a', header=(start == 0), index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def synthetic_dataset(data_dir, rows, seed=42):
+    """Return the path of the cached synthetic dataset of rows encounters, generating it if needed."""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"diabetic_data_{rows}_{seed}.csv")
+    if not os.path.exists(path):
+        write_synthetic_csv(path, rows, seed)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, required=True)
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    write_synthetic_csv(args.out, args.rows, args.seed)
+
+
+if __name__ == '__main__':
+    main()
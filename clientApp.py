@@ -1,8 +1,13 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 import os
+import json
+import itertools
+import pandas as pd
 from flask_cors import CORS, cross_origin
-from continuous_training.airflow_local.src.lib.utils import decodeCSV
+from continuous_training.airflow_local.src.lib.csv_io import decode_csv_to_dataframe, read_csv_chunks
 from continuous_training.airflow_local.src.model_inference.predict import DiabetesReadmissionPredictor
+from continuous_training.airflow_local.src.model_inference.metrics import (REQUEST_ROWS, record_error, render_metrics,
+                                                                         stage_timer, track_request)
 # from continuous_training.airflow_local.src.model_training.train import DiabetesReadmissionTrainer
 # from continuous_training.airflow_local.src.lib.utils import trigger_dag
 import logging
@@ -10,6 +15,12 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Promoted model served by this app, the benchmarks point it at their own model
+MODEL_DIR = os.getenv('MEDIWATCH_MODEL_DIR', os.path.join(os.getcwd(), "continuous_training/airflow_local/src/models/best_model"))
+
+# Rows cleaned and scored at a time by /predict_batch
+BATCH_CHUNK_ROWS = int(os.getenv('MEDIWATCH_BATCH_CHUNK_ROWS', '5000'))
+
 os.putenv('LANG', 'en_US.UTF-8')
 os.putenv('LC_ALL', 'en_US.UTF-8')
 
@@ -20,12 +31,14 @@ CORS(app)
 #@cross_origin()
 class ClientApp:
     def __init__(self):
-        self.filename = "test_data.csv"
-        self.predictor = DiabetesReadmissionPredictor(self.filename, os.path.join(os.getcwd(), "continuous_training/airflow_local/src/models/best_model"))
+        self.predictor = DiabetesReadmissionPredictor(model_dir=MODEL_DIR)
         # self.trainer = DiabetesReadmissionTrainer(os.path.join(os.getcwd(), "src/input_data/dataset_diabetes/diabetic_data.csv"), 
         #                                           self.filename, 
         #                                           os.path.join(os.getcwd(), "src/models"))
 
+# One ClientApp per gunicorn worker: the predictor keeps the model in memory between requests
+client_app = ClientApp()
+
 @app.route("/", methods=['GET'])
 @cross_origin()
 def home():
@@ -34,11 +47,14 @@ def home():
 
 @app.route("/predict", methods=['POST'])
 @cross_origin()
+@track_request('/predict')
 def predictRoute():
     csv_data = request.json['csv']
-    client_app = ClientApp()
-    decodeCSV(csv_data, client_app.filename)
-    result = client_app.predictor.prediction_diabetes_readmission()
+    # Parse the upload once in memory, nothing is written to a shared file
+    with stage_timer('decode'):
+        input_df = decode_csv_to_dataframe(csv_data)
+    REQUEST_ROWS.labels('/predict').observe(input_df.shape[0])
+    result = client_app.predictor.prediction_diabetes_readmission(input_df)
     # Ensure the result is in the correct format
     formatted_result = {
         "Hospital Readmission Prediction": result[0]["Hospital Readmission Prediction"]
@@ -46,6 +62,77 @@ def predictRoute():
     return jsonify(formatted_result)
 
 
+@app.route("/predict_batch", methods=['POST'])
+@cross_origin()
+@track_request('/predict_batch')
+def predictBatchRoute():
+    """
+    Score a raw CSV upload in chunks and stream the predictions back.
+
+    The request body is the CSV file itself, optionally gzip compressed
+    (Content-Encoding: gzip or Content-Type: application/gzip). Predictions are
+    streamed as NDJSON, one record per line, or as CSV with ?format=csv or
+    Accept: text/csv. Only one chunk of BATCH_CHUNK_ROWS rows is in memory at a time.
+    """
+    gzip_types = ('application/gzip', 'application/x-gzip')
+    compression = None
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip' or request.mimetype in gzip_types:
+        compression = 'gzip'
+    as_csv = request.args.get('format') == 'csv' or (
+        request.args.get('format') is None and request.accept_mimetypes.best == 'text/csv')
+
+    # Score the first chunk before answering so malformed uploads get a 400 instead of a broken stream
+    try:
+        chunks = client_app.predictor.score_chunks(read_csv_chunks(request.stream, BATCH_CHUNK_ROWS, compression))
+        first_result = next(chunks, None)
+    except (ValueError, KeyError, OSError, pd.errors.ParserError) as e:
+        logger.warning(f"Rejected batch upload: {e}")
+        record_error('/predict_batch', e)
+        return jsonify({"error": f"Could not score the uploaded CSV: {e}"}), 400
+
+    def generate():
+        if first_result is None:
+            return
+        rows = 0
+        for i, result_df in enumerate(itertools.chain([first_result], chunks)):
+            rows += result_df.shape[0]
+            if as_csv:
+                yield result_df.to_csv(index=False, header=(i == 0))
+            else:
+                yield result_df.to_json(orient='records', lines=True).rstrip('\n') + '\n'
+        REQUEST_ROWS.labels('/predict_batch').observe(rows)
+        logger.info(f"Streamed predictions for {rows} rows")
+
+    def generate_safely():
+        try:
+            yield from generate()
+        except Exception as e:
+            # Headers are already sent, the error can only be reported in the body
+            logger.exception("Batch scoring failed mid-stream")
+            record_error('/predict_batch', e)
+            if not as_csv:
+                yield json.dumps({"error": f"Scoring stopped: {e}"}) + '\n'
+
+    mimetype = 'text/csv' if as_csv else 'application/x-ndjson'
+    return Response(stream_with_context(generate_safely()), mimetype=mimetype)
+
+
+@app.route("/cache_stats", methods=['GET'])
+@cross_origin()
+def cacheStatsRoute():
+    cache = client_app.predictor.prediction_cache
+    if cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **cache.stats()})
+
+
+@app.route("/metrics", methods=['GET'])
+def metricsRoute():
+    # Aggregated over every gunicorn worker when PROMETHEUS_MULTIPROC_DIR is set, see gunicorn.conf.py
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
 # @app.route("/train", methods=['POST'])
 # @cross_origin()
 # def trainRoute():
@@ -82,6 +169,5 @@ def predictRoute():
 
 #port = int(os.getenv("PORT"))
 if __name__ == "__main__":
-    clApp = ClientApp()
     #app.run(host='0.0.0.0', port=port)
     app.run(host='0.0.0.0', port=9003, debug=True)
@@ -1,14 +1,45 @@
+import os
 from airflow.models import DAG
 from datetime import datetime, timedelta
-from airflow.operators.python_operator import PythonOperator
-from src.model_training.train import DiabetesReadmissionTrainer
+from airflow.operators.python_operator import PythonOperator, ShortCircuitOperator
+from src.model_training.train import DiabetesReadmissionTrainer, candidate_families
+from src.lib.new_data_store import compact_new_data
+from src.data_cleaning.snapshot import is_snapshot
 
 TRAINING_DATA_PATH = "/home/ubuntu/mediwatch_capstone_2024/continuous_training/airflow_local/src/input_data/dataset_diabetes/diabetic_data.csv"
 
 NEW_DATA_PATH = "/home/ubuntu/mediwatch_capstone_2024/continuous_training/airflow_local/src/new_data/new_data.csv"
 
+# TRAINING_DATA_PATH and NEW_DATA_PATH may also be Parquet snapshot directories, see src/data_cleaning/snapshot.py
+
 MODEL_PATH = "/home/ubuntu/mediwatch_capstone_2024/continuous_training/airflow_local/src/models/best_model"
 
+# Candidate models trained at the same time, None uses every CPU of the worker
+TRAINING_WORKERS = None
+
+# Seconds a candidate model may train before it is cancelled, None for no limit
+CANDIDATE_TIME_BUDGET = 1800
+
+# LazyPredict models kept after the candidate search
+TOP_K_CANDIDATES = 3
+
+# LazyPredict estimators left out of the candidate search
+EXCLUDED_CANDIDATES = []
+
+# Rows per chunk to clean the training data out of core, None cleans it in memory
+CLEAN_CHUNK_ROWS = None
+
+# Inclusive ingest date range (YYYY-MM-DD) read from snapshot inputs, None for no bound
+TRAINING_START_DATE = None
+TRAINING_END_DATE = None
+
+# 'auto' folds the new rows into the promoted model when it supports it and no full retrain is due,
+# 'full' always retrains every candidate, 'incremental' never does
+RETRAIN_MODE = 'auto'
+
+# Tasks the LazyPredict estimators are split into, trained in parallel on the available workers
+LAZY_CLASSIFIER_SHARDS = 3
+
 default_args = {
     'owner': 'airflow',
     'depends_on_past': False,
@@ -26,38 +57,133 @@ dg = DAG('patient-readmission-model-retraining',
           catchup=False
           )
 
-def run_trainer(**kwargs):
+def build_trainer(kwargs):
+    """Trainer of this DAG run, the stages of every task share the model_dir/pipeline work directory."""
     dag_run = kwargs.get('dag_run')
     if dag_run and dag_run.conf:
-        #original_data_filename = dag_run.conf.get('original_data_filename', cfg.TRAINING_DATA_PATH)
-        original_data_filename = kwargs['dag_run'].conf['original_data_filename']
-        #new_data_filename = dag_run.conf.get('new_data_filename', cfg.NEW_DATA_PATH)
-        new_data_filename = kwargs['dag_run'].conf['new_data_filename']
-        #model_dir = dag_run.conf.get('model_dir', cfg.MODEL_PATH)
-        model_dir = kwargs['dag_run'].conf['model_dir']
+        original_data_filename = dag_run.conf['original_data_filename']
+        new_data_filename = dag_run.conf['new_data_filename']
+        model_dir = dag_run.conf['model_dir']
+        conf = dag_run.conf
     else:
         original_data_filename = TRAINING_DATA_PATH
         new_data_filename = NEW_DATA_PATH
         model_dir = MODEL_PATH
-    # original_data_filename = kwargs['dag_run'].conf['original_data_filename']
-    # new_data_filename = kwargs['dag_run'].conf['new_data_filename']
-    # # bucket_name = kwargs['dag_run'].conf['bucket_name']
-    # model_dir = kwargs['dag_run'].conf['model_dir']
-    
-    trainer = DiabetesReadmissionTrainer(
+        conf = {}
+    return DiabetesReadmissionTrainer(
         original_data_filename=original_data_filename,
         new_data_filename=new_data_filename,
-        model_dir=model_dir
+        model_dir=model_dir,
+        n_workers=conf.get('n_workers', TRAINING_WORKERS),
+        candidate_time_budget=conf.get('candidate_time_budget', CANDIDATE_TIME_BUDGET),
+        top_k=conf.get('top_k', TOP_K_CANDIDATES),
+        excluded_candidates=conf.get('excluded_candidates', EXCLUDED_CANDIDATES),
+        clean_chunk_rows=conf.get('clean_chunk_rows', CLEAN_CHUNK_ROWS),
+        start_date=conf.get('start_date', TRAINING_START_DATE),
+        end_date=conf.get('end_date', TRAINING_END_DATE),
+        lazy_shards=LAZY_CLASSIFIER_SHARDS
     )
-    
-    result = trainer.train_and_evaluate_model()
-    return result
 
-retrain_model = PythonOperator(
-    task_id='retrain_model',
-    python_callable=run_trainer,
+# Each task runs one stage of the trainer. Stages exchange their outputs through files in
+# model_dir/pipeline, not XCom, and skip themselves when their inputs did not change, so a
+# retried or rerun DAG only redoes what changed. Workers on separate hosts need model_dir
+# on a shared filesystem.
+
+def run_incremental_update(**kwargs):
+    """Fold the new rows into the promoted model, return True when the full retrain tasks have to run."""
+    trainer = build_trainer(kwargs)
+    conf = kwargs['dag_run'].conf if kwargs.get('dag_run') and kwargs['dag_run'].conf else {}
+    mode = conf.get('mode', RETRAIN_MODE)
+    # Merge the segments appended by the prediction service into new_data.csv, snapshots are already merged
+    if trainer.new_data_filename and not is_snapshot(trainer.new_data_filename):
+        compact_new_data(trainer.new_data_filename)
+    if mode == 'full':
+        return True
+    # The monitoring job sets drift_detected when a drift test failed
+    result = trainer.update_incremental(drift_detected=conf.get('drift_detected', False))
+    if result is None and mode == 'incremental':
+        raise RuntimeError("The promoted model cannot be updated incrementally, trigger a full retrain")
+    return result is None
+
+def run_clean_original(**kwargs):
+    return build_trainer(kwargs).clean_original()['rows']
+
+def run_clean_new(**kwargs):
+    trainer = build_trainer(kwargs)
+    # Compacted by incremental_update, there is no new data before the first prediction
+    if trainer.new_data_filename and not os.path.exists(trainer.new_data_filename):
+        trainer.new_data_filename = None
+    return trainer.clean_new()['rows']
+
+def run_build_features(**kwargs):
+    return build_trainer(kwargs).build_features()['rows']
+
+def run_train_family(family, **kwargs):
+    return sorted(build_trainer(kwargs).train_family(family)['results'])
+
+def run_evaluate(**kwargs):
+    return build_trainer(kwargs).evaluate()['best_model_name']
+
+def run_promote(**kwargs):
+    return build_trainer(kwargs).promote()
+
+# Skips every other task when the new rows were folded into the promoted model
+incremental_update = ShortCircuitOperator(
+    task_id='incremental_update',
+    python_callable=run_incremental_update,
+    provide_context=True,
+    dag=dg
+)
+
+clean_original = PythonOperator(
+    task_id='clean_original',
+    python_callable=run_clean_original,
+    provide_context=True,
+    dag=dg
+)
+
+clean_new = PythonOperator(
+    task_id='clean_new',
+    python_callable=run_clean_new,
+    provide_context=True,
+    dag=dg
+)
+
+build_features = PythonOperator(
+    task_id='build_features',
+    python_callable=run_build_features,
+    provide_context=True,
+    dag=dg
+)
+
+# One task per family, the number of shards is fixed when the DAG is parsed
+train_families = [
+    PythonOperator(
+        task_id=f'train_{family}',
+        python_callable=run_train_family,
+        op_kwargs={'family': family},
+        provide_context=True,
+        dag=dg
+    )
+    for family in candidate_families(LAZY_CLASSIFIER_SHARDS)
+]
+
+# Families that failed are left out of the evaluation, the others still compete
+evaluate = PythonOperator(
+    task_id='evaluate',
+    python_callable=run_evaluate,
+    provide_context=True,
+    trigger_rule='all_done',
+    dag=dg
+)
+
+promote = PythonOperator(
+    task_id='promote',
+    python_callable=run_promote,
     provide_context=True,
     dag=dg
 )
 
-retrain_model
\ No newline at end of file
+incremental_update >> [clean_original, clean_new]
+[clean_original, clean_new] >> build_features >> train_families
+train_families >> evaluate >> promote
@@ -0,0 +1,105 @@
+"""
+Content-addressed cache of prepared datasets.
+
+Cleaning the full `diabetic_data.csv` is repeated by every monitoring run
+(`get_reference_data`) and every retrain. `load_prepared_data` stores the
+output of `clean.prepare_data` as an uncompressed Feather file keyed by:
+
+- the SHA-256 of the source file, and
+- a version of the cleaning code, the hash of the modules prepare_data runs
+  (clean.py, recode.py, schema.py) together with the pandas version.
+
+The cache therefore rebuilds by itself when either the input or the cleaning
+logic changes, and older entries of the same source are removed. Cached
+files are read through a memory map. Parquet snapshots are already cheap to
+read and are prepared without a cache.
+
+Example:
+    prepared_df = load_prepared_data('diabetic_data.csv')
+    cleaned_df = clean(df=prepared_df).encode_data(preprocessor)
+"""
+import os
+import glob
+import hashlib
+import pandas as pd
+import pyarrow.feather as feather
+from . import clean as clean_module
+from . import recode as recode_module
+from . import schema as schema_module
+from .snapshot import is_snapshot
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CACHE_DIR_NAME = '.clean_cache'
+
+# Modules whose code decides the output of clean.prepare_data
+CLEANING_MODULES = [clean_module, recode_module, schema_module]
+
+_HASH_CHUNK = 1 << 20
+
+
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file, read in 1 MiB chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cleaning_code_version():
+    """Return a hash of the cleaning code and the pandas version it runs on."""
+    digest = hashlib.sha256(pd.__version__.encode('utf-8'))
+    for module in CLEANING_MODULES:
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def cache_path_for(source_path, cache_dir=None):
+    """Return the cache file of the current content of source_path and cleaning code."""
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(source_path)), CACHE_DIR_NAME)
+    name = os.path.basename(source_path)
+    return os.path.join(cache_dir, f"{name}.{file_digest(source_path)[:16]}.{cleaning_code_version()[:12]}.feather")
+
+
+def load_prepared_data(source_path, cache_dir=None):
+    """
+    Return clean(source_path).prepare_data(), from the cache when it is up to date.
+
+    Args:
+        source_path (str): Raw CSV file, e.g. diabetic_data.csv, or a Parquet snapshot
+        cache_dir (str, optional): Cache directory. Defaults to a .clean_cache
+            directory next to the source file.
+
+    Returns:
+        pandas.DataFrame: The prepared data, with the row index of the source file
+    """
+    if is_snapshot(source_path):
+        return clean_module.clean(source_path).prepare_data()
+
+    cache_path = cache_path_for(source_path, cache_dir)
+
+    if os.path.exists(cache_path):
+        logger.info(f"Loading prepared data for {source_path} from cache {cache_path}")
+        return feather.read_feather(cache_path, memory_map=True)
+
+    logger.info(f"No up-to-date cache for {source_path}, preparing it ..........")
+    prepared_df = clean_module.clean(source_path).prepare_data()
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    # Uncompressed so the file can be memory-mapped, the index keeps the source row numbers
+    feather.write_feather(prepared_df, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, cache_path)
+
+    # Entries for an older version of this source or of the cleaning code are never read again
+    prefix = os.path.join(os.path.dirname(cache_path), f"{os.path.basename(source_path)}.")
+    for stale_path in glob.glob(f"{prefix}*.feather"):
+        if stale_path != cache_path:
+            os.remove(stale_path)
+
+    logger.info(f"Cached prepared data for {source_path} in {cache_path}")
+    return prepared_df
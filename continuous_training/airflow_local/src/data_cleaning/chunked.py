@@ -0,0 +1,138 @@
+"""
+Out-of-core cleaning of training files that do not fit in memory.
+
+`clean` reads the whole CSV into one DataFrame and every cleaning step copies
+it, so peak memory is several times the size of the raw file.
+`clean_csv_in_chunks` streams the files, CSV or Parquet snapshots, instead,
+in two passes over chunks of `chunk_rows` rows:
+
+1. Plan: every chunk is read with the dtypes of `schema.RAW_SCHEMA` and run
+   through `clean.prepare_data`. The pass records the dtype of each prepared
+   column and, unless a fitted preprocessor is given, fits a
+   `DiabetesPreprocessor` with `partial_fit`, which only keeps value counts.
+2. Encode: the files are read again, each chunk is prepared, encoded with
+   the fitted preprocessor, cast to the dtypes of the whole data and appended
+   to a Parquet file as one row group.
+
+Peak memory is a few copies of one chunk. The Parquet file holds the same
+values, dtypes and row index as
+`preprocessor.transform(clean(filename).prepare_data())`.
+
+Example:
+    result = clean_csv_in_chunks(['diabetic_data.csv', 'new_data.csv'], 'train.parquet')
+    train_df = pd.read_parquet(result.path)
+"""
+import os
+from collections import namedtuple
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .clean import clean
+from .common import PROFILE_OFF
+from .preprocessor import DiabetesPreprocessor
+from .schema import is_categorical
+from .snapshot import read_raw_data
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_CHUNK_ROWS = int(os.getenv('MEDIWATCH_CLEAN_CHUNK_ROWS', '100000'))
+
+ChunkedCleanResult = namedtuple('ChunkedCleanResult', ['path', 'preprocessor', 'rows', 'chunks'])
+
+
+def _merge_dtype(dtypes, column, dtype):
+    """Widen the recorded dtype of column to hold dtype too: strings win, then float over int."""
+    previous = dtypes.get(column)
+    if is_categorical(dtype):
+        dtype = np.dtype(object)
+    if previous is None or previous == dtype:
+        dtypes[column] = dtype
+    elif previous == object or dtype == object:
+        dtypes[column] = np.dtype(object)
+    else:
+        dtypes[column] = np.result_type(previous, dtype)
+
+
+def _prepared_chunks(source_paths, chunk_rows, **read_kwargs):
+    """Yield the prepared chunks of every source in turn."""
+    for source_path in source_paths:
+        for chunk in read_raw_data(source_path, chunksize=chunk_rows, **read_kwargs):
+            yield clean(df=chunk, profile_level=PROFILE_OFF).prepare_data()
+
+
+def clean_csv_in_chunks(source_paths, output_path, preprocessor=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+                        columns=None, start_date=None, end_date=None):
+    """
+    Clean and encode CSV files or snapshots chunk by chunk into one Parquet file.
+
+    Args:
+        source_paths (str or list): Raw CSV file(s) or Parquet snapshot(s) with the diabetic_data.csv
+            columns, cleaned as if they were concatenated.
+        output_path (str): Parquet file written, through a temporary file moved into place.
+        preprocessor (DiabetesPreprocessor, optional): Fitted preprocessor to encode with.
+            By default one is fitted on the source files during the first pass.
+        chunk_rows (int): Rows read at a time, defaults to MEDIWATCH_CLEAN_CHUNK_ROWS or 100000.
+        columns (list, optional): Raw columns read, e.g. schema.TRAINING_COLUMNS. Every column by default.
+        start_date (str, optional): First ingest date read from snapshots, YYYY-MM-DD.
+        end_date (str, optional): Last ingest date read from snapshots, YYYY-MM-DD.
+
+    Returns:
+        ChunkedCleanResult: output path, the preprocessor used, rows written and chunks read.
+    """
+    if isinstance(source_paths, str):
+        source_paths = [source_paths]
+    fit_preprocessor = preprocessor is None
+    if fit_preprocessor:
+        preprocessor = DiabetesPreprocessor()
+    read_kwargs = {'columns': columns, 'start_date': start_date, 'end_date': end_date}
+
+    # Pass 1: dtypes of the whole data and, without a preprocessor, its fitted values
+    logger.info(f"Planning the chunked cleaning of {source_paths} in chunks of {chunk_rows} rows")
+    prepared_dtypes = {}
+    for prepared in _prepared_chunks(source_paths, chunk_rows, **read_kwargs):
+        for col, dtype in prepared.dtypes.items():
+            _merge_dtype(prepared_dtypes, col, dtype)
+        if fit_preprocessor:
+            preprocessor.partial_fit(prepared)
+    if fit_preprocessor:
+        logger.info(f"Fitted preprocessor over chunks: {len(preprocessor.numeric_columns)} numeric "
+                    f"and {len(preprocessor.categorical_columns)} categorical columns")
+
+    # A numeric column with a missing value in any chunk is float in the whole data, transform
+    # keeps the numeric dtypes and gives the codes of a categorical column the same dtype in every chunk
+    output_dtypes = {}
+    for col in preprocessor.numeric_columns:
+        dtype = prepared_dtypes.get(col, np.dtype(np.float64))
+        output_dtypes[col] = dtype if np.issubdtype(dtype, np.number) else np.dtype(np.float64)
+
+    # Pass 2: encode every chunk and append it to the Parquet file
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    writer = None
+    rows = chunks = 0
+    try:
+        for prepared in _prepared_chunks(source_paths, chunk_rows, **read_kwargs):
+            encoded = preprocessor.transform(prepared)
+            encoded = encoded.astype({col: output_dtypes[col] for col in encoded.columns if col in output_dtypes})
+            if writer is None:
+                table = pa.Table.from_pandas(encoded, preserve_index=True)
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            else:
+                table = pa.Table.from_pandas(encoded, schema=writer.schema, preserve_index=True)
+            writer.write_table(table)
+            rows += encoded.shape[0]
+            chunks += 1
+        if writer is None:
+            raise ValueError(f"No rows to clean in {source_paths}")
+        writer.close()
+        writer = None
+        os.replace(tmp_path, output_path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    logger.info(f"Cleaned {rows} rows in {chunks} chunks into {output_path}")
+    return ChunkedCleanResult(output_path, preprocessor, rows, chunks)
@@ -18,7 +18,9 @@ Example:
 """
 import pandas as pd
 import numpy as np
-from .common import get_rows_columns_dtypes, get_unique_values
+from .common import profile_data, DEFAULT_PROFILE_LEVEL
+from .recode import RECODING_TABLE, recode_series, mask_missing_markers
+from .schema import DROPPED_FEATURES
 from sklearn.preprocessing import LabelEncoder
 import logging
 
@@ -35,22 +37,62 @@ class clean:
     particularly focusing on readmission prediction preprocessing tasks.
 
     Parameters:
-        filename (str): Path to the CSV file containing the medical data to be processed.
+        filename (str): Path to the CSV file or Parquet snapshot containing the medical data to be processed.
+        df (pandas.DataFrame, optional): Already loaded data to clean instead of reading
+            `filename`. Used by the prediction service to clean an uploaded payload in memory.
+        profile_level (str): Diagnostics logged before and after cleaning: 'off', 'summary'
+            or 'full'. Defaults to the MEDIWATCH_PROFILE_LEVEL environment variable or 'summary'.
 
     Attributes:
-        filename (str): Path to the source data file.
+        filename (str): Path to the source data file, None when cleaning an in-memory DataFrame.
         df (pandas.DataFrame): DataFrame containing the loaded and processed medical data.
             This is the main data structure that gets transformed by the cleaning methods.
     """
-    def __init__(self, filename):
+    def __init__(self, filename=None, df=None, profile_level=DEFAULT_PROFILE_LEVEL):
         self.filename = filename
-        self.df = pd.read_csv(self.filename)
-        logger.info(f"Initializing Data cleaner with the file: {self.filename}")
+        self.profile_level = profile_level
+        if df is not None:
+            # prepare_data drops features into a new DataFrame before modifying any column,
+            # so the caller's DataFrame is left untouched
+            self.df = df
+            logger.info(f"Initializing Data cleaner with an in-memory DataFrame of {df.shape[0]} rows")
+        elif filename is not None:
+            # A CSV file or a Parquet snapshot, with the compact dtypes of the schema. Imported here,
+            # pyarrow is a training dependency and the prediction service only cleans DataFrames
+            from .snapshot import read_raw_data
+            self.df = read_raw_data(self.filename)
+            logger.info(f"Initializing Data cleaner with the file: {self.filename}")
+        else:
+            raise ValueError("Either a filename or a DataFrame must be provided to clean")
     
     def drop_feature(self, feature_arr=[]):
-        self.df = self.df.drop(feature_arr, axis=1)
+        # Columns left out when the data was read are already gone
+        self.df = self.df.drop(feature_arr, axis=1, errors='ignore')
     
 
+    def recode_column(self, column):
+        """
+        Recode one column with its entry of RECODING_TABLE.
+
+        The lookup is a single vectorized pass over the column, which also turns
+        the "?" markers of that column into NaN.
+        """
+        self.df[column] = recode_series(self.df[column], RECODING_TABLE[column])
+
+    def mask_missing_markers(self):
+        """
+        Replace the "?" markers of the string columns that are not recoded with NaN.
+
+        Only the affected columns are touched, instead of running DataFrame.replace
+        over the whole frame.
+        """
+        for col in self.df.select_dtypes(['O', 'category']).columns:
+            if col in RECODING_TABLE:
+                continue
+            masked = mask_missing_markers(self.df[col])
+            if masked is not self.df[col]:
+                self.df[col] = masked
+
     def collapse_readmitted(self):
         """
         Collapse readmission variable into a binary target variable, where:
@@ -58,23 +100,12 @@ class clean:
         - 1: Readmitted in less than 30 days
         """
         # New target variable mapping to collapse into a binary classification and plotting distribution
-        self.df = self.df.replace({"NO":0,
-                                   "<30":1,
-                                   ">30":0})
+        self.recode_column('readmitted')
         logger.info(self.df.readmitted.value_counts())
     
     def collapse_age_groups(self):
 
-        self.df.age = self.df.age.replace({"[70-80)":75,
-                                           "[60-70)":65,
-                                           "[50-60)":55,
-                                           "[80-90)":85,
-                                           "[40-50)":45,
-                                           "[30-40)":35,
-                                           "[90-100)":95,
-                                           "[20-30)":25,
-                                           "[10-20)":15,
-                                           "[0-10)":5})
+        self.recode_column('age')
     
     def collapse_admission_id(self):
         """
@@ -90,43 +121,15 @@ class clean:
         The method modifies the 'admission_type_id' column in the DataFrame directly.
         """
 
-        mapped = {1.0:"Emergency",
-                  2.0:"Emergency",
-                  3.0:"Elective",
-                  4.0:"New Born",
-                  5.0:np.nan,
-                  6.0:np.nan,
-                  7.0:"Trauma Center",
-                  8.0:np.nan}
-
-        self.df.admission_type_id = self.df.admission_type_id.replace(mapped)
+        self.recode_column('admission_type_id')
     
     def collapse_discharge_disposition_id(self):
 
-        mapped_discharge = {1:"Discharged to Home",
-                            6:"Discharged to Home",
-                            8:"Discharged to Home",
-                            13:"Discharged to Home",
-                            19:"Discharged to Home",
-                            18:np.nan,25:np.nan,26:np.nan,
-                            2:"Other",3:"Other",4:"Other",
-                            5:"Other",7:"Other",9:"Other",
-                            10:"Other",11:"Other",12:"Other",
-                            14:"Other",15:"Other",16:"Other",
-                            17:"Other",20:"Other",21:"Other",
-                            22:"Other",23:"Other",24:"Other",
-                            27:"Other",28:"Other",29:"Other",30:"Other"}
-        
-        self.df["discharge_disposition_id"] = self.df["discharge_disposition_id"].replace(mapped_discharge)
+        self.recode_column('discharge_disposition_id')
     
     def collapse_admission_source_id(self):
 
-        mapped_adm = {1:"Referral",2:"Referral",3:"Referral",
-                      4:"Other",5:"Other",6:"Other",10:"Other",22:"Other",25:"Other",
-                      9:"Other",8:"Other",14:"Other",13:"Other",11:"Other",
-                      15:np.nan,17:np.nan,20:np.nan,21:np.nan,
-                      7:"Emergency"}
-        self.df.admission_source_id = self.df.admission_source_id.replace(mapped_adm)
+        self.recode_column('admission_source_id')
     
     def label_encode(self):
         """
@@ -141,7 +144,7 @@ class clean:
         Returns:
             pandas.DataFrame: DataFrame with all categorical columns converted to numbers
         """
-        cat_data = self.df.select_dtypes('O')
+        cat_data = self.df.select_dtypes(['O', 'category'])
         num_data = self.df.select_dtypes(np.number)
 
         LE = LabelEncoder()
@@ -151,21 +154,28 @@ class clean:
         return data
 
 
-    def clean_data(self):
+    def prepare_data(self):
+        """
+        Apply the row-level cleaning steps that need nothing learned from the data.
 
-        get_rows_columns_dtypes(self.df)
+        Replaces "?" markers with NaN, drops unused features and Unknown/Invalid
+        gender records and collapses the readmitted, age and admission columns.
+        Missing values are not filled and categories are not encoded yet, that is
+        done by clean_data either per batch or with a fitted DiabetesPreprocessor.
 
-        get_unique_values(self.df)
+        Returns:
+            pandas.DataFrame: The prepared data, also stored in self.df
+        """
+        # Drop weight, payer_code, and medical_speciality features
+        logger.info("Dropping weight, payer_code, and medical_speciality features")
+        self.drop_feature(DROPPED_FEATURES)
 
         '''
-        replace all occurrences of the string "?" in the DataFrame df with np.nan (Not a Number), 
+        replace the string "?" with np.nan (Not a Number) in the columns that are not recoded,
         effectively converting unknown or missing values to NaN for further processing.
+        The recoded columns below handle "?" in the same pass as their mapping.
         '''
-        self.df = self.df.replace("?",np.nan)
-
-        # Drop weight, payer_code, and medical_speciality features
-        logger.info("Dropping weight, payer_code, and medical_speciality features")
-        self.drop_feature(['weight', 'payer_code', 'medical_specialty'])
+        self.mask_missing_markers()
 
         self.collapse_readmitted()
 
@@ -184,24 +194,61 @@ class clean:
         # Collapsing Admission Source IDs to Referral,  Other, and Emergency
         self.collapse_admission_source_id()
 
-        # Get list of columns with missing values
-        missing_cols = self.df.columns[self.df.isnull().any()].tolist()
+        return self.df
 
-        if len(missing_cols) > 0:
-            logger.info("Replace missing values with most common value")
-            for feat in missing_cols:
-                self.df[f'{feat}'] = self.df[f'{feat}'].fillna(self.df[f'{feat}'].mode()[0])
-        
-        # Perfom Label Encoding
-        self.df = self.label_encode()
+    def encode_data(self, preprocessor=None):
+        """
+        Fill missing values and encode categories of data already run through prepare_data.
 
-        # Drop encounter_id and patient_nbr
-        self.drop_feature(['encounter_id','patient_nbr'])
+        Args:
+            preprocessor (DiabetesPreprocessor, optional): Fitted preprocessor used to fill
+                missing values and encode categories with the values learned at training time.
+                Without it, fill values and label codes are learned from this batch.
 
-        logger.info(f"Data cleaned successfully and ready for either training or prediction")
+        Returns:
+            pandas.DataFrame: Fully numeric data including the readmitted target, also stored in self.df
+        """
+        if preprocessor is not None:
+            logger.info("Filling missing values and encoding categories with the fitted preprocessor")
+            self.df = preprocessor.transform(self.df)
+        else:
+            # Get list of columns with missing values
+            missing_cols = self.df.columns[self.df.isnull().any()].tolist()
+
+            if len(missing_cols) > 0:
+                logger.info("Replace missing values with most common value")
+                for feat in missing_cols:
+                    self.df[f'{feat}'] = self.df[f'{feat}'].fillna(self.df[f'{feat}'].mode()[0])
+            
+            # Perfom Label Encoding
+            self.df = self.label_encode()
+
+            # Drop encounter_id and patient_nbr
+            self.drop_feature(['encounter_id','patient_nbr'])
+
+        return self.df
+
+    def clean_data(self, preprocessor=None):
+        """
+        Clean the data so it is ready for training or prediction.
 
-        get_rows_columns_dtypes(self.df)
+        Args:
+            preprocessor (DiabetesPreprocessor, optional): Fitted preprocessor used to fill
+                missing values and encode categories with the values learned at training time.
+                Without it, fill values and label codes are learned from this batch.
+
+        Returns:
+            pandas.DataFrame: Cleaned, fully numeric data including the readmitted target
+        """
+
+        profile_data(self.df, self.profile_level)
+
+        self.prepare_data()
+
+        self.encode_data(preprocessor)
+
+        logger.info(f"Data cleaned successfully and ready for either training or prediction")
 
-        get_unique_values(self.df)
+        profile_data(self.df, self.profile_level)
 
         return self.df
\ No newline at end of file
@@ -1,10 +1,21 @@
+import os
 import numpy as np
+import pandas as pd
 import logging
 
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Profiling levels of the diagnostic scans run before and after cleaning
+PROFILE_OFF = 'off'
+PROFILE_SUMMARY = 'summary'
+PROFILE_FULL = 'full'
+PROFILE_LEVELS = (PROFILE_OFF, PROFILE_SUMMARY, PROFILE_FULL)
+
+# MEDIWATCH_PROFILE_LEVEL=off skips the scans of every caller that does not pass a level
+DEFAULT_PROFILE_LEVEL = os.getenv('MEDIWATCH_PROFILE_LEVEL', PROFILE_SUMMARY)
+
 
 
 def get_rows_columns_dtypes(data):
@@ -61,3 +72,39 @@ def get_unique_values(data):
   for col in data.columns:
     logger.info(f"Unique values of {col}: {data[col].unique()}")
 
+
+#Summary of every column computed with a single value_counts pass per column
+def get_summary(data):
+    summary = {}
+    for col in data.columns:
+        counts = data[col].value_counts(dropna=False)
+        missing = int(counts[counts.index.isna()].sum())
+        summary[col] = {'dtype': str(data[col].dtype),
+                        'missing': missing,
+                        'unique': len(counts) - int(counts.index.isna().any()),
+                        'top': counts.index[0] if len(counts) else None}
+    return pd.DataFrame.from_dict(summary, orient='index')
+
+
+def profile_data(data, level=DEFAULT_PROFILE_LEVEL):
+    """
+    Log diagnostics about a DataFrame at the requested profiling level.
+
+    Args:
+        data (pandas.DataFrame): Data to profile
+        level (str): 'off' skips the scans entirely, 'summary' logs the shape and one
+            row of statistics per column, 'full' also lists the unique values of every column.
+    """
+    if level not in PROFILE_LEVELS:
+        raise ValueError(f"Unknown profiling level {level}, expected one of {PROFILE_LEVELS}")
+    if level == PROFILE_OFF:
+        return
+
+    if level == PROFILE_FULL:
+        get_rows_columns_dtypes(data)
+        get_unique_values(data)
+        return
+
+    logger.info('#samples  (rows)    =  {}'.format(data.shape[0]))
+    logger.info('#features (columns) =  {}'.format(data.shape[1]))
+    logger.info(f"\nColumn summary:\n {get_summary(data).to_string()}")
@@ -0,0 +1,202 @@
+"""
+Fitted preprocessing for the MediWatch diabetes dataset.
+
+`clean.label_encode` and the mode-fill in `clean.clean_data` learn their
+category codes and fill values from whatever batch they are given, so a
+10-row prediction request is encoded differently from the training set.
+`DiabetesPreprocessor` learns those values once, on the training data, and
+is saved next to the best model so inference only runs a cheap transform.
+
+The preprocessor works on the output of `clean.prepare_data`, i.e. after the
+"?" markers, dropped features and collapsed categories have been handled.
+
+Example:
+    preprocessor = DiabetesPreprocessor().fit(clean('train.csv').prepare_data())
+    encoded_df = preprocessor.transform(clean(df=request_df).prepare_data())
+"""
+import pandas as pd
+import numpy as np
+from .schema import is_categorical
+import logging
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+ID_COLUMNS = ['encounter_id', 'patient_nbr']
+TARGET_COLUMN = 'readmitted'
+
+
+def normalize_categories(series):
+    """
+    Turn the values of a categorical column into comparable strings.
+
+    Small batches of codes such as diag_1 are parsed as floats by read_csv
+    (599 becomes 599.0) while the full dataset keeps them as strings, so the
+    trailing ".0" is dropped to make both spellings share one category.
+    Missing values are left as NaN. Only the distinct values are converted, so
+    the cost does not grow with the number of rows beyond one hashing pass.
+    """
+    codes, uniques = pd.factorize(series)
+    normalized = pd.Series(uniques, dtype=object).astype(str).str.replace(r'\.0$', '', regex=True)
+    # Code -1 marks missing values and picks the trailing NaN
+    lookup = np.append(normalized.to_numpy(dtype=object), np.nan)
+    return pd.Series(lookup[codes], index=series.index, name=series.name)
+
+
+def code_dtype(vocabulary_size):
+    """Return the smallest signed integer dtype holding the codes of a vocabulary."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if vocabulary_size <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def mode_from_counts(counts):
+    """
+    Return the most frequent value of a value_counts result.
+    Ties resolve to the smallest value, like pandas.Series.mode()[0].
+    """
+    if len(counts) == 0:
+        return np.nan
+    top = counts[counts == counts.max()].index
+    return sorted(top)[0]
+
+
+class DiabetesPreprocessor:
+    """
+    Fill missing values and label encode categorical columns with values learned at training time.
+
+    Parameters:
+        id_columns (list): Identifier columns that are dropped from the output.
+        target_column (str): Target column, passed through untouched when present.
+
+    Attributes:
+        numeric_columns (list): Numeric columns in output order, including the target.
+        categorical_columns (list): Categorical columns in output order.
+        fill_values (dict): Value used to fill missing entries of each column.
+        categories (dict): Sorted vocabulary of each categorical column. The code of a
+            value is its position in the vocabulary, as with sklearn's LabelEncoder.
+        feature_columns (list): Columns the scaler and model expect, in order.
+    """
+    def __init__(self, id_columns=ID_COLUMNS, target_column=TARGET_COLUMN):
+        self.id_columns = list(id_columns)
+        self.target_column = target_column
+        self.numeric_columns = []
+        self.categorical_columns = []
+        self.fill_values = {}
+        self.categories = {}
+        self.feature_columns = []
+
+    def fit(self, df):
+        """
+        Learn column order, fill values and category vocabularies from prepared training data.
+
+        Args:
+            df (pandas.DataFrame): Output of clean.prepare_data on the training data.
+
+        Returns:
+            DiabetesPreprocessor: self, fitted.
+        """
+        self._value_counts = {}
+        self._object_columns = set()
+        self.partial_fit(df)
+        logger.info(f"Fitted preprocessor on {df.shape[0]} rows: {len(self.numeric_columns)} numeric "
+                    f"and {len(self.categorical_columns)} categorical columns")
+        return self
+
+    def partial_fit(self, df):
+        """
+        Update the fitted values with one more chunk of prepared training data.
+
+        Only the value counts of each column are kept between calls, so fitting
+        chunk by chunk gives the same values as fitting the concatenated chunks.
+        A column is categorical as soon as one chunk has it as strings, like
+        read_csv makes it an object column of the whole file.
+
+        Args:
+            df (pandas.DataFrame): Output of clean.prepare_data on one chunk of the training data.
+
+        Returns:
+            DiabetesPreprocessor: self, fitted on every chunk seen since the last fit.
+        """
+        if not hasattr(self, '_value_counts'):
+            self._value_counts = {}
+            self._object_columns = set()
+
+        for col in df.columns:
+            if col in self.id_columns:
+                continue
+            if is_categorical(df[col].dtype):
+                if col not in self._object_columns and col in self._value_counts:
+                    # Counted as numbers in the previous chunks, e.g. diag_1 codes without a "V" prefix
+                    previous = self._value_counts[col]
+                    self._value_counts[col] = previous.groupby(normalize_categories(previous.index.to_series()).to_numpy()).sum()
+                self._object_columns.add(col)
+                counts = normalize_categories(df[col]).value_counts()
+            elif col in self._object_columns:
+                counts = normalize_categories(df[col]).value_counts()
+            elif np.issubdtype(df[col].dtype, np.number):
+                counts = df[col].value_counts()
+            else:
+                continue
+            if col in self._value_counts:
+                counts = self._value_counts[col].add(counts, fill_value=0)
+            self._value_counts[col] = counts
+
+        columns = list(self._value_counts)
+        self.numeric_columns = [col for col in columns if col not in self._object_columns]
+        self.categorical_columns = [col for col in columns if col in self._object_columns]
+
+        self.fill_values = {}
+        self.categories = {}
+        for col in columns:
+            counts = self._value_counts[col]
+            self.fill_values[col] = mode_from_counts(counts)
+            if col in self._object_columns:
+                self.categories[col] = sorted(counts.index)
+
+        self.feature_columns = [col for col in self.numeric_columns + self.categorical_columns
+                                if col != self.target_column]
+        return self
+
+    def transform(self, df):
+        """
+        Fill and encode prepared data with the fitted values.
+
+        Categories that were not seen during training are encoded as the most
+        frequent training category, the same value used for missing entries.
+        Numeric columns keep their dtype and codes take the smallest integer dtype
+        of their vocabulary, so the encoded data of the compact schema stays compact.
+
+        Args:
+            df (pandas.DataFrame): Output of clean.prepare_data on new data.
+
+        Returns:
+            pandas.DataFrame: Encoded data with the numeric columns followed by the
+                categorical columns in training order. The target is kept only if present.
+        """
+        if not self.feature_columns:
+            raise ValueError("The preprocessor must be fitted before calling transform")
+
+        missing = [col for col in self.feature_columns if col not in df.columns]
+        if missing:
+            raise ValueError(f"Input data is missing feature columns: {missing}")
+
+        encoded = {}
+        for col in self.numeric_columns:
+            if col not in df.columns:
+                # Only the target may be absent, e.g. when scoring unlabelled encounters
+                continue
+            values = pd.to_numeric(df[col], errors='coerce')
+            encoded[col] = values.fillna(self.fill_values[col])
+
+        for col in self.categorical_columns:
+            vocabulary = self.categories[col]
+            values = normalize_categories(df[col]).fillna(self.fill_values[col])
+            codes = pd.Categorical(values, categories=vocabulary).codes
+            # Unseen categories get code -1 from pandas, map them to the fill value's code
+            codes = np.where(codes < 0, vocabulary.index(self.fill_values[col]), codes)
+            encoded[col] = codes.astype(code_dtype(len(vocabulary)))
+
+        return pd.DataFrame(encoded, index=df.index)
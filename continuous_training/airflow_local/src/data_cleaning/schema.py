@@ -0,0 +1,120 @@
+"""
+Explicit dtypes of the raw diabetes dataset columns.
+
+Without a schema read_csv infers every column: the ~35 string columns
+(race, gender, diag_1..3, the medication columns holding "No"/"Steady"/
+"Up"/"Down", ...) become object columns with one Python string per cell and
+every counter becomes int64. `RAW_SCHEMA` gives each column a compact dtype
+instead:
+
+- identifiers stay int64
+- string columns are categories, one small integer code per cell
+- bounded counters and the admission ids are int8 or int16
+
+`read_raw_csv` reads with these dtypes, so type inference is skipped. A
+counter with a blank cell cannot be held by an integer dtype, the counters
+are therefore parsed as float32 and downcast to their integer dtype when the
+column has no missing value, and kept as float32 otherwise. Columns that are
+not in the schema, e.g. Predicted_readmitted, are inferred as before.
+
+Example:
+    df = read_raw_csv('diabetic_data.csv')
+    for chunk in read_raw_csv('diabetic_data.csv', chunksize=100000):
+        ...
+"""
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+ID_DTYPES = {
+    'encounter_id': np.int64,
+    'patient_nbr': np.int64,
+}
+
+# Integer dtype of each counter and id column, wide enough for the values of the dataset with headroom
+COUNT_DTYPES = {
+    'admission_type_id': np.int8,
+    'discharge_disposition_id': np.int8,
+    'admission_source_id': np.int8,
+    'time_in_hospital': np.int8,
+    'num_lab_procedures': np.int16,
+    'num_procedures': np.int8,
+    'num_medications': np.int16,
+    'number_outpatient': np.int16,
+    'number_emergency': np.int16,
+    'number_inpatient': np.int16,
+    'number_diagnoses': np.int8,
+}
+
+CATEGORY_COLUMNS = [
+    'race', 'gender', 'age', 'weight', 'payer_code', 'medical_specialty',
+    'diag_1', 'diag_2', 'diag_3', 'max_glu_serum', 'A1Cresult',
+    'metformin', 'repaglinide', 'nateglinide', 'chlorpropamide', 'glimepiride',
+    'acetohexamide', 'glipizide', 'glyburide', 'tolbutamide', 'pioglitazone',
+    'rosiglitazone', 'acarbose', 'miglitol', 'troglitazone', 'tolazamide',
+    'examide', 'citoglipton', 'insulin', 'glyburide-metformin', 'glipizide-metformin',
+    'glimepiride-pioglitazone', 'metformin-rosiglitazone', 'metformin-pioglitazone',
+    'change', 'diabetesMed', 'readmitted',
+]
+
+RAW_SCHEMA = {**ID_DTYPES, **COUNT_DTYPES, **{col: 'category' for col in CATEGORY_COLUMNS}}
+
+# Features clean.prepare_data drops, mostly missing or too specific
+DROPPED_FEATURES = ['weight', 'payer_code', 'medical_specialty']
+
+# Raw columns training reads: the identifiers and the dropped features never reach the model
+TRAINING_COLUMNS = [col for col in RAW_SCHEMA if col not in DROPPED_FEATURES and col not in ID_DTYPES]
+
+# Dtype the counters are parsed with, exact for integers below 2**24
+_PARSE_DTYPE = np.float32
+
+
+def is_categorical(dtype):
+    """Return True for the dtypes of string columns: object and category."""
+    return dtype == object or isinstance(dtype, pd.CategoricalDtype)
+
+
+def downcast_counts(df):
+    """
+    Cast the counter columns of df, parsed as float32, to their integer dtype.
+
+    Columns with a missing value or a value out of range of the integer dtype
+    are left as float32.
+
+    Returns:
+        pandas.DataFrame: df, modified in place.
+    """
+    for col, dtype in COUNT_DTYPES.items():
+        if col not in df.columns or df[col].dtype != _PARSE_DTYPE:
+            continue
+        values = df[col].to_numpy()
+        limits = np.iinfo(dtype)
+        if np.isnan(values).any():
+            continue
+        if len(values) and (values.min() < limits.min or values.max() > limits.max):
+            logger.warning(f"{col} has values out of the {np.dtype(dtype).name} range, keeping it as float32")
+            continue
+        df[col] = values.astype(dtype)
+    return df
+
+
+def read_raw_csv(filepath_or_buffer, **kwargs):
+    """
+    pandas.read_csv with the dtypes of RAW_SCHEMA.
+
+    Args:
+        filepath_or_buffer (str or file): Raw CSV data with the diabetic_data.csv columns.
+        **kwargs: Passed to pandas.read_csv, e.g. chunksize, names and header. A dtype
+            argument overrides the schema for its columns.
+
+    Returns:
+        pandas.DataFrame, or an iterator of DataFrames when chunksize is given.
+    """
+    dtype = {**ID_DTYPES, **{col: _PARSE_DTYPE for col in COUNT_DTYPES},
+             **{col: 'category' for col in CATEGORY_COLUMNS}, **kwargs.pop('dtype', {})}
+    if kwargs.get('chunksize') is not None:
+        return (downcast_counts(chunk) for chunk in pd.read_csv(filepath_or_buffer, dtype=dtype, **kwargs))
+    return downcast_counts(pd.read_csv(filepath_or_buffer, dtype=dtype, **kwargs))
@@ -0,0 +1,217 @@
+"""
+Columnar snapshots of the raw training data.
+
+Every retrain used to parse diabetic_data.csv and new_data.csv as text. A
+snapshot holds the same raw rows as Parquet files, partitioned by the date
+the rows were ingested:
+
+    snapshots/
+        ingest_date=2024-11-04/diabetic_data.parquet
+        ingest_date=2024-12-01/new_data.parquet
+
+The columns are stored with the types of `schema.RAW_SCHEMA` (strings,
+int8/int16 counters that may be null), so reading a snapshot gives the same
+DataFrame as `read_raw_csv` on the CSV files it was converted from. Readers
+only load the columns they ask for, e.g. `schema.TRAINING_COLUMNS`, and only
+the partitions of an ingest date range.
+
+`read_raw_data` reads either a CSV file or a snapshot, which is a directory
+of partitions or a single .parquet file. Date ranges only apply to
+snapshots, a CSV file has no ingest date and is always read whole.
+
+Convert a CSV file (from continuous_training/airflow_local):
+    python -m src.data_cleaning.snapshot src/input_data/dataset_diabetes/diabetic_data.csv \\
+        src/input_data/snapshots --ingest-date 2024-11-04
+
+Example:
+    df = read_raw_data('snapshots', columns=TRAINING_COLUMNS, start_date='2024-11-01')
+"""
+import os
+import argparse
+from datetime import date
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from .schema import ID_DTYPES, COUNT_DTYPES, CATEGORY_COLUMNS, read_raw_csv
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PARTITION_COLUMN = 'ingest_date'
+SNAPSHOT_SUFFIX = '.parquet'
+
+# Partition directories are named ingest_date=YYYY-MM-DD, compared as strings
+PARTITIONING = ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor='hive')
+
+# Rows converted at a time, each written as one row group
+CONVERT_CHUNK_ROWS = 250000
+
+ARROW_TYPES = {
+    **{col: pa.from_numpy_dtype(np.dtype(dtype)) for col, dtype in ID_DTYPES.items()},
+    **{col: pa.from_numpy_dtype(np.dtype(dtype)) for col, dtype in COUNT_DTYPES.items()},
+    **{col: pa.string() for col in CATEGORY_COLUMNS},
+}
+
+
+def is_snapshot(path):
+    """Return True for a snapshot directory or .parquet file, False for a CSV file."""
+    return os.path.isdir(path) or path.endswith(SNAPSHOT_SUFFIX)
+
+
+def _arrow_schema(df):
+    """Arrow schema of a raw chunk: the schema types for known columns, inferred ones for the others."""
+    inferred = pa.Schema.from_pandas(df, preserve_index=False)
+    return pa.schema([pa.field(field.name, ARROW_TYPES.get(field.name, field.type)) for field in inferred])
+
+
+def write_snapshot(csv_path, snapshot_dir, ingest_date=None, chunk_rows=CONVERT_CHUNK_ROWS):
+    """
+    Convert a raw CSV file into a partition of a snapshot.
+
+    The file is written to a temporary file, ignored by readers, and moved into
+    place. Converting the same CSV file again for the same date replaces it.
+
+    Args:
+        csv_path (str): Raw CSV file with the diabetic_data.csv columns.
+        snapshot_dir (str): Snapshot directory, created when missing.
+        ingest_date (str, optional): Partition date as YYYY-MM-DD, today by default.
+        chunk_rows (int): Rows converted at a time.
+
+    Returns:
+        str: Path of the Parquet file written.
+    """
+    ingest_date = ingest_date or date.today().isoformat()
+    partition_dir = os.path.join(snapshot_dir, f"{PARTITION_COLUMN}={ingest_date}")
+    os.makedirs(partition_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(csv_path))[0] + SNAPSHOT_SUFFIX
+    output_path = os.path.join(partition_dir, name)
+    # Files starting with "." are skipped by pyarrow datasets, readers never see a partial file
+    tmp_path = os.path.join(partition_dir, f".{name}.{os.getpid()}.tmp")
+
+    writer = None
+    rows = 0
+    try:
+        for chunk in read_raw_csv(csv_path, chunksize=chunk_rows):
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, _arrow_schema(chunk))
+            writer.write_table(pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False))
+            rows += chunk.shape[0]
+        if writer is None:
+            raise ValueError(f"{csv_path} has no rows to convert")
+        writer.close()
+        writer = None
+        os.replace(tmp_path, output_path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    logger.info(f"Converted {rows} rows of {csv_path} into {output_path}")
+    return output_path
+
+
+def _date_filter(start_date, end_date):
+    """Partition filter of an inclusive ingest date range, None when unbounded."""
+    expression = None
+    if start_date:
+        expression = ds.field(PARTITION_COLUMN) >= str(start_date)
+    if end_date:
+        upper = ds.field(PARTITION_COLUMN) <= str(end_date)
+        expression = upper if expression is None else expression & upper
+    return expression
+
+
+def _to_raw_dtypes(table):
+    """Convert an Arrow table to a DataFrame with the dtypes read_raw_csv gives."""
+    df = table.to_pandas(strings_to_categorical=True)
+    for col in COUNT_DTYPES:
+        # Counters with nulls come back as float64, read_raw_csv keeps them as float32
+        if col in df.columns and df[col].dtype.kind == 'f':
+            df[col] = df[col].astype(np.float32)
+    return df
+
+
+def read_snapshot(path, columns=None, start_date=None, end_date=None, chunksize=None):
+    """
+    Read the rows of a snapshot.
+
+    Args:
+        path (str): Snapshot directory or .parquet file.
+        columns (list, optional): Columns to read, every raw column by default. Columns
+            missing from the snapshot are skipped. The ingest_date partition column is
+            only returned when listed.
+        start_date (str, optional): First ingest date read, YYYY-MM-DD.
+        end_date (str, optional): Last ingest date read, YYYY-MM-DD.
+        chunksize (int, optional): Return an iterator of DataFrames of at most this many rows.
+
+    Returns:
+        pandas.DataFrame, or an iterator of DataFrames when chunksize is given. Rows are in
+            partition and file order with a RangeIndex running across chunks.
+    """
+    if os.path.isdir(path):
+        dataset = ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+        filter_expression = _date_filter(start_date, end_date)
+    else:
+        dataset = ds.dataset(path, format='parquet')
+        filter_expression = None
+        if start_date or end_date:
+            logger.warning(f"{path} is a single file outside of a snapshot directory, reading all of its rows")
+    names = dataset.schema.names
+    # In file order, like read_csv with usecols
+    columns = [col for col in names if (col in columns if columns is not None else col != PARTITION_COLUMN)]
+
+    if chunksize is None:
+        return _to_raw_dtypes(dataset.to_table(columns=columns, filter=filter_expression))
+
+    def chunks():
+        offset = 0
+        for batch in dataset.to_batches(columns=columns, filter=filter_expression, batch_size=chunksize):
+            if batch.num_rows == 0:
+                continue
+            df = _to_raw_dtypes(pa.Table.from_batches([batch]))
+            # Chunks continue each other's row numbers, like read_csv chunks
+            df.index = df.index + offset
+            offset += batch.num_rows
+            yield df
+    return chunks()
+
+
+def read_raw_data(path, columns=None, start_date=None, end_date=None, chunksize=None):
+    """
+    Read raw data from a CSV file or a snapshot with the dtypes of the schema.
+
+    Args:
+        path (str): CSV file, snapshot directory or .parquet file.
+        columns (list, optional): Columns to read, every column by default.
+        start_date (str, optional): First ingest date read from a snapshot.
+        end_date (str, optional): Last ingest date read from a snapshot.
+        chunksize (int, optional): Return an iterator of DataFrames of at most this many rows.
+
+    Returns:
+        pandas.DataFrame, or an iterator of DataFrames when chunksize is given.
+    """
+    if is_snapshot(path):
+        return read_snapshot(path, columns=columns, start_date=start_date, end_date=end_date, chunksize=chunksize)
+    if start_date or end_date:
+        logger.warning(f"{path} is a CSV file without ingest dates, reading all of its rows")
+    usecols = None if columns is None else (lambda col: col in columns)
+    return read_raw_csv(path, usecols=usecols, chunksize=chunksize)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert raw CSV files into a Parquet snapshot partitioned by ingest date")
+    parser.add_argument('csv_paths', nargs='+', help="Raw CSV files, e.g. diabetic_data.csv and new_data.csv")
+    parser.add_argument('snapshot_dir', help="Snapshot directory")
+    parser.add_argument('--ingest-date', default=None, help="Partition date as YYYY-MM-DD, today by default")
+    parser.add_argument('--chunk-rows', type=int, default=CONVERT_CHUNK_ROWS)
+    args = parser.parse_args()
+    logging.basicConfig()
+    for csv_path in args.csv_paths:
+        print(write_snapshot(csv_path, args.snapshot_dir, args.ingest_date, args.chunk_rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Model artifact format shared by the trainer and the prediction service.
+
+Artifacts used to be written with `joblib.dump(..., compress=('gzip', 3))`,
+so every gunicorn worker had to inflate the whole model into private memory
+on startup and on every model swap. `dump_artifact` writes them uncompressed
+(or with a fast codec such as lz4), a layout `load_artifact` opens with
+`joblib.load(mmap_mode='r')`: NumPy arrays held by the artifact, e.g. the
+coefficients of linear models, are mapped from the file and shared by every
+worker through the page cache. sklearn trees copy their nodes when unpickled,
+so forests are not shared, but they still load without the gzip pass and its
+buffers (see benchmarks/bench_artifacts.py).
+
+A promoted model directory also carries a `manifest.json` describing the
+artifacts it holds:
+
+    {
+      "version": "3f0c9a1e2b7d",
+      "created_at": "2024-11-04T13:05:00",
+      "model_name": "Random Forest",
+      "feature_columns": ["time_in_hospital", ...],
+      "artifacts": {
+        "model": {"file": "best_model.joblib", "sha256": "...", "size": 1234, "compress": 0},
+        ...
+      }
+    }
+
+Loaders compare the files with the manifest before reading them, so a
+directory that is still being promoted is never loaded. The size check costs
+one stat per file, the optional sha256 check one read of each file.
+
+Example:
+    entry = dump_artifact(model, '/models/best_model/best_model.joblib')
+    write_manifest('/models/best_model', {'model': entry}, feature_columns=features)
+    model = load_artifact('/models/best_model/best_model.joblib')
+"""
+import os
+import json
+import time
+import hashlib
+import joblib
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MANIFEST_FILENAME = 'manifest.json'
+
+# 0 writes an uncompressed, memory-mappable file. ('lz4', 3) is a fast alternative
+# when the lz4 package is installed, gzip is kept readable for older artifacts.
+DEFAULT_COMPRESS = 0
+
+# First byte of an uncompressed pickle (protocol 2 and above)
+_PICKLE_MAGIC = b'\x80'
+
+_HASH_CHUNK = 1 << 20
+
+
+def file_sha256(path):
+    """Return the SHA-256 hex digest of a file, read in 1 MiB chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_memory_mappable(path):
+    """Return True if path is an uncompressed joblib file that can be opened with mmap_mode."""
+    with open(path, 'rb') as f:
+        return f.read(1) == _PICKLE_MAGIC
+
+
+def dump_artifact(obj, path, compress=DEFAULT_COMPRESS):
+    """
+    Write an object with joblib, through a temporary file moved into place.
+
+    Args:
+        obj: Object to save, e.g. a fitted model, scaler or preprocessor.
+        path (str): Destination file.
+        compress: joblib compression, 0 (default) for a memory-mappable file.
+
+    Returns:
+        dict: Manifest entry of the artifact with file, sha256, size and compress.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(obj, tmp_path, compress=compress)
+    os.replace(tmp_path, path)
+    return artifact_entry(path, compress)
+
+
+def artifact_entry(path, compress=None):
+    """Return the manifest entry of an artifact already on disk."""
+    if compress is None:
+        compress = 0 if is_memory_mappable(path) else 'unknown'
+    return {
+        'file': os.path.basename(path),
+        'sha256': file_sha256(path),
+        'size': os.path.getsize(path),
+        'compress': list(compress) if isinstance(compress, tuple) else compress,
+    }
+
+
+def load_artifact(path, mmap=True):
+    """
+    Load a joblib artifact, memory-mapping its arrays when the file is uncompressed.
+
+    Compressed artifacts written before this format, e.g. with gzip, are loaded
+    the usual way.
+
+    Args:
+        path (str): Artifact file.
+        mmap (bool): Map the arrays of uncompressed files read-only instead of copying them.
+
+    Returns:
+        The loaded object.
+    """
+    if mmap and is_memory_mappable(path):
+        return joblib.load(path, mmap_mode='r')
+    return joblib.load(path)
+
+
+def write_manifest(artifact_dir, artifacts, feature_columns=None, **metadata):
+    """
+    Write manifest.json for the artifacts of a directory.
+
+    The version is derived from the artifact hashes, so identical artifacts
+    always get the same version. Write the manifest after the artifacts it
+    describes, it is what marks the directory as complete.
+
+    Args:
+        artifact_dir (str): Directory holding the artifacts.
+        artifacts (dict): Role (model, scaler, preprocessor) -> entry from dump_artifact
+            or artifact_entry.
+        feature_columns (list, optional): Columns the model expects, in order.
+        **metadata: Extra JSON-serializable fields, e.g. model_name.
+
+    Returns:
+        dict: The manifest.
+    """
+    digest = hashlib.sha256()
+    for role in sorted(artifacts):
+        digest.update(f"{role}:{artifacts[role]['sha256']}".encode('utf-8'))
+    manifest = {
+        'version': digest.hexdigest()[:12],
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'feature_columns': list(feature_columns) if feature_columns is not None else None,
+        'artifacts': artifacts,
+    }
+    manifest.update(metadata)
+
+    path = os.path.join(artifact_dir, MANIFEST_FILENAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote manifest of version {manifest['version']} to {path}")
+    return manifest
+
+
+def read_manifest(artifact_dir):
+    """Return the manifest of a directory, or None for directories written before manifests existed."""
+    path = os.path.join(artifact_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def validate_manifest(artifact_dir, manifest, check_hash=False):
+    """
+    Check that the artifacts on disk are the ones described by the manifest.
+
+    Args:
+        artifact_dir (str): Directory holding the artifacts.
+        manifest (dict): Output of read_manifest.
+        check_hash (bool): Also compare the sha256 of every file. Sizes alone are
+            checked by default, which only costs one stat per file.
+
+    Raises:
+        ValueError: If an artifact is missing or does not match its manifest entry.
+    """
+    for role, entry in manifest['artifacts'].items():
+        path = os.path.join(artifact_dir, entry['file'])
+        if not os.path.exists(path):
+            raise ValueError(f"Artifact {role} is missing: {path}")
+        size = os.path.getsize(path)
+        if size != entry['size']:
+            raise ValueError(f"Artifact {role} has {size} bytes, the manifest expects {entry['size']}: {path}")
+        if check_hash and file_sha256(path) != entry['sha256']:
+            raise ValueError(f"Artifact {role} does not match the sha256 of the manifest: {path}")
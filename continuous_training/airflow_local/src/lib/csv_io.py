@@ -0,0 +1,67 @@
+"""
+CSV payload helpers of the prediction service.
+
+Kept apart from `lib.utils`, which imports the Evidently reporting stack, so
+that a serving worker only imports pandas to parse uploads.
+"""
+import base64
+import gzip
+import io
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+def decodeCSV(csvstring, fileName):
+    """
+    Decode a base64-encoded CSV string and save it to a file.
+
+    Args:
+        csvstring (str): Base64-encoded CSV data
+        fileName (str): Path where the decoded CSV should be saved
+
+    The function decodes the base64 string to UTF-8 CSV format and saves it.
+    Useful when receiving CSV data that has been encoded for transmission.
+    """
+    csvdata = base64.b64decode(csvstring).decode('utf-8')
+    with open(fileName, 'w') as f:
+        f.write(csvdata)
+        f.close()
+    logger.info(f"CSV file saved as: {fileName}")
+
+def decode_csv_to_dataframe(csvstring):
+    """
+    Decode a base64-encoded CSV string straight into a DataFrame.
+
+    Args:
+        csvstring (str): Base64-encoded CSV data
+
+    Returns:
+        pandas.DataFrame: The parsed CSV data
+
+    Nothing is written to disk, so concurrent requests cannot overwrite each
+    other's uploads the way they could with a shared file from decodeCSV.
+    """
+    df = pd.read_csv(io.BytesIO(base64.b64decode(csvstring)))
+    logger.info(f"Decoded CSV payload with {df.shape[0]} rows")
+    return df
+
+def read_csv_chunks(stream, chunksize, compression=None):
+    """
+    Parse a raw CSV stream into DataFrames of at most chunksize rows.
+
+    Args:
+        stream: File-like object with a read method, e.g. a request body stream
+        chunksize (int): Maximum number of rows per chunk
+        compression (str, optional): 'gzip' when the stream is gzip compressed
+
+    Returns:
+        pandas.io.parsers.TextFileReader: Iterator of DataFrames. The stream is read
+            incrementally, so only one chunk is held in memory at a time.
+    """
+    if compression == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    elif compression is not None:
+        raise ValueError(f"Unsupported compression: {compression}")
+    return pd.read_csv(stream, chunksize=chunksize)
@@ -0,0 +1,281 @@
+"""
+Incremental drift and quality monitoring of the served model.
+
+The monitoring job used to re-score and re-clean every accumulated row and
+run the Evidently test suite over the whole training set and the whole
+history on each run, so its cost grew with the total traffic. `DriftMonitor`
+keeps, per model version, everything the retraining decision needs as
+mergeable aggregates in a small JSON state file:
+
+- a sketch of the reference (training) data: for each monitored column, bin
+  edges and the reference count of each bin. Columns with few distinct values
+  get one bin per value, the others one bin per reference percentile.
+- the same bin counts over every row reported since the model was promoted
+- the confusion matrix of those rows
+- a high-water mark: the number of rows of the new data already reported and
+  the encounter_id of the last one
+
+A run only reads, cleans and bins the rows past the high-water mark, adds
+them to the running counts and recomputes the tests from the counts:
+
+- PSI over ten equal-mass groups of reference bins, like a quantile PSI
+- two-sample KS statistic and asymptotic p-value from the two binned CDFs,
+  exact for the one-bin-per-value columns
+- accuracy and precision of class 1 from the confusion matrix
+
+The thresholds, DRIFT_TESTS, MIN_ACCURACY and MIN_PRECISION, are the ones of
+the Evidently test suite it replaces. The reference sketch is rebuilt, and
+the running counts reset, only when the model version changes.
+
+Example:
+    monitor = DriftMonitor('/path/to/monitor_state.json')
+    monitor.ensure_reference(artifacts.version, lambda: get_reference_data(training_path, preprocessor))
+    new_df, skipped = monitor.read_new_rows(new_data_path)
+    monitor.update(clean_new_df, rows_read=len(new_df) + skipped, last_id=new_df['encounter_id'].iloc[-1])
+    results = monitor.run_tests()
+"""
+import os
+import json
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from scipy.stats import kstwobign
+from .new_data_store import read_rows_after
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MONITOR_STATE_FILENAME = 'monitor_state.json'
+ID_COLUMN = 'encounter_id'
+TARGET_COLUMN = 'readmitted'
+PREDICTION_COLUMN = 'Predicted_readmitted'
+
+# (column, stattest, threshold): drift when psi > threshold or the ks p-value < threshold
+DRIFT_TESTS = [
+    ('time_in_hospital', 'psi', 0.1),
+    ('num_medications', 'ks', 0.05),
+    ('number_diagnoses', 'ks', 0.05),
+]
+MIN_ACCURACY = 0.5
+MIN_PRECISION = 0.5
+PRECISION_LABEL = 1
+
+# Columns with at most this many distinct reference values get one bin per value
+MAX_DISCRETE_VALUES = 100
+# Bins of the other columns, at the reference percentiles
+CONTINUOUS_BINS = 100
+PSI_GROUPS = 10
+# Proportion substituted for empty bins, as Evidently does, so PSI stays finite
+_PSI_EPSILON = 0.0001
+
+
+def column_sketch(values):
+    """
+    Bin edges and reference counts of one column.
+
+    Args:
+        values (pandas.Series): Reference values of the column.
+
+    Returns:
+        dict: 'edges' (inner bin edges, a value v falls in bin searchsorted(edges, v, 'right')),
+            'counts' (reference count of each bin) and 'groups' (PSI group of each bin).
+    """
+    values = values.dropna().to_numpy(dtype=float)
+    distinct = np.unique(values)
+    if len(distinct) <= MAX_DISCRETE_VALUES:
+        # Midpoints between consecutive values: one bin per reference value
+        edges = (distinct[:-1] + distinct[1:]) / 2
+    else:
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, CONTINUOUS_BINS + 1)[1:-1]))
+    counts = bin_counts(values, edges)
+    # Consecutive bins are grouped into PSI_GROUPS groups of roughly equal reference mass
+    cumulative = (np.cumsum(counts) - counts) / max(counts.sum(), 1)
+    groups = np.minimum((cumulative * PSI_GROUPS).astype(int), PSI_GROUPS - 1)
+    return {'edges': edges.tolist(), 'counts': counts.tolist(), 'groups': groups.tolist()}
+
+
+def bin_counts(values, edges):
+    """Count the non-missing values falling in each bin delimited by the inner edges."""
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    return np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+
+
+def psi(reference_counts, current_counts, groups):
+    """Population stability index of the current counts against the reference counts, per PSI group."""
+    reference = np.bincount(groups, weights=reference_counts, minlength=PSI_GROUPS)
+    current = np.bincount(groups, weights=current_counts, minlength=PSI_GROUPS)
+    reference = np.maximum(reference / max(reference.sum(), 1), _PSI_EPSILON)
+    current = np.maximum(current / max(current.sum(), 1), _PSI_EPSILON)
+    return float(np.sum((current - reference) * np.log(current / reference)))
+
+
+def ks_test(reference_counts, current_counts):
+    """
+    Two-sample Kolmogorov-Smirnov test on binned samples.
+
+    Returns:
+        tuple: (statistic, p-value), the p-value from the asymptotic distribution.
+    """
+    reference_counts = np.asarray(reference_counts, dtype=float)
+    current_counts = np.asarray(current_counts, dtype=float)
+    n, m = reference_counts.sum(), current_counts.sum()
+    if n == 0 or m == 0:
+        return 0.0, 1.0
+    statistic = float(np.max(np.abs(np.cumsum(reference_counts) / n - np.cumsum(current_counts) / m)))
+    p_value = float(kstwobign.sf(statistic * np.sqrt(n * m / (n + m))))
+    return statistic, p_value
+
+
+class DriftMonitor:
+    """
+    Running drift and quality aggregates of the served model, persisted in a JSON file.
+
+    Parameters:
+        state_path (str): JSON state file, created on the first run.
+
+    Attributes:
+        state (dict): model_version, reference sketches, running bin counts, confusion
+            matrix ([[tn, fp], [fn, tp]]) and the high-water mark (rows, last_id).
+    """
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.state = None
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def _save(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+    @property
+    def high_water_mark(self):
+        return self.state['high_water_mark'] if self.state else {'rows': 0, 'last_id': None}
+
+    def ensure_reference(self, model_version, load_reference):
+        """
+        Build the reference sketches when the model version changed.
+
+        The running aggregates start over for a new model, the high-water mark
+        is kept: rows reported for the previous model are not reported again.
+
+        Args:
+            model_version (str): Version of the served artifacts.
+            load_reference (callable): Returns the cleaned and encoded reference DataFrame,
+                only called when the sketches have to be (re)built.
+        """
+        if self.state is not None and self.state['model_version'] == model_version:
+            return
+        logger.info(f"Building reference sketches for model version {model_version}")
+        reference_df = load_reference()
+        sketches = {column: column_sketch(reference_df[column]) for column, _, _ in DRIFT_TESTS}
+        self.state = {
+            'model_version': model_version,
+            'reference': sketches,
+            'reference_rows': int(reference_df.shape[0]),
+            'current': {column: [0] * len(sketch['counts']) for column, sketch in sketches.items()},
+            'confusion': [[0, 0], [0, 0]],
+            'rows_reported': 0,
+            'high_water_mark': self.high_water_mark,
+            'updated_at': None,
+        }
+        self._save()
+
+    def read_new_rows(self, csv_path):
+        """
+        Read the rows of csv_path past the high-water mark.
+
+        The file only grows at the end (see NewDataStore.compact). If the row at
+        the high-water mark is not the last reported encounter, the file was
+        rebuilt and every row is read again with the running counts reset.
+
+        Returns:
+            tuple: (pandas.DataFrame of the new rows, number of rows skipped).
+        """
+        mark = self.high_water_mark
+        new_df, skipped = read_rows_after(csv_path, mark)
+        if skipped < mark['rows']:
+            # The file was rebuilt, every row is reported again
+            self._reset_running()
+        return new_df, skipped
+
+    def _reset_running(self):
+        self.state['current'] = {column: [0] * len(sketch['counts'])
+                                 for column, sketch in self.state['reference'].items()}
+        self.state['confusion'] = [[0, 0], [0, 0]]
+        self.state['rows_reported'] = 0
+        self.state['high_water_mark'] = {'rows': 0, 'last_id': None}
+
+    def update(self, clean_df, rows_read, last_id, model_versions=None):
+        """
+        Merge the cleaned new rows into the running aggregates and move the high-water mark.
+
+        Args:
+            clean_df (pandas.DataFrame): New rows after cleaning, with the target and
+                Predicted_readmitted columns. Rows without a prediction only count for drift.
+            rows_read (int): Rows of the new data consumed up to and including this batch.
+            last_id (int): encounter_id of the last row consumed.
+            model_versions (pandas.Series, optional): Version of the model that served each
+                row, aligned on clean_df. Only the rows served by the monitored version count
+                for accuracy and precision.
+
+        Returns:
+            dict: The test results of this batch alone, see run_tests.
+        """
+        batch_current = {}
+        for column, sketch in self.state['reference'].items():
+            counts = bin_counts(clean_df[column], np.asarray(sketch['edges']))
+            batch_current[column] = counts
+            self.state['current'][column] = (np.asarray(self.state['current'][column]) + counts).tolist()
+
+        labelled = clean_df[[TARGET_COLUMN, PREDICTION_COLUMN]]
+        if model_versions is not None:
+            labelled = labelled[model_versions == self.state['model_version']]
+        labelled = labelled.dropna().astype(int)
+        batch_confusion = np.zeros((2, 2), dtype=int)
+        np.add.at(batch_confusion, (labelled[TARGET_COLUMN].to_numpy(), labelled[PREDICTION_COLUMN].to_numpy()), 1)
+        self.state['confusion'] = (np.asarray(self.state['confusion']) + batch_confusion).tolist()
+
+        self.state['rows_reported'] += int(clean_df.shape[0])
+        self.state['high_water_mark'] = {'rows': int(rows_read), 'last_id': int(last_id)}
+        self.state['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        self._save()
+        logger.info(f"Merged {clean_df.shape[0]} rows, {self.state['rows_reported']} rows reported "
+                    f"for model version {self.state['model_version']}")
+        return self.run_tests(batch_current, batch_confusion)
+
+    def run_tests(self, current=None, confusion=None):
+        """
+        Evaluate the drift and quality tests, by default on the running aggregates.
+
+        Returns:
+            list: One dict per test with name, column, value, threshold and passed.
+        """
+        current = self.state['current'] if current is None else current
+        confusion = np.asarray(self.state['confusion'] if confusion is None else confusion)
+        results = []
+
+        total = confusion.sum()
+        accuracy = float(np.trace(confusion) / total) if total else None
+        results.append({'name': 'accuracy', 'column': None, 'value': accuracy, 'threshold': MIN_ACCURACY,
+                        'passed': accuracy is None or accuracy >= MIN_ACCURACY})
+        predicted_positive = confusion[:, PRECISION_LABEL].sum()
+        precision = float(confusion[PRECISION_LABEL, PRECISION_LABEL] / predicted_positive) if predicted_positive else 0.0
+        results.append({'name': f'precision_{PRECISION_LABEL}', 'column': None, 'value': precision,
+                        'threshold': MIN_PRECISION, 'passed': total == 0 or precision >= MIN_PRECISION})
+
+        for column, stattest, threshold in DRIFT_TESTS:
+            sketch = self.state['reference'][column]
+            if stattest == 'psi':
+                value = psi(np.asarray(sketch['counts']), np.asarray(current[column]), np.asarray(sketch['groups']))
+                passed = value <= threshold
+            else:
+                _, value = ks_test(sketch['counts'], current[column])
+                passed = value >= threshold
+            results.append({'name': f'{stattest}_drift', 'column': column, 'value': value,
+                            'threshold': threshold, 'passed': bool(passed)})
+        return results
@@ -0,0 +1,292 @@
+"""
+Append-only store for the encounters received by the prediction service.
+
+Every prediction request used to read the whole `new_data/new_data.csv`,
+concatenate the new rows, drop duplicates and rewrite the file, so the cost
+of a request grew with the history and concurrent workers could lose each
+other's writes. `NewDataStore` instead appends each batch to a small JSON
+Lines segment, partitioned by date and hour and owned by a single process:
+
+    new_data/
+        new_data.csv                         compacted history read by training and monitoring
+        encounter_index.sqlite               encounter_id index used for de-duplication
+        segments/date=2024-11-04/part-13-4711.jsonl
+        archive/date=2024-11-04/part-13-4711.jsonl
+
+The SQLite index is the single writer lock: appends and compaction run inside
+an IMMEDIATE transaction, so workers never interleave and an encounter_id is
+only ever stored once. `compact` merges the pending segments into
+`new_data.csv` for the retraining DAG and the monitoring job, and moves the
+merged segments to the archive.
+
+Example:
+    store = NewDataStore('/path/to/src/new_data')
+    store.append(request_df)
+    new_data_path = store.compact()
+"""
+import os
+import glob
+import sqlite3
+import itertools
+import functools
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from ..data_cleaning.schema import COUNT_DTYPES, CATEGORY_COLUMNS, downcast_counts, read_raw_csv
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+ID_COLUMN = 'encounter_id'
+COMPACTED_FILENAME = 'new_data.csv'
+INDEX_FILENAME = 'encounter_index.sqlite'
+
+# Maximum number of parameters per SQLite IN (...) query
+_SQLITE_BATCH = 500
+
+
+def _read_segment(path):
+    """Read a JSON Lines segment with the dtypes read_raw_csv gives."""
+    df = pd.read_json(path, lines=True, dtype=False)
+    df = df.astype({**{col: np.float32 for col in COUNT_DTYPES if col in df.columns},
+                    **{col: 'category' for col in CATEGORY_COLUMNS if col in df.columns}})
+    return downcast_counts(df)
+
+
+def _concat_raw(frames):
+    """
+    Concatenate raw frames, keeping the string columns categorical.
+
+    pd.concat turns category columns with different categories into object
+    columns, one Python string per cell, so the categories are unified first.
+    """
+    for col in CATEGORY_COLUMNS:
+        if all(col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype) for df in frames):
+            categories = functools.reduce(pd.Index.union, [df[col].cat.categories for df in frames])
+            for df in frames:
+                df[col] = df[col].cat.set_categories(categories)
+    return pd.concat(frames, axis=0, ignore_index=True)
+
+
+class NewDataStore:
+    """
+    Append-only, date/hour partitioned store of raw encounters with encounter_id de-duplication.
+
+    Parameters:
+        root_dir (str): The new_data directory holding the segments, the index and new_data.csv.
+        lock_timeout (float): Seconds to wait for another process holding the store lock.
+
+    Attributes:
+        root_dir (str): The new_data directory.
+        segments_dir (str): Directory of the segments not yet merged into new_data.csv.
+        archive_dir (str): Directory the merged segments are moved to.
+        index_path (str): Path of the SQLite encounter_id index.
+        compacted_path (str): Path of new_data.csv.
+    """
+    def __init__(self, root_dir, lock_timeout=30.0):
+        self.root_dir = root_dir
+        self.segments_dir = os.path.join(root_dir, 'segments')
+        self.archive_dir = os.path.join(root_dir, 'archive')
+        self.index_path = os.path.join(root_dir, INDEX_FILENAME)
+        self.compacted_path = os.path.join(root_dir, COMPACTED_FILENAME)
+        self.lock_timeout = lock_timeout
+        os.makedirs(self.segments_dir, exist_ok=True)
+
+    def _connect(self):
+        """
+        Open the index, creating it on first use.
+
+        A new index is seeded with the encounter_ids already in new_data.csv so
+        rows saved before the store existed are not stored a second time.
+        """
+        conn = sqlite3.connect(self.index_path, timeout=self.lock_timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("BEGIN IMMEDIATE")
+        exists = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='encounters'").fetchone()
+        if not exists:
+            conn.execute("CREATE TABLE encounters (encounter_id INTEGER PRIMARY KEY, segment TEXT)")
+            if os.path.exists(self.compacted_path):
+                ids = read_raw_csv(self.compacted_path, usecols=[ID_COLUMN])[ID_COLUMN].unique()
+                conn.executemany("INSERT OR IGNORE INTO encounters VALUES (?, ?)",
+                                 ((int(i), COMPACTED_FILENAME) for i in ids))
+                logger.info(f"Seeded encounter index with {len(ids)} ids from {self.compacted_path}")
+        conn.execute("COMMIT")
+        return conn
+
+    @staticmethod
+    def _known_ids(conn, ids):
+        known = set()
+        for start in range(0, len(ids), _SQLITE_BATCH):
+            batch = ids[start:start + _SQLITE_BATCH]
+            placeholders = ','.join('?' * len(batch))
+            rows = conn.execute(f"SELECT encounter_id FROM encounters WHERE encounter_id IN ({placeholders})",
+                                batch).fetchall()
+            known.update(row[0] for row in rows)
+        return known
+
+    def _segment_path(self, now):
+        # One file per process and hour keeps every segment single-writer
+        partition_dir = os.path.join(self.segments_dir, f"date={now:%Y-%m-%d}")
+        os.makedirs(partition_dir, exist_ok=True)
+        return os.path.join(partition_dir, f"part-{now:%H}-{os.getpid()}.jsonl")
+
+    def append(self, df):
+        """
+        Append the encounters of a batch that are not stored yet.
+
+        Args:
+            df (pandas.DataFrame): Raw encounters, must contain an encounter_id column.
+
+        Returns:
+            int: Number of rows appended.
+        """
+        if ID_COLUMN not in df.columns:
+            raise ValueError(f"New data must contain an {ID_COLUMN} column to be stored")
+
+        batch = df.drop_duplicates(subset=[ID_COLUMN])
+        ids = [int(i) for i in batch[ID_COLUMN]]
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            known = self._known_ids(conn, ids)
+            new_rows = batch[~batch[ID_COLUMN].isin(known)]
+            if new_rows.empty:
+                conn.execute("COMMIT")
+                logger.info("All encounters of the batch are already stored")
+                return 0
+
+            segment_path = self._segment_path(datetime.now())
+            lines = new_rows.to_json(orient='records', lines=True)
+            with open(segment_path, 'a') as f:
+                f.write(lines if lines.endswith('\n') else lines + '\n')
+            segment = os.path.relpath(segment_path, self.root_dir)
+            conn.executemany("INSERT INTO encounters VALUES (?, ?)",
+                             ((int(i), segment) for i in new_rows[ID_COLUMN]))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        logger.info(f"Appended {len(new_rows)} new encounters to {segment}")
+        return len(new_rows)
+
+    def pending_segments(self):
+        """Return the segment files not yet merged into new_data.csv, oldest partition first."""
+        return sorted(glob.glob(os.path.join(self.segments_dir, 'date=*', '*.jsonl')))
+
+    def _archive(self, path):
+        archived_path = os.path.join(self.archive_dir, os.path.relpath(path, self.segments_dir))
+        os.makedirs(os.path.dirname(archived_path), exist_ok=True)
+        if os.path.exists(archived_path):
+            # The same process appended to this hour's segment again after an earlier compaction
+            with open(path) as src, open(archived_path, 'a') as dst:
+                dst.write(src.read())
+            os.remove(path)
+        else:
+            os.replace(path, archived_path)
+
+    def compact(self):
+        """
+        Merge the pending segments into new_data.csv and archive them.
+
+        new_data.csv is rewritten to a temporary file and moved into place, so
+        readers always see a complete file. The rows are merged with the dtypes
+        of schema.RAW_SCHEMA. Compaction runs once per retraining or monitoring
+        run, not per prediction.
+
+        Returns:
+            str: Path of new_data.csv, or None if there is no data at all.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            segments = self.pending_segments()
+            if segments:
+                frames = []
+                if os.path.exists(self.compacted_path):
+                    frames.append(read_raw_csv(self.compacted_path))
+                for path in segments:
+                    frames.append(_read_segment(path))
+                combined_df = _concat_raw(frames)
+                combined_df = combined_df.drop_duplicates(subset=[ID_COLUMN])
+
+                tmp_path = f"{self.compacted_path}.tmp"
+                combined_df.to_csv(tmp_path, index=False)
+                os.replace(tmp_path, self.compacted_path)
+
+                for path in segments:
+                    self._archive(path)
+                logger.info(f"Compacted {len(segments)} segments into {self.compacted_path} ({combined_df.shape[0]} rows)")
+            else:
+                logger.info("No pending segments to compact")
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        return self.compacted_path if os.path.exists(self.compacted_path) else None
+
+
+def compact_new_data(new_data_path):
+    """
+    Compact the store holding new_data_path (a new_data.csv path) and return that path.
+
+    Used by the retraining DAG and the monitoring job before they read the new data.
+    """
+    store = NewDataStore(os.path.dirname(new_data_path))
+    store.compact()
+    return new_data_path
+
+
+def high_water_mark(csv_path):
+    """
+    Return the high-water mark of the end of new_data.csv: its number of rows and last encounter_id.
+
+    Returns:
+        dict: rows and last_id, 0 and None when the file does not exist.
+    """
+    if csv_path is None or not os.path.exists(csv_path):
+        return {'rows': 0, 'last_id': None}
+    ids = read_raw_csv(csv_path, usecols=[ID_COLUMN])[ID_COLUMN]
+    return {'rows': int(ids.shape[0]), 'last_id': int(ids.iloc[-1]) if ids.shape[0] else None}
+
+
+def read_rows_after(csv_path, mark):
+    """
+    Read the rows of new_data.csv past a high-water mark.
+
+    The file only grows at the end (see NewDataStore.compact). If the row at
+    the high-water mark is not the encounter it recorded, the file was rebuilt
+    and every row is read again.
+
+    Args:
+        csv_path (str): new_data.csv path.
+        mark (dict): rows and last_id of the last row already consumed, see high_water_mark.
+
+    Returns:
+        tuple: (pandas.DataFrame of the new rows, number of rows skipped). Fewer rows
+            skipped than mark['rows'] means the file was rebuilt.
+    """
+    skip = mark['rows']
+    with open(csv_path) as f:
+        header = next(f).rstrip('\r\n').split(',')
+        if skip > 0:
+            # Keep the last consumed row to check the file was only appended to
+            for _ in itertools.islice(f, skip - 1):
+                pass
+            last_line = next(f, None)
+            last_id = int(last_line.split(',')[header.index(ID_COLUMN)]) if last_line else None
+            if last_id != mark['last_id']:
+                logger.warning(f"{csv_path} was rebuilt since the high-water mark, reading all of its rows again")
+                return read_raw_csv(csv_path), 0
+        new_df = read_raw_csv(f, names=header, header=None)
+    return new_df, skip
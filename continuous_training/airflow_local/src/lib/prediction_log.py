@@ -0,0 +1,120 @@
+"""
+Log of the predictions served by the prediction service.
+
+The monitoring job used to rebuild a predictor and re-score every stored
+encounter to compare predictions with labels, with whatever model was
+promoted at monitoring time. The prediction service now records, for each
+encounter it scores, the prediction it answered and the version of the
+model that produced it:
+
+    new_data/prediction_log.sqlite
+        predictions (encounter_id PRIMARY KEY, patient_nbr, prediction, model_version, scored_at)
+
+The first prediction of an encounter is kept, like `NewDataStore` keeps the
+first copy of its raw row. The monitor joins the labels of the new rows
+against the log on encounter_id, no model is loaded and nothing is scored.
+
+Example:
+    log = PredictionLog('/path/to/src/new_data/prediction_log.sqlite')
+    log.record(encounter_ids, patient_ids, y_pred, artifacts.version)
+    logged = log.lookup(new_df['encounter_id'])
+"""
+import os
+import time
+import sqlite3
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PREDICTION_LOG_FILENAME = 'prediction_log.sqlite'
+PREDICTION_LOG_ENABLED = os.getenv('MEDIWATCH_PREDICTION_LOG', '1') == '1'
+
+
+class PredictionLog:
+    """
+    SQLite log of the served predictions keyed by encounter_id.
+
+    Parameters:
+        path (str): SQLite database file, shared by the workers of a host and the monitoring job.
+        lock_timeout (float): Seconds to wait for another process writing the log.
+    """
+    def __init__(self, path, lock_timeout=30.0):
+        self.path = path
+        self.lock_timeout = lock_timeout
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS predictions (encounter_id INTEGER PRIMARY KEY, patient_nbr INTEGER, "
+                         "prediction INTEGER, model_version TEXT, scored_at REAL)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.lock_timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def record(self, encounter_ids, patient_ids, predictions, model_version):
+        """
+        Log the predictions of one request. Encounters already logged keep their first prediction.
+
+        Args:
+            encounter_ids (array-like): encounter_id of each scored row.
+            patient_ids (array-like): patient_nbr of each scored row.
+            predictions (array-like): Prediction of each row.
+            model_version (str): Version of the artifacts that scored the rows.
+
+        Returns:
+            int: Number of predictions logged.
+        """
+        if len(encounter_ids) == 0:
+            return 0
+        now = time.time()
+        rows = [(int(encounter_id), int(patient_id), int(prediction), model_version, now)
+                for encounter_id, patient_id, prediction in zip(encounter_ids, patient_ids, predictions)]
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO predictions VALUES (?, ?, ?, ?, ?)", rows)
+            logged = conn.total_changes - before
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return logged
+
+    def lookup(self, encounter_ids):
+        """
+        Return the logged predictions of the given encounters.
+
+        The ids are loaded into a temporary table and joined in one query, which
+        stays fast for millions of ids.
+
+        Args:
+            encounter_ids (array-like): encounter_ids to look up.
+
+        Returns:
+            pandas.DataFrame: prediction, model_version and scored_at indexed by encounter_id,
+                for the encounters found in the log.
+        """
+        ids = pd.unique(pd.Series(encounter_ids, dtype='int64'))
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TEMP TABLE wanted (encounter_id INTEGER PRIMARY KEY)")
+            # One transaction, the connection autocommits every statement otherwise
+            conn.execute("BEGIN")
+            conn.executemany("INSERT INTO wanted VALUES (?)", ((i,) for i in ids.tolist()))
+            logged = pd.read_sql_query(
+                "SELECT encounter_id, prediction, model_version, scored_at FROM predictions "
+                "JOIN wanted USING (encounter_id)", conn)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return logged.set_index('encounter_id')
@@ -0,0 +1,152 @@
+"""
+Micro-batching of concurrent scoring calls.
+
+`scaler.transform` and `model.predict` have a high fixed cost per call, and
+a /predict request usually carries a handful of rows. When several requests
+are scored at the same time in one process (the ASGI app's thread pool, or
+gunicorn's gthread workers), `MicroBatcher` collects their feature rows for
+at most `max_wait` seconds or `max_rows` rows, scores them in one vectorized
+call and hands every caller its own slice of the predictions.
+
+Rows are only batched with rows scored by the same artifacts, so a model
+swap never mixes two versions in one call. With sync gunicorn workers each
+process scores one request at a time and batching only adds the wait, so it
+is off by default (MEDIWATCH_MICRO_BATCH=1 turns it on).
+
+Example:
+    batcher = MicroBatcher(max_rows=512, max_wait=0.005)
+    y_pred = batcher.predict(artifacts, X_new)
+"""
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+from .metrics import QUEUE_DEPTH, stage_timer
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MICRO_BATCH_ENABLED = os.getenv('MEDIWATCH_MICRO_BATCH', '0') == '1'
+DEFAULT_MAX_ROWS = int(os.getenv('MEDIWATCH_MICRO_BATCH_MAX_ROWS', '512'))
+DEFAULT_MAX_WAIT = float(os.getenv('MEDIWATCH_MICRO_BATCH_MAX_WAIT_MS', '5')) / 1000
+
+
+def score_features(artifacts, X):
+    """Scale the encoded features and predict with the model of the artifacts."""
+    with stage_timer('scale'):
+        # The trainer scales float32 features, the codes and counters are exact in float32
+        X_scaled = artifacts.scaler.transform(X.astype(np.float32))
+    with stage_timer('predict'):
+        return artifacts.model.predict(X_scaled)
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent scoring calls into one model call.
+
+    Parameters:
+        max_rows (int): A batch is scored as soon as it holds this many rows.
+        max_wait (float): Seconds the first request of a batch waits for others.
+        score_fn (callable): score_fn(artifacts, X) -> predictions, defaults to score_features.
+
+    Attributes:
+        batches (int): Number of model calls made.
+        rows (int): Number of rows scored.
+    """
+    def __init__(self, max_rows=DEFAULT_MAX_ROWS, max_wait=DEFAULT_MAX_WAIT, score_fn=score_features):
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.score_fn = score_fn
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_worker(self):
+        # A batcher created before gunicorn forks has no thread in the worker, start one per process
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._thread.start()
+                logger.info(f"Started micro-batcher (max {self.max_rows} rows, {self.max_wait * 1000:.1f} ms)")
+
+    def predict(self, artifacts, X):
+        """
+        Score X with the artifacts, together with the rows of concurrent callers.
+
+        Args:
+            artifacts (LoadedArtifacts): Model and scaler to score with.
+            X (pandas.DataFrame): Encoded features of one request.
+
+        Returns:
+            numpy.ndarray: Predictions for the rows of X, in order.
+        """
+        if len(X) == 0:
+            return self.score_fn(artifacts, X)
+        self._ensure_worker()
+        future = Future()
+        QUEUE_DEPTH.labels('micro_batch').inc()
+        try:
+            self._queue.put((artifacts, X, future))
+            return future.result()
+        finally:
+            QUEUE_DEPTH.labels('micro_batch').dec()
+
+    def _collect(self, first):
+        """Gather requests scored by the same artifacts as first, within the size and time limits."""
+        batch = [first]
+        rows = len(first[1])
+        deadline = time.monotonic() + self.max_wait
+        leftover = None
+        while rows < self.max_rows:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item[0] is not first[0]:
+                # Scored by another model version, it starts the next batch
+                leftover = item
+                break
+            batch.append(item)
+            rows += len(item[1])
+        return batch, leftover
+
+    def _score_batch(self, batch):
+        artifacts = batch[0][0]
+        frames = [X for _, X, _ in batch]
+        try:
+            if len(frames) == 1:
+                X = frames[0]
+            else:
+                X = pd.DataFrame(np.concatenate([frame.to_numpy() for frame in frames]), columns=frames[0].columns)
+            y_pred = np.asarray(self.score_fn(artifacts, X))
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.rows += len(y_pred)
+        offset = 0
+        for _, frame, future in batch:
+            future.set_result(y_pred[offset:offset + len(frame)])
+            offset += len(frame)
+
+    def _run(self):
+        leftover = None
+        while True:
+            first = leftover if leftover is not None else self._queue.get()
+            batch, leftover = self._collect(first)
+            self._score_batch(batch)
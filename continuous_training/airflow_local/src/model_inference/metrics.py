@@ -0,0 +1,172 @@
+"""
+Prometheus metrics of the prediction service.
+
+Every stage of the request path is timed in one histogram,
+`mediwatch_stage_seconds{stage=...}`:
+
+- decode:       base64/CSV parsing of the upload
+- cache_lookup: prediction cache lookup of the raw rows
+- persist:      append of the raw rows to the new data store
+- clean:        cleaning and encoding with the fitted preprocessor
+- scale:        scaler.transform
+- predict:      model.predict
+- cache_store:  saving the fresh predictions to the prediction cache
+- prediction_log: recording the answered predictions for the monitoring job
+- model_load:   (re)load of the artifacts by the model registry
+
+Next to it, per route: request latency, rows per request, requests and
+errors by type; and the model loads, prediction cache hits/misses and the
+depth of the scoring queues (micro-batcher, ASGI executor).
+
+gunicorn runs several worker processes, each with its own counters. When
+PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py does it), every worker
+writes its values to that directory and `render_metrics` aggregates all of
+them, so any worker can answer /metrics. Without it, /metrics only shows the
+worker that answered.
+
+prometheus_client is only needed by the serving image. When it is not
+installed the metrics below are no-ops, so training and monitoring code can
+import the predictor without it.
+
+Example:
+    with stage_timer('clean'):
+        clean_df = cleanObj.clean_data(preprocessor=artifacts.preprocessor)
+"""
+import os
+import time
+import inspect
+import functools
+from contextlib import contextmanager
+import logging
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MULTIPROC_DIR_ENV = 'PROMETHEUS_MULTIPROC_DIR'
+
+# Stages take from a fraction of a millisecond (cache lookup of one row) to minutes (a large batch)
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+_ROWS_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+
+
+class _NoOpMetric:
+    """Stand-in for a metric when prometheus_client is not installed."""
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _metric(kind, name, documentation, labelnames=(), **kwargs):
+    if prometheus_client is None:
+        return _NoOpMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labelnames, **kwargs)
+
+
+STAGE_SECONDS = _metric('Histogram', 'mediwatch_stage_seconds', "Time spent in each stage of scoring",
+                        ['stage'], buckets=_LATENCY_BUCKETS)
+REQUEST_SECONDS = _metric('Histogram', 'mediwatch_request_seconds', "Request latency by route",
+                          ['route'], buckets=_LATENCY_BUCKETS)
+REQUEST_ROWS = _metric('Histogram', 'mediwatch_request_rows', "Rows received per request by route",
+                       ['route'], buckets=_ROWS_BUCKETS)
+REQUESTS = _metric('Counter', 'mediwatch_requests', "Requests by route", ['route'])
+ERRORS = _metric('Counter', 'mediwatch_errors', "Failed requests by route and error type", ['route', 'error'])
+MODEL_LOADS = _metric('Counter', 'mediwatch_model_loads', "Artifact loads by the model registry by outcome",
+                      ['outcome'])
+PREDICTION_CACHE_ROWS = _metric('Counter', 'mediwatch_prediction_cache_rows', "Rows looked up in the prediction cache",
+                                ['result'])
+QUEUE_DEPTH = _metric('Gauge', 'mediwatch_queue_depth', "Requests waiting for or being scored by a scoring queue",
+                      ['queue'], multiprocess_mode='livesum')
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time the body of the with statement as one observation of the given stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def record_error(route, error):
+    """Count a failed request of route, error is an exception or an error type name."""
+    ERRORS.labels(route, error if isinstance(error, str) else type(error).__name__).inc()
+
+
+def track_request(route):
+    """
+    Decorate a request handler to count it, time it and count its exceptions.
+
+    Works for plain and async handlers. A streaming response is timed until
+    the handler returns it, not until the last byte is sent.
+    """
+    def decorator(handler):
+        def _finish(start):
+            REQUEST_SECONDS.labels(route).observe(time.perf_counter() - start)
+
+        if inspect.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def async_wrapper(*args, **kwargs):
+                REQUESTS.labels(route).inc()
+                start = time.perf_counter()
+                try:
+                    return await handler(*args, **kwargs)
+                except Exception as e:
+                    record_error(route, e)
+                    raise
+                finally:
+                    _finish(start)
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            REQUESTS.labels(route).inc()
+            start = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            except Exception as e:
+                record_error(route, e)
+                raise
+            finally:
+                _finish(start)
+        return wrapper
+    return decorator
+
+
+def render_metrics():
+    """
+    Return (body, content type) of the current metrics in the Prometheus text format.
+
+    Aggregates every worker of the host when PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    if prometheus_client is None:
+        return "# prometheus_client is not installed\n", 'text/plain; charset=utf-8'
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Drop the live gauges of a dead worker, called by the gunicorn child_exit hook."""
+    if prometheus_client is not None and os.environ.get(MULTIPROC_DIR_ENV):
+        multiprocess.mark_process_dead(pid)
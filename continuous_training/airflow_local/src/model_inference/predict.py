@@ -1,54 +1,76 @@
 import os
-import joblib
+from collections import namedtuple
+import numpy as np
 import pandas as pd
 from ..data_cleaning.clean import clean
+from ..data_cleaning.common import PROFILE_OFF
+from ..data_cleaning.schema import read_raw_csv
+from ..data_cleaning.recode import RECODING_TABLE, recode_series
+from ..lib.new_data_store import NewDataStore
+from ..lib.prediction_log import PredictionLog, PREDICTION_LOG_ENABLED, PREDICTION_LOG_FILENAME
+from .registry import get_model_registry
+from .batching import MicroBatcher, MICRO_BATCH_ENABLED, score_features
+from .prediction_cache import PredictionCache, PREDICTION_CACHE_ENABLED, CACHE_FILENAME
+from .metrics import PREDICTION_CACHE_ROWS, stage_timer
 import logging
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Aligned numpy arrays, one entry per input row kept by the cleaning step. row is its position in the input.
+Predictions = namedtuple('Predictions', ['row', 'encounter_id', 'patient_id', 'readmitted', 'predicted_readmitted',
+                                         'model_version'])
+
 
 class DiabetesReadmissionPredictor:
-    def __init__(self, filename, model_dir):
+    def __init__(self, filename=None, model_dir=None, micro_batching=MICRO_BATCH_ENABLED,
+                 prediction_cache=PREDICTION_CACHE_ENABLED, prediction_log=PREDICTION_LOG_ENABLED):
         self.filename = filename
         self.model_dir = model_dir
+        self.registry = get_model_registry(self.model_dir)
+        # Coalesces the scoring of concurrent requests, only useful with several request threads per process
+        self.batcher = MicroBatcher() if micro_batching else None
+        # The new_data directory and the prediction cache sit next to the models directory
+        src_dir = os.path.dirname(os.path.dirname(self.model_dir))
+        self.new_data_store = NewDataStore(os.path.join(src_dir, 'new_data'))
+        # Shared by the workers of the host, repeated rows skip cleaning and scoring
+        self.prediction_cache = PredictionCache(os.path.join(src_dir, CACHE_FILENAME)) if prediction_cache else None
+        # What was answered for each encounter and by which model version, read by the monitoring job
+        self.prediction_log = None
+        if prediction_log:
+            self.prediction_log = PredictionLog(os.path.join(self.new_data_store.root_dir, PREDICTION_LOG_FILENAME))
         logger.info(f"Initializing Diabetes Readmission Predictor with file: {self.filename} and best model at {self.model_dir}")
 
-    def merge_or_save_new_data(self):
-        # Define the path to the new_data directory and new_data.csv file
-        new_data_dir = os.path.join(os.path.dirname(os.path.dirname(self.model_dir)), 'new_data')
-        new_data_path = os.path.join(new_data_dir, "new_data.csv")
-        
-        # Ensure the new_data directory exists
-        os.makedirs(new_data_dir, exist_ok=True)
+    def merge_or_save_new_data(self, new_data_df=None):
+        """
+        Append the raw input data to the append-only new data store.
 
-        # Load the new data from self.filename
-        new_data_df = pd.read_csv(self.filename)
+        Only encounters not seen before are written, to a segment owned by this
+        process. new_data.csv is no longer rewritten per request, it is rebuilt
+        by NewDataStore.compact before retraining and monitoring.
 
-        if os.path.exists(new_data_path):
-            # If new_data.csv exists, load and concatenate with the new data
-            existing_data_df = pd.read_csv(new_data_path)
-            combined_df = pd.concat([existing_data_df, new_data_df], axis=0, ignore_index=True)
-            logger.info("Merged new data with existing new_data.csv")
-        else:
-            # If new_data.csv doesn't exist, use new_data_df directly
-            combined_df = new_data_df
-            logger.info("Saving new data as new_data.csv")
-        
-        # Remove exact duplicate rows
-        combined_df = combined_df.drop_duplicates()
+        Args:
+            new_data_df (pandas.DataFrame, optional): Raw input data. Read from self.filename when omitted.
+        """
+        # Load the new data from self.filename unless the caller already has it in memory
+        if new_data_df is None:
+            new_data_df = read_raw_csv(self.filename)
 
-        # Save the combined data back to new_data.csv
-        combined_df.to_csv(new_data_path, index=False)
-        logger.info("Data merged, duplicates removed, and saved to new_data.csv")
+        with stage_timer('persist'):
+            appended = self.new_data_store.append(new_data_df)
+        logger.info(f"Stored {appended} new encounters in {self.new_data_store.root_dir}")
     
-    def prediction_diabetes_readmission(self):
+    def prediction_diabetes_readmission(self, df=None):
         """
         Predict diabetes patient readmission using the trained model.
 
+        Args:
+            df (pandas.DataFrame, optional): Raw input data already parsed in memory.
+                When omitted the data is read from self.filename.
+
         Process:
-        1. Loads and cleans the input data using the clean module
-        2. Loads the trained model and scaler
+        1. Fetches the trained model, scaler and preprocessor from the process-wide model registry
+        2. Loads and cleans the input data using the clean module and the fitted preprocessor
         3. Scales the features using the saved scaler
         4. Makes predictions using the model
         5. Returns results with patient IDs and predictions
@@ -56,42 +78,168 @@ class DiabetesReadmissionPredictor:
         Returns:
             list: A list containing a dictionary with predictions in the format:
                 [{'Hospital Readmission Prediction': [
-                    {'patient_id': id, 'readmitted': actual, 'predicted_readmitted': pred},
+                    {'encounter_id': id, 'patient_id': id, 'readmitted': actual, 'predicted_readmitted': pred},
                     ...
                 ]}]
+
+        Building one dict per row is only worth it for a JSON response, use
+        predict_arrays for anything else.
         """
-        logger.info("Loading the original data ..........")
-        original_df = pd.read_csv(self.filename)
-        patient_id = original_df['patient_nbr']
-        
-        logger.info("Invoking cleaning module to clean new data ..........")
-        cleanObj = clean(self.filename)
-        clean_df = cleanObj.clean_data()
+        if df is None:
+            logger.info("Loading the original data ..........")
+            df = read_raw_csv(self.filename)
+
+        result_df = self.score_chunk(df)
+
+        # Convert the DataFrame to a dictionary
+        result_dict = result_df.to_dict(orient='records')
+
+        return [{"Hospital Readmission Prediction": result_dict}]
+
+    def predict_arrays(self, df):
+        """
+        Score raw encounters and return the results as aligned arrays.
+
+        Cleaning keeps the row index, so every prediction carries the identity of
+        its input row: a caller joins on encounter_id, or takes input rows by
+        position with Predictions.row. Patients with several encounters keep one
+        prediction per encounter.
 
-        # Merge or save the cleaned data
-        self.merge_or_save_new_data()
+        Args:
+            df (pandas.DataFrame): Raw input data with a unique index.
+
+        Returns:
+            Predictions: namedtuple of numpy arrays (row, encounter_id, patient_id, readmitted,
+                predicted_readmitted) and the model_version that scored them.
+        """
+        artifacts = self.registry.get()
+        result_df = self.score_chunk(df, artifacts=artifacts)
+        return Predictions(row=df.index.get_indexer(result_df.index),
+                           encounter_id=result_df['encounter_id'].to_numpy(),
+                           patient_id=result_df['patient_id'].to_numpy(),
+                           readmitted=result_df['readmitted'].to_numpy(),
+                           predicted_readmitted=result_df['predicted_readmitted'].to_numpy(),
+                           model_version=artifacts.version)
+
+    def score_chunk(self, df, artifacts=None):
+        """
+        Clean, store and score one DataFrame of raw encounters.
+
+        Rows already scored by the same model version are answered from the
+        prediction cache, only the others are cleaned and scored. The answered
+        predictions are written to the prediction log with the model version.
+
+        Args:
+            df (pandas.DataFrame): Raw input data.
+            artifacts (LoadedArtifacts, optional): Artifacts to score with. Fetched from
+                the registry when omitted.
+
+        Returns:
+            pandas.DataFrame: encounter_id, patient_id, readmitted and predicted_readmitted for
+                every row kept by the cleaning step, in input order and with the input index.
+        """
+        # The registry loads the model once per process and reloads it only when it changes on disk
+        if artifacts is None:
+            artifacts = self.registry.get()
+
+        # Append the raw input data to the new data store
+        self.merge_or_save_new_data(df)
+
+        # Per-batch encoding depends on the other rows of the batch, only fitted encoding is cacheable
+        if self.prediction_cache is None or artifacts.preprocessor is None:
+            result_df = self._clean_and_score(df, artifacts)
+            self._log_predictions(result_df, artifacts)
+            return result_df
+
+        with stage_timer('cache_lookup'):
+            keys = self.prediction_cache.row_keys(df)
+            cached = self.prediction_cache.lookup(artifacts.version, keys)
+            hit = keys.isin(cached).to_numpy()
+        PREDICTION_CACHE_ROWS.labels('hit').inc(int(hit.sum()))
+        PREDICTION_CACHE_ROWS.labels('miss').inc(int((~hit).sum()))
+        logger.info(f"Prediction cache: {hit.sum()} hits, {(~hit).sum()} misses")
+
+        results = []
+        if hit.any():
+            hit_df = df[hit]
+            readmitted = recode_series(hit_df['readmitted'], RECODING_TABLE['readmitted'])
+            results.append(pd.DataFrame({
+                'encounter_id': hit_df['encounter_id'],
+                'patient_id': hit_df['patient_nbr'],
+                'readmitted': readmitted.fillna(artifacts.preprocessor.fill_values['readmitted']).astype(int),
+                'predicted_readmitted': keys[hit].map(cached)
+            }))
+        if not hit.all():
+            scored_df = self._clean_and_score(df[~hit], artifacts)
+            if scored_df.shape[0]:
+                with stage_timer('cache_store'):
+                    self.prediction_cache.store(artifacts.version, keys.loc[scored_df.index], scored_df['predicted_readmitted'])
+            results.append(scored_df)
+
+        result_df = pd.concat(results) if len(results) > 1 else results[0]
+        # Back to input order, rows dropped by the cleaning step stay out
+        result_df = result_df.loc[df.index[df.index.isin(result_df.index)]]
+        self._log_predictions(result_df, artifacts)
+        return result_df
+
+    def _log_predictions(self, result_df, artifacts):
+        if self.prediction_log is None:
+            return
+        with stage_timer('prediction_log'):
+            self.prediction_log.record(result_df['encounter_id'], result_df['patient_id'],
+                                       result_df['predicted_readmitted'], artifacts.version)
+
+    def _clean_and_score(self, df, artifacts):
+        logger.info("Invoking cleaning module to clean new data ..........")
+        # Diagnostic scans are pure overhead on the request path
+        with stage_timer('clean'):
+            cleanObj = clean(df=df, profile_level=PROFILE_OFF)
+            clean_df = cleanObj.clean_data(preprocessor=artifacts.preprocessor)
 
         # This is non-scaled data so we need to apply scaler here before we do predictions
         
-        logger.info("Loading the best model ..........")
-        loaded_model = joblib.load(os.path.join(self.model_dir, 'best_model.joblib'))
-        loaded_scaler = joblib.load(os.path.join(self.model_dir, 'best_scaler.joblib'))
-
         y_actual = clean_df['readmitted']
         X_new = clean_df.drop('readmitted', axis=1)
-        X_new_scaled = loaded_scaler.transform(X_new)
 
-        # Predicting the patient readmission
-        y_pred = loaded_model.predict(X_new_scaled)
+        # Predicting the patient readmission, scaled with the saved scaler
+        if clean_df.shape[0] == 0:
+            # Cleaning dropped every row, e.g. Unknown/Invalid gender, the scaler cannot transform 0 rows
+            logger.info("No row of the batch is left after cleaning, nothing to score")
+            y_pred = np.empty(0, dtype=int)
+        elif self.batcher is not None:
+            y_pred = self.batcher.predict(artifacts, X_new)
+        else:
+            y_pred = score_features(artifacts, X_new)
 
-        # Creating the result DataFrame
-        result_df = pd.DataFrame({
-            'patient_id': patient_id,
+        # Creating the result DataFrame, on the rows the cleaning step kept
+        return pd.DataFrame({
+            'encounter_id': df['encounter_id'].loc[clean_df.index],
+            'patient_id': df['patient_nbr'].loc[clean_df.index],
             'readmitted': y_actual,
             'predicted_readmitted': y_pred
         })
 
-        # Convert the DataFrame to a dictionary
-        result_dict = result_df.to_dict(orient='records')
+    def score_chunks(self, chunks):
+        """
+        Score an iterable of raw DataFrames one at a time.
+
+        All chunks are scored with the artifacts loaded when the first chunk
+        arrives, so a long upload is never split across two model versions.
 
-        return [{"Hospital Readmission Prediction": result_dict}]
\ No newline at end of file
+        Args:
+            chunks (iterable): pandas.DataFrame chunks, e.g. from pd.read_csv(..., chunksize=n).
+
+        Yields:
+            pandas.DataFrame: The score_chunk result of each chunk.
+        """
+        artifacts = None
+        chunks = iter(chunks)
+        while True:
+            # Reading the next chunk parses that part of the upload
+            with stage_timer('decode'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            if artifacts is None:
+                artifacts = self.registry.get()
+            yield self.score_chunk(chunk, artifacts=artifacts)
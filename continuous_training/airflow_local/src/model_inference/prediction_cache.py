@@ -0,0 +1,209 @@
+"""
+Cache of prediction results shared by the gunicorn workers of one host.
+
+EHR integrations resubmit the same encounters (retries, overlapping export
+windows, refreshes of the same CSV in the UI). `PredictionCache` stores the
+prediction of every scored row in SQLite, keyed by:
+
+- a 64-bit hash of the raw feature values of the row (every column except
+  encounter_id, patient_nbr and readmitted, in a fixed column order), and
+- the version of the model artifacts that scored it.
+
+Keying on the raw row lets a repeated row skip cleaning and scoring entirely.
+This is only correct because the fitted preprocessor encodes every row on its
+own; models served without one are encoded per batch and are never cached.
+
+When a request arrives with a new model version, the entries of every other
+version are deleted, so a swapped `best_model` never serves stale results.
+Entries also expire after `ttl` seconds and the oldest are evicted beyond
+`max_entries`. Hit and miss counters are kept per process and, shared by all
+workers, in the database.
+
+Example:
+    cache = PredictionCache('/path/to/src/prediction_cache.sqlite')
+    keys = cache.row_keys(raw_df)
+    known = cache.lookup(artifacts.version, keys)
+    cache.store(artifacts.version, keys[scored_rows], y_pred)
+"""
+import os
+import time
+import sqlite3
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Columns that identify the encounter or hold the label, they do not change the prediction
+NON_FEATURE_COLUMNS = ('encounter_id', 'patient_nbr', 'readmitted')
+
+CACHE_FILENAME = 'prediction_cache.sqlite'
+PREDICTION_CACHE_ENABLED = os.getenv('MEDIWATCH_PREDICTION_CACHE', '1') == '1'
+DEFAULT_TTL = float(os.getenv('MEDIWATCH_PREDICTION_CACHE_TTL', str(24 * 3600)))
+DEFAULT_MAX_ENTRIES = int(os.getenv('MEDIWATCH_PREDICTION_CACHE_MAX_ENTRIES', '1000000'))
+
+# Maximum number of parameters per SQLite IN (...) query
+_SQLITE_BATCH = 500
+
+# The size limit is enforced every this many stores, counting the table is not free
+_EVICTION_EVERY = 100
+
+
+class PredictionCache:
+    """
+    SQLite-backed cache of predictions keyed by raw feature row hash and model version.
+
+    Parameters:
+        path (str): SQLite database file, shared by the workers of a host.
+        ttl (float): Seconds an entry stays valid.
+        max_entries (int): Entries kept, the oldest are evicted beyond this.
+        lock_timeout (float): Seconds to wait for another process writing the cache.
+
+    Attributes:
+        hits (int): Rows answered from the cache by this process.
+        misses (int): Rows this process had to score.
+    """
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, lock_timeout=30.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock_timeout = lock_timeout
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        self._stores = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS predictions (model_version TEXT, row_hash INTEGER, "
+                         "prediction INTEGER, created_at REAL, PRIMARY KEY (model_version, row_hash)) WITHOUT ROWID")
+            conn.execute("CREATE INDEX IF NOT EXISTS predictions_created_at ON predictions (created_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+            conn.executemany("INSERT OR IGNORE INTO meta VALUES (?, ?)",
+                             [('model_version', None), ('hits', 0), ('misses', 0)])
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.lock_timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def row_keys(df):
+        """
+        Return the 64-bit hash of the raw feature values of each row, as int64 for SQLite.
+
+        Args:
+            df (pandas.DataFrame): Raw input rows.
+
+        Returns:
+            pandas.Series: One key per row, with the index of df.
+        """
+        columns = sorted(col for col in df.columns if col not in NON_FEATURE_COLUMNS)
+        hashes = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+        return pd.Series(hashes.view(np.int64), index=df.index)
+
+    def _invalidate_other_versions(self, conn, version):
+        # Runs inside the caller's write transaction, once per process and model version
+        current = conn.execute("SELECT value FROM meta WHERE key = 'model_version'").fetchone()[0]
+        if current != version:
+            deleted = conn.execute("DELETE FROM predictions WHERE model_version != ?", (version,)).rowcount
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'model_version'", (version,))
+            logger.info(f"Prediction cache switched to model version {version}, dropped {deleted} entries")
+        self._version = version
+
+    def lookup(self, version, keys):
+        """
+        Return the cached predictions of the keys scored by the given model version.
+
+        Args:
+            version (str): Version of the artifacts that will score the misses.
+            keys (pandas.Series): Output of row_keys.
+
+        Returns:
+            dict: Key -> prediction for the keys found in the cache.
+        """
+        unique_keys = [int(key) for key in pd.unique(keys)]
+        min_created_at = time.time() - self.ttl
+        found = {}
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if version != self._version:
+                self._invalidate_other_versions(conn, version)
+            for start in range(0, len(unique_keys), _SQLITE_BATCH):
+                batch = unique_keys[start:start + _SQLITE_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                rows = conn.execute(
+                    f"SELECT row_hash, prediction FROM predictions WHERE model_version = ? "
+                    f"AND created_at >= ? AND row_hash IN ({placeholders})",
+                    [version, min_created_at] + batch).fetchall()
+                found.update(rows)
+            hits = int(keys.isin(found).sum())
+            conn.execute("UPDATE meta SET value = value + ? WHERE key = 'hits'", (hits,))
+            conn.execute("UPDATE meta SET value = value + ? WHERE key = 'misses'", (len(keys) - hits,))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def store(self, version, keys, predictions):
+        """
+        Save the predictions of freshly scored rows.
+
+        Args:
+            version (str): Version of the artifacts that scored the rows.
+            keys (pandas.Series): row_keys of the scored rows.
+            predictions (array-like): Prediction of each row, in the order of keys.
+        """
+        if len(keys) == 0:
+            return
+        now = time.time()
+        rows = [(version, int(key), int(prediction), now) for key, prediction in zip(keys, predictions)]
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if version != self._version:
+                self._invalidate_other_versions(conn, version)
+            conn.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)", rows)
+            conn.execute("DELETE FROM predictions WHERE created_at < ?", (now - self.ttl,))
+            self._stores += 1
+            if self._stores % _EVICTION_EVERY == 0:
+                excess = conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0] - self.max_entries
+                if excess > 0:
+                    conn.execute("DELETE FROM predictions WHERE row_hash IN "
+                                 "(SELECT row_hash FROM predictions ORDER BY created_at LIMIT ?)", (excess,))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Return the hit and miss counters of this process and of all workers sharing the cache."""
+        conn = self._connect()
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+            entries = conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            'model_version': meta.get('model_version'),
+            'entries': entries,
+            'hits': meta.get('hits', 0),
+            'misses': meta.get('misses', 0),
+            'process_hits': self.hits,
+            'process_misses': self.misses,
+        }
@@ -0,0 +1,183 @@
+"""
+Process-wide registry of the promoted model artifacts.
+
+Every gunicorn worker keeps one `ModelRegistry` per model directory. The
+registry loads `best_model.joblib`, `best_scaler.joblib` and, when present,
+`best_preprocessor.joblib` once, keeps them in memory and reloads them only
+when the files in the model directory change on disk (detected through a
+cheap `os.stat` of each artifact). The artifacts are always swapped together
+so a request never scores with a model from one training run and a scaler
+from another.
+
+Directories promoted with a `manifest.json` (see `lib.artifacts`) are
+validated against it before loading and take their version from it. Their
+uncompressed artifacts are memory-mapped, so the model arrays are shared by
+all workers through the page cache. Older gzip artifacts still load.
+
+Example:
+    registry = get_model_registry('/path/to/models/best_model')
+    artifacts = registry.get()
+    y_pred = artifacts.model.predict(artifacts.scaler.transform(X))
+"""
+import os
+import time
+import threading
+import hashlib
+from collections import namedtuple
+from ..lib.artifacts import MANIFEST_FILENAME, load_artifact, read_manifest, validate_manifest
+from .metrics import MODEL_LOADS, STAGE_SECONDS
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MODEL_FILENAME = 'best_model.joblib'
+SCALER_FILENAME = 'best_scaler.joblib'
+PREPROCESSOR_FILENAME = 'best_preprocessor.joblib'
+
+# Seconds between two stat checks of the artifacts on disk
+DEFAULT_CHECK_INTERVAL = float(os.getenv('MEDIWATCH_MODEL_CHECK_INTERVAL', '1.0'))
+
+LoadedArtifacts = namedtuple('LoadedArtifacts', ['model', 'scaler', 'preprocessor', 'version', 'loaded_at', 'manifest'])
+
+
+class ModelRegistry:
+    """
+    Keep the promoted model and scaler of a model directory in memory.
+
+    Parameters:
+        model_dir (str): Directory containing best_model.joblib, best_scaler.joblib and
+            optionally best_preprocessor.joblib. Models trained before the preprocessor
+            existed have none and are cleaned with per-batch encoding.
+        check_interval (float): Minimum number of seconds between two checks of
+            the artifacts on disk. Use 0 to check on every call.
+
+    Attributes:
+        model_dir (str): Directory the artifacts are loaded from.
+        check_interval (float): Seconds between two checks of the artifacts.
+    """
+    def __init__(self, model_dir, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.model_dir = model_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._artifacts = None
+        self._signature = None
+        self._last_check = 0.0
+        logger.info(f"Initializing model registry for {self.model_dir}")
+
+    def _artifact_paths(self):
+        return [os.path.join(self.model_dir, MODEL_FILENAME),
+                os.path.join(self.model_dir, SCALER_FILENAME),
+                os.path.join(self.model_dir, PREPROCESSOR_FILENAME)]
+
+    def _stat_signature(self):
+        """
+        Identify the current artifacts on disk by (inode, size, mtime) of each file.
+        A new file moved into place with os.replace always changes the signature.
+        """
+        model_path, scaler_path, preprocessor_path = self._artifact_paths()
+        signature = []
+        for path in (model_path, scaler_path):
+            st = os.stat(path)
+            signature.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        if os.path.exists(preprocessor_path):
+            st = os.stat(preprocessor_path)
+            signature.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        manifest_path = os.path.join(self.model_dir, MANIFEST_FILENAME)
+        if os.path.exists(manifest_path):
+            st = os.stat(manifest_path)
+            signature.append(('manifest', st.st_ino, st.st_size, st.st_mtime_ns))
+        return tuple(signature)
+
+    @staticmethod
+    def _version_from_signature(signature):
+        return hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()[:12]
+
+    def _load(self, signature):
+        model_path, scaler_path, preprocessor_path = self._artifact_paths()
+        logger.info(f"Loading the best model and scaler from {self.model_dir} ..........")
+        start = time.perf_counter()
+        manifest = read_manifest(self.model_dir)
+        if manifest is not None:
+            # Fails while a retrain is still moving the files into place. Hashing only
+            # runs on reloads and warms the page cache the model is mapped from.
+            validate_manifest(self.model_dir, manifest, check_hash=True)
+        model = load_artifact(model_path)
+        scaler = load_artifact(scaler_path)
+        preprocessor = None
+        if os.path.exists(preprocessor_path):
+            preprocessor = load_artifact(preprocessor_path)
+        else:
+            logger.warning(f"No {PREPROCESSOR_FILENAME} in {self.model_dir}, falling back to per-batch encoding")
+        if manifest is not None:
+            feature_columns = manifest.get('feature_columns')
+            if preprocessor is not None and feature_columns is not None and preprocessor.feature_columns != feature_columns:
+                raise ValueError(f"The preprocessor in {self.model_dir} does not produce the features of the manifest")
+            version = manifest['version']
+        else:
+            version = self._version_from_signature(signature)
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels('model_load').observe(elapsed)
+        logger.info(f"Loaded model version {version} in {elapsed:.3f}s")
+        return LoadedArtifacts(model=model, scaler=scaler, preprocessor=preprocessor,
+                               version=version, loaded_at=time.time(), manifest=manifest)
+
+    def get(self):
+        """
+        Return the in-memory artifacts, reloading them if they changed on disk.
+
+        If the artifacts cannot be read (for example while a retrain is copying
+        new files into place), the previously loaded model keeps serving and the
+        reload is retried on the next check.
+
+        Returns:
+            LoadedArtifacts: namedtuple with model, scaler, preprocessor, version, loaded_at
+                and the manifest (None for directories without one).
+        """
+        now = time.monotonic()
+        artifacts = self._artifacts
+        if artifacts is not None and now - self._last_check < self.check_interval:
+            return artifacts
+
+        with self._lock:
+            if self._artifacts is not None and now - self._last_check < self.check_interval:
+                return self._artifacts
+            self._last_check = now
+            try:
+                signature = self._stat_signature()
+                if signature != self._signature:
+                    loaded = self._load(signature)
+                    MODEL_LOADS.labels('loaded' if self._artifacts is None else 'reloaded').inc()
+                    if self._artifacts is not None:
+                        logger.info(f"Swapping model version {self._artifacts.version} for {loaded.version}")
+                    # Single reference assignment so readers see either the old or the new artifacts
+                    self._artifacts = loaded
+                    self._signature = signature
+            except Exception:
+                MODEL_LOADS.labels('failed').inc()
+                if self._artifacts is None:
+                    raise
+                logger.exception(f"Failed to reload artifacts from {self.model_dir}, serving version {self._artifacts.version}")
+            return self._artifacts
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_model_registry(model_dir, check_interval=DEFAULT_CHECK_INTERVAL):
+    """
+    Return the registry of this process for the given model directory, creating it on first use.
+
+    The registries are created lazily, so each forked gunicorn worker loads
+    its own copy of the model the first time it serves a request.
+    """
+    key = os.path.abspath(model_dir)
+    registry = _registries.get(key)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(key)
+            if registry is None:
+                registry = ModelRegistry(key, check_interval=check_interval)
+                _registries[key] = registry
+    return registry
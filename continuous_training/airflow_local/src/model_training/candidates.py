@@ -0,0 +1,205 @@
+"""
+Parallel training of candidate models under a wall-clock budget.
+
+`DiabetesReadmissionTrainer` used to fit LogisticRegression, RandomForest and
+the ~30 LazyPredict estimators one after the other on a single core.
+`run_candidates` fits every candidate in its own worker process, at most
+`n_workers` at a time. A candidate that runs longer than `time_budget`
+seconds is terminated, as is one that crashes or runs out of memory, and the
+remaining candidates carry on. Every finished candidate dumps its fitted model
+to disk and reports its metrics, fit time and peak memory, so partial results
+still feed best-model selection and slow or memory hungry estimators can be
+spotted in the search report.
+
+Example:
+    candidates = [Candidate('Logistic Regression', LogisticRegression(), 'scaled',
+                            '/models/logisic_regression/logistic_model.joblib')]
+    results = run_candidates(candidates, {'scaled': (X_train, X_test, y_train, y_test)},
+                             n_workers=4, time_budget=600)
+"""
+import os
+import json
+import time
+import queue
+import multiprocessing
+from collections import namedtuple
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+from sklearn.metrics import accuracy_score, balanced_accuracy_score
+from ..lib.artifacts import dump_artifact
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Seconds between two checks of the running candidates
+POLL_INTERVAL = 0.2
+
+Candidate = namedtuple('Candidate', ['name', 'estimator', 'dataset', 'model_path'])
+"""
+A model to train.
+
+name (str): Name used in logs and results.
+estimator: Unfitted sklearn-compatible estimator.
+dataset (str): Key of the (X_train, X_test, y_train, y_test) tuple to train and evaluate on.
+model_path (str): Where the fitted model is dumped.
+"""
+
+
+def _mp_context():
+    # fork shares the training data with the workers without pickling it
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def _max_rss_mb():
+    """Return the peak resident set size of this process in MiB, None if unknown."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _fit_candidate(candidate, datasets, results_queue):
+    """Worker process: fit one candidate, dump it and report its metrics."""
+    start = time.perf_counter()
+    # A forked worker starts with the peak of its parent, only the growth is the candidate's
+    start_rss = _max_rss_mb()
+    try:
+        X_train, X_test, y_train, y_test = datasets[candidate.dataset]
+        model = candidate.estimator
+        model.fit(X_train, y_train)
+        fit_seconds = time.perf_counter() - start
+
+        y_test_pred = model.predict(X_test)
+        metrics = {
+            'train_accuracy': model.score(X_train, y_train),
+            'test_accuracy': accuracy_score(y_test, y_test_pred),
+            'balanced_accuracy': balanced_accuracy_score(y_test, y_test_pred),
+            'fit_seconds': fit_seconds,
+            'peak_memory_mb': None if start_rss is None else round(_max_rss_mb() - start_rss, 1),
+        }
+        dump_artifact(model, candidate.model_path)
+        results_queue.put((candidate.name, metrics))
+    except Exception as e:
+        results_queue.put((candidate.name, {'error': repr(e), 'fit_seconds': time.perf_counter() - start}))
+
+
+def _collect_results(results_queue, results, timeout):
+    """Move every report waiting in the queue into results."""
+    try:
+        while True:
+            name, metrics = results_queue.get(timeout=timeout)
+            results[name] = metrics
+            if 'error' in metrics:
+                logger.warning(f"Candidate {name} failed: {metrics['error']}")
+            else:
+                logger.info(f"Candidate {name} trained in {metrics['fit_seconds']:.1f}s "
+                            f"using {metrics['peak_memory_mb']} MiB, test accuracy {metrics['test_accuracy']:.4f}")
+    except queue.Empty:
+        pass
+
+
+def run_candidates(candidates, datasets, n_workers=None, time_budget=None):
+    """
+    Fit candidates concurrently, each in its own process.
+
+    Args:
+        candidates (list): Candidate tuples to train.
+        datasets (dict): Dataset key -> (X_train, X_test, y_train, y_test).
+        n_workers (int, optional): Maximum number of candidates trained at the same
+            time. Defaults to the number of CPUs.
+        time_budget (float, optional): Wall-clock seconds a candidate may run before
+            it is terminated. No limit by default.
+
+    Returns:
+        dict: Candidate name -> metrics dict with train_accuracy, test_accuracy,
+            balanced_accuracy, fit_seconds and peak_memory_mb (growth of the worker's
+            peak RSS while fitting), or with an 'error' entry for candidates that
+            failed, crashed or ran out of time.
+    """
+    n_workers = max(1, n_workers or os.cpu_count() or 1)
+    ctx = _mp_context()
+    results_queue = ctx.Queue()
+    pending = list(candidates)
+    running = {}
+    results = {}
+
+    logger.info(f"Training {len(pending)} candidates with {n_workers} workers"
+                + (f" and a budget of {time_budget}s per candidate" if time_budget else ""))
+
+    try:
+        while pending or running:
+            while pending and len(running) < n_workers:
+                candidate = pending.pop(0)
+                process = ctx.Process(target=_fit_candidate, args=(candidate, datasets, results_queue),
+                                      name=f"candidate-{candidate.name}")
+                process.start()
+                running[candidate.name] = (process, time.monotonic())
+
+            # Collect reports before joining, a worker only exits once its report is flushed
+            _collect_results(results_queue, results, POLL_INTERVAL)
+
+            now = time.monotonic()
+            for name, (process, started) in list(running.items()):
+                if name in results:
+                    process.join()
+                    del running[name]
+                elif not process.is_alive():
+                    process.join()
+                    # The report may have been queued just after the last collection
+                    _collect_results(results_queue, results, POLL_INTERVAL)
+                    if name in results:
+                        del running[name]
+                        continue
+                    # Exited without a report, e.g. killed by the kernel for using too much memory
+                    results[name] = {'error': f"worker exited with code {process.exitcode}",
+                                     'fit_seconds': now - started}
+                    logger.warning(f"Candidate {name} exited with code {process.exitcode} without results")
+                    del running[name]
+                elif time_budget and now - started > time_budget:
+                    process.terminate()
+                    process.join()
+                    results[name] = {'error': f"exceeded the time budget of {time_budget}s",
+                                     'fit_seconds': now - started}
+                    logger.warning(f"Candidate {name} cancelled after exceeding {time_budget}s")
+                    del running[name]
+    finally:
+        for process, _ in running.values():
+            process.terminate()
+            process.join()
+
+    return results
+
+
+def write_search_report(path, results, selected, best_model_name):
+    """
+    Save the outcome of a candidate search as JSON.
+
+    Args:
+        path (str): Report file, written to a temporary file and moved into place.
+        results (dict): Output of run_candidates.
+        selected (list): Names of the candidates whose models were kept.
+        best_model_name (str): Name of the promoted candidate.
+
+    Returns:
+        str: path
+    """
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'best_model': best_model_name,
+        'selected': list(selected),
+        # Slowest first, the candidates worth pruning from the search space
+        'candidates': [dict(name=name, **metrics) for name, metrics in
+                       sorted(results.items(), key=lambda item: item[1].get('fit_seconds', 0), reverse=True)],
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+    logger.info(f"Saved the candidate search report to {path}")
+    return path
@@ -0,0 +1,132 @@
+"""
+Incremental updates of the promoted model with the rows added to new_data.csv.
+
+A full retrain cleans the original and new data again, rebuilds the features
+and fits every candidate family, even when new_data.csv only grew by a few
+thousand rows. Most updates can instead fold the new rows into the promoted
+model, keeping its preprocessor and scaler, in seconds:
+
+- partial_fit: estimators with partial_fit (SGDClassifier, Perceptron,
+  PassiveAggressiveClassifier, the naive Bayes models) take one more pass
+  over the new rows.
+- warm_start: forests (RandomForestClassifier, ExtraTreesClassifier) keep
+  their trees and grow extra ones on the new rows, as many as the share of
+  the new rows in the data seen so far, at least `MIN_EXTRA_TREES`.
+- boosting: gradient boosted models (XGBClassifier, LGBMClassifier,
+  GradientBoostingClassifier) continue boosting for `BOOSTING_ROUNDS` rounds
+  on the new rows.
+
+Other models, e.g. LogisticRegression, can only be retrained in full.
+`full_retrain_reason` decides when an update is not enough: drift reported
+by the monitoring job, or a full retrain older than `FULL_RETRAIN_DAYS`.
+The manifest of the promoted model records what the decision needs: when it
+was last retrained in full and its test accuracy then, how many rows it has
+seen and the high-water mark of the new_data.csv rows already folded in (see
+new_data_store.high_water_mark).
+
+Example:
+    if full_retrain_reason(manifest, drift_detected) is None and update_strategy(model):
+        model = fold_batch(model, X_new, y_new, rows_seen=manifest['training_rows'])
+"""
+import os
+import math
+from datetime import datetime
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.ensemble._forest import BaseForest
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Days after which the next retrain is a full one, even without drift
+FULL_RETRAIN_DAYS = float(os.getenv('MEDIWATCH_FULL_RETRAIN_DAYS', '30'))
+
+# Trees grown at least by a warm-started forest on a batch
+MIN_EXTRA_TREES = 10
+
+# Boosting rounds added on a batch
+BOOSTING_ROUNDS = 10
+
+# Drop in test accuracy from the last full retrain after which an update is rejected and the model retrained in full
+MAX_ACCURACY_DROP = 0.01
+
+
+def update_strategy(model):
+    """
+    Return how a fitted model folds in new rows: 'partial_fit', 'warm_start', 'boosting',
+    or None when it can only be retrained in full.
+    """
+    if hasattr(model, 'partial_fit'):
+        return 'partial_fit'
+    if isinstance(model, BaseForest):
+        return 'warm_start'
+    if isinstance(model, GradientBoostingClassifier) or type(model).__name__ in ('XGBClassifier', 'LGBMClassifier'):
+        return 'boosting'
+    return None
+
+
+def fold_batch(model, X, y, rows_seen):
+    """
+    Fold a batch of rows into a fitted model.
+
+    Args:
+        model: Fitted model, see update_strategy. It is updated in place.
+        X (numpy.ndarray or pandas.DataFrame): Features of the batch, scaled like the training data.
+        y (pandas.Series): Target of the batch, with every class of the training data.
+        rows_seen (int): Rows the model was trained on so far, sizes the extra trees of a forest.
+
+    Returns:
+        The updated model.
+    """
+    strategy = update_strategy(model)
+    if strategy == 'partial_fit':
+        model.partial_fit(X, y)
+    elif strategy == 'warm_start':
+        # New trees only see the batch, the existing ones keep what they learned
+        extra_trees = max(MIN_EXTRA_TREES, math.ceil(model.n_estimators * len(y) / max(rows_seen, 1)))
+        model.set_params(warm_start=True, n_estimators=model.n_estimators + extra_trees)
+        model.fit(X, y)
+    elif strategy == 'boosting' and isinstance(model, GradientBoostingClassifier):
+        model.set_params(warm_start=True, n_estimators=model.n_estimators + BOOSTING_ROUNDS)
+        model.fit(X, y)
+    elif strategy == 'boosting' and type(model).__name__ == 'XGBClassifier':
+        booster = model.get_booster()
+        model.set_params(n_estimators=BOOSTING_ROUNDS)
+        model.fit(X, y, xgb_model=booster)
+    elif strategy == 'boosting':
+        booster = model.booster_
+        model.set_params(n_estimators=BOOSTING_ROUNDS)
+        model.fit(X, y, init_model=booster)
+    else:
+        raise ValueError(f"{type(model).__name__} cannot be updated incrementally")
+    logger.info(f"Folded {len(y)} rows into {type(model).__name__} with {strategy}")
+    return model
+
+
+def has_every_class(y, classes):
+    """Return True if the batch target holds every class of the model, which warm_start and boosting need."""
+    return set(np.unique(y)) >= set(np.asarray(classes).tolist())
+
+
+def full_retrain_reason(manifest, drift_detected=False, now=None, full_retrain_days=FULL_RETRAIN_DAYS):
+    """
+    Return why the next retrain has to be a full one, or None if an incremental update is enough.
+
+    Args:
+        manifest (dict): Manifest of the promoted model, None if there is none.
+        drift_detected (bool): A drift test of the monitoring job failed.
+        now (datetime, optional): Current time, for tests of the schedule.
+        full_retrain_days (float): Days after which a full retrain is due.
+
+    Returns:
+        str: The reason, None when no full retrain is needed.
+    """
+    if manifest is None or manifest.get('full_retrain_at') is None or manifest.get('full_retrain_test_accuracy') is None:
+        return "no model retrained in full was promoted yet"
+    if drift_detected:
+        return "the monitoring job detected drift"
+    age = (now or datetime.now()) - datetime.fromisoformat(manifest['full_retrain_at'])
+    if age.total_seconds() > full_retrain_days * 86400:
+        return f"the last full retrain is {age.days} days old, more than {full_retrain_days:g}"
+    return None
@@ -0,0 +1,121 @@
+"""
+Stage outputs of the training pipeline, kept on disk between runs.
+
+Every stage of `DiabetesReadmissionTrainer` (clean the original data, clean
+the new data, build the features, train a family of candidates, evaluate,
+promote) writes its outputs to its own directory of the pipeline work
+directory, then a `stamp.json` holding the fingerprint of its inputs:
+
+    pipeline/
+        prepared/original/  prepared.feather, stamp.json
+        prepared/new/       prepared.feather, stamp.json
+        features/           datasets, preprocessor, scalers, stamp.json
+        candidates/<family>/ fitted models, stamp.json with their metrics
+        evaluation/         candidate_search.json, stamp.json
+
+A fingerprint hashes what decides the output of a stage: the content of the
+source files for the cleaning stages, the fingerprints of the upstream
+stages and the code versions for the others. A stage whose stamp already
+holds the fingerprint of its current inputs is skipped, so rerunning the
+pipeline after a failure, or with unchanged data, only redoes what changed.
+The stamp is written last, a stage interrupted half way is redone.
+
+Example:
+    key = fingerprint(source_fingerprint('diabetic_data.csv'), cleaning_code_version())
+    if not is_current(stage_dir, key):
+        ...
+        write_stamp(stage_dir, key, rows=prepared_df.shape[0])
+"""
+import os
+import json
+import time
+import hashlib
+from ..data_cleaning.cache import file_digest
+from ..data_cleaning.snapshot import PARTITION_COLUMN, SNAPSHOT_SUFFIX
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+STAMP_FILENAME = 'stamp.json'
+
+
+def fingerprint(*parts):
+    """Return a short hash of JSON-serializable parts."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def code_version(*modules):
+    """Return a hash of the source files of the given modules."""
+    digest = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def source_fingerprint(path, start_date=None, end_date=None):
+    """
+    Fingerprint of the content of a data source.
+
+    A CSV or .parquet file is hashed whole. For a snapshot directory, only the
+    files of the partitions within the ingest date range are hashed, so
+    partitions added outside of the range do not invalidate the stage.
+
+    Returns:
+        str: Hex digest, None when path is None.
+    """
+    if path is None:
+        return None
+    if not os.path.isdir(path):
+        return file_digest(path)
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        partition = os.path.basename(root)
+        if partition.startswith(f"{PARTITION_COLUMN}="):
+            ingest_date = partition.split('=', 1)[1]
+            if (start_date and ingest_date < str(start_date)) or (end_date and ingest_date > str(end_date)):
+                continue
+        for name in sorted(names):
+            if name.endswith(SNAPSHOT_SUFFIX) and not name.startswith('.'):
+                file_path = os.path.join(root, name)
+                files.append((os.path.relpath(file_path, path), file_digest(file_path)))
+    return fingerprint(files)
+
+
+def read_stamp(stage_dir):
+    """Return the stamp of a stage directory, None if the stage never completed."""
+    path = os.path.join(stage_dir, STAMP_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def is_current(stage_dir, key):
+    """Return True if the stage completed with inputs of fingerprint key."""
+    stamp = read_stamp(stage_dir)
+    return stamp is not None and stamp['fingerprint'] == key
+
+
+def write_stamp(stage_dir, key, **info):
+    """
+    Mark a stage as completed for inputs of fingerprint key.
+
+    Args:
+        stage_dir (str): Stage directory, holding the outputs already written.
+        key (str): Fingerprint of the inputs of the stage.
+        **info: JSON-serializable details read by the next stages, e.g. row counts or metrics.
+
+    Returns:
+        dict: The stamp.
+    """
+    stamp = {'fingerprint': key, 'completed_at': time.strftime('%Y-%m-%dT%H:%M:%S'), **info}
+    os.makedirs(stage_dir, exist_ok=True)
+    path = os.path.join(stage_dir, STAMP_FILENAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(stamp, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+    return stamp
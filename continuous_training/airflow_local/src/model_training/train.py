@@ -13,205 +13,632 @@ from sklearn import metrics
 from sklearn.metrics import confusion_matrix
 from sklearn.metrics import accuracy_score, classification_report
 import lazypredict
-from lazypredict.Supervised import LazyClassifier
+from lazypredict.Supervised import CLASSIFIERS
 from sklearn.preprocessing import PolynomialFeatures
 from sklearn.pipeline import make_pipeline
 from ..data_cleaning.clean import clean
+from ..data_cleaning.preprocessor import DiabetesPreprocessor
+from ..data_cleaning.cache import load_prepared_data
+from ..data_cleaning.chunked import clean_csv_in_chunks
+from ..data_cleaning.schema import TRAINING_COLUMNS
+from ..data_cleaning.snapshot import is_snapshot, read_raw_data
+from .candidates import Candidate, run_candidates, write_search_report
+from ..lib.artifacts import dump_artifact, artifact_entry, write_manifest
+from .stages import fingerprint, code_version, source_fingerprint, read_stamp, is_current, write_stamp
+from ..data_cleaning import cache as cache_module
+from ..data_cleaning import preprocessor as preprocessor_module
+from . import candidates as candidates_module
+from ..lib.artifacts import read_manifest, load_artifact
+from ..lib.new_data_store import ID_COLUMN, high_water_mark, read_rows_after
+from .incremental import MAX_ACCURACY_DROP, update_strategy, fold_batch, has_every_class, full_retrain_reason
+import sys
+import time
+from datetime import datetime
+import pyarrow.feather as feather
 import logging
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Work directory of the pipeline stages inside model_dir, kept between runs so unchanged stages are skipped
+PIPELINE_DIR_NAME = 'pipeline'
+
+TARGET_COLUMN = 'readmitted'
+
+# Candidate families always trained, each one its own stage (and DAG task)
+STANDARD_FAMILIES = ['logistic_regression', 'random_forest']
+# The LazyPredict estimators are split round-robin into lazy_shards families named lazy_classifier_<i>
+LAZY_FAMILY_PREFIX = 'lazy_classifier'
+
+# Rows of the stratified sample the LazyPredict estimators are trained on
+LAZY_SAMPLE_ROWS = 20000
+
+# Scaler fitted for each dataset, promoted with a model trained on that dataset. The
+# raw dataset gets an identity scaler so serving feeds the model the values it was trained on.
+DATASET_SCALERS = {
+    'scaled': 'standard_scaler.joblib',
+    'raw': 'identity_scaler.joblib',
+    'lazy_scaled': 'lazy_standard_scaler.joblib',
+}
+
+
+def candidate_families(lazy_shards=1):
+    """Return the candidate families trained with lazy_shards LazyPredict families."""
+    return STANDARD_FAMILIES + [f'{LAZY_FAMILY_PREFIX}_{i}' for i in range(max(1, lazy_shards))]
+
+
 class DiabetesReadmissionTrainer:
-    def __init__(self, original_data_filename, new_data_filename=None, model_dir=None):
+    """
+    Train the candidate models, select the best one and promote it, in stages.
+
+    Each stage reads the outputs of the previous ones from the pipeline work
+    directory and writes its own there with a stamp (see stages.py), so the
+    stages can run as separate tasks, on separate workers, and are skipped
+    when their inputs did not change:
+
+    - clean_original / clean_new: prepare the raw data
+    - build_features: fit the preprocessor, split, scale
+    - train_family: fit one family of candidates (see family_names)
+    - evaluate: rank the candidates and pick the best model
+    - promote: copy the best model and its artifacts into best_model
+
+    train_and_evaluate_model runs all of them in order. update_incremental instead
+    folds the rows added to new_data.csv into the promoted model, and retrain
+    picks between the two.
+    """
+    def __init__(self, original_data_filename, new_data_filename=None, model_dir=None,
+                 n_workers=None, candidate_time_budget=None, top_k=3, excluded_candidates=None,
+                 clean_chunk_rows=None, start_date=None, end_date=None, lazy_shards=1, work_dir=None):
         self.original_data_filename = original_data_filename
         self.new_data_filename = new_data_filename
         self.model_dir = model_dir
+        # Candidates trained at the same time (defaults to the number of CPUs) and
+        # wall-clock seconds after which a candidate is cancelled (no limit by default)
+        self.n_workers = n_workers
+        self.candidate_time_budget = candidate_time_budget
+        # Number of LazyPredict models kept after the search, and LazyPredict
+        # estimators left out of it, e.g. the ones the search report shows as too slow
+        self.top_k = top_k
+        self.excluded_candidates = set(excluded_candidates or [])
+        # Rows per chunk to clean the data out of core, None cleans it in memory
+        self.clean_chunk_rows = clean_chunk_rows
+        # Inclusive ingest date range (YYYY-MM-DD) read from Parquet snapshot inputs, CSV inputs are read whole
+        self.start_date = start_date
+        self.end_date = end_date
+        # Number of families the LazyPredict estimators are split into, to train them as parallel tasks
+        self.lazy_shards = max(1, lazy_shards)
+        self.work_dir = work_dir or os.path.join(self.model_dir, PIPELINE_DIR_NAME)
         logger.info("Initializing Trainer with original data file: {} and new data file: {} and model dir: {}".format(
             self.original_data_filename,
             self.new_data_filename,
             self.model_dir
         ))
     
-    def train_and_evaluate_model(self):
+    @staticmethod
+    def promote_artifact(source_path, destination_path):
         """
-        Train and evaluate models for diabetes readmission prediction.
+        Copy an artifact next to its destination and move it into place with os.replace.
 
-        Process:
-        1. Data Preparation:
-           - Cleans data using the clean module
-           - Optionally combines original and new data
-           - Splits into train (80%) and test (20%) sets
-           - Standardizes features
+        The rename is atomic, so serving workers polling the best_model directory
+        never load a partially written file.
+        """
+        tmp_path = f"{destination_path}.tmp"
+        shutil.copy(source_path, tmp_path)
+        os.replace(tmp_path, destination_path)
 
-        2. Model Training:
-           Trains multiple models:
-           - Logistic Regression: Simple linear classifier
-           - Random Forest: Ensemble of decision trees
+    def load_prepared(self, path, cached=False):
+        """
+        Return the prepared rows of a CSV file or Parquet snapshot.
 
-        3. Model Evaluation:
-           - Calculates training and test accuracy
-           - Creates confusion matrices
-           - Selects best performing model
+        Only the raw columns that reach the model are read, from the partitions of
+        the ingest date range for a snapshot. With cached, a CSV file comes from the
+        prepared data cache instead.
+        """
+        if cached and not is_snapshot(path):
+            return load_prepared_data(path)
+        raw_df = read_raw_data(path, columns=TRAINING_COLUMNS, start_date=self.start_date, end_date=self.end_date)
+        return clean(df=raw_df).prepare_data()
 
-        4. Model Storage:
-           - Saves best model and its scaler
-           - Cleans up intermediate files
 
-        Returns:
-            dict: Dictionary containing model performance metrics
+    def stage_dir(self, *parts):
+        """Return the directory of a stage in the pipeline work directory."""
+        return os.path.join(self.work_dir, *parts)
+
+    def family_names(self):
+        """Return the candidate families, each trained by one train_family call."""
+        return candidate_families(self.lazy_shards)
+
+    def clean_original(self):
+        """Stage: prepare the original data, from the prepared data cache for a CSV file."""
+        return self._prepare_source('original', self.original_data_filename, cached=True)
+
+    def clean_new(self):
+        """Stage: prepare the new data, a stage with no rows when there is none."""
+        return self._prepare_source('new', self.new_data_filename)
+
+    def _prepare_source(self, name, path, cached=False):
+        stage_dir = self.stage_dir('prepared', name)
+        key = fingerprint(source_fingerprint(path, self.start_date, self.end_date),
+                          cache_module.cleaning_code_version(), TRAINING_COLUMNS,
+                          self.start_date, self.end_date, self.clean_chunk_rows)
+        if is_current(stage_dir, key):
+            logger.info(f"{path} is unchanged since it was last prepared, skipping")
+            return read_stamp(stage_dir)
+
+        rows = 0
+        if path is not None and self.clean_chunk_rows:
+            # Data that does not fit in memory is streamed by build_features, only its fingerprint is kept
+            rows = None
+        elif path is not None:
+            logger.info(f"Preparing {name} data from {path} ..........")
+            prepared_df = self.load_prepared(path, cached=cached)
+            os.makedirs(stage_dir, exist_ok=True)
+            tmp_path = os.path.join(stage_dir, f"prepared.feather.{os.getpid()}.tmp")
+            feather.write_feather(prepared_df, tmp_path, compression='uncompressed')
+            os.replace(tmp_path, os.path.join(stage_dir, 'prepared.feather'))
+            rows = int(prepared_df.shape[0])
+        # Rows of new_data.csv the full retrain covers, later rows are folded in by update_incremental
+        new_data_mark = None if path is not None and is_snapshot(path) else high_water_mark(path)
+        return write_stamp(stage_dir, key, source=path, rows=rows, new_data_mark=new_data_mark)
+
+    def build_features(self):
+        """
+        Stage: fit the preprocessor on the prepared data, split it and fit the scalers.
+
+        Writes the train and test sets of every dataset (scaled, raw, lazy_scaled) as
+        Feather files with the target column, the preprocessor and the scaler of each dataset.
         """
-        logger.info("Invoking cleaning module to clean original data ..........")
-        cleanObj_orig = clean(self.original_data_filename)
-        original_train_df = cleanObj_orig.clean_data()
+        stage_dir = self.stage_dir('features')
+        sources = {name: read_stamp(self.stage_dir('prepared', name)) for name in ['original', 'new']}
+        if any(stamp is None for stamp in sources.values()):
+            raise RuntimeError("The clean_original and clean_new stages must run before build_features")
+        key = fingerprint([sources[name]['fingerprint'] for name in ['original', 'new']],
+                          code_version(preprocessor_module, sys.modules[__name__]))
+        if is_current(stage_dir, key):
+            logger.info("Prepared data is unchanged since the features were built, skipping")
+            return read_stamp(stage_dir)
 
-        if self.new_data_filename:
-            logger.info("Invoking cleaning module to clean new data ..........")
-            cleanObj_new = clean(self.new_data_filename)
-            new_train_df = cleanObj_new.clean_data()
-            train_df = pd.concat([original_train_df, new_train_df], axis=0, ignore_index=True)
+        if self.clean_chunk_rows:
+            # Only the encoded data is held in memory, the raw files are streamed
+            source_paths = [stamp['source'] for stamp in sources.values() if stamp['source']]
+            logger.info(f"Cleaning the training data in chunks of {self.clean_chunk_rows} rows ..........")
+            os.makedirs(stage_dir, exist_ok=True)
+            cleaned = clean_csv_in_chunks(source_paths, os.path.join(stage_dir, 'encoded.parquet'),
+                                          chunk_rows=self.clean_chunk_rows, columns=TRAINING_COLUMNS,
+                                          start_date=self.start_date, end_date=self.end_date)
+            preprocessor = cleaned.preprocessor
+            train_df = pd.read_parquet(cleaned.path).reset_index(drop=True)
+            os.remove(cleaned.path)
         else:
-            train_df = original_train_df
+            prepared = [feather.read_feather(os.path.join(self.stage_dir('prepared', name), 'prepared.feather'))
+                        for name in ['original', 'new'] if sources[name]['rows']]
+            prepared_df = pd.concat(prepared, axis=0, ignore_index=True) if len(prepared) > 1 else prepared[0]
+
+            # Fill values and category codes are learned once here and reused at inference
+            logger.info("Fitting the preprocessor on the prepared training data")
+            preprocessor = DiabetesPreprocessor().fit(prepared_df)
+            train_df = preprocessor.transform(prepared_df)
 
         # Splitting the data into train and test
         logger.info("Splitting the data into train and test")
-        X = train_df.drop('readmitted', axis=1)
-        y = train_df['readmitted']
+        # float32 features: StandardScaler keeps float32 input as float32 and the tree models work in float32
+        X = train_df.drop(TARGET_COLUMN, axis=1).astype(np.float32)
+        y = train_df[TARGET_COLUMN]
         X_train,X_test,y_train,y_test = train_test_split(X,y,test_size=0.2,random_state=1)
 
-        train_algo_accuracy = {}
-        test_algo_accuracy = {}
-
         # Standardizing the data
         logger.info("Standardizing the data")
         SC = StandardScaler()
         X_train_scaled = pd.DataFrame(SC.fit_transform(X_train),columns=X_train.columns)
         X_test_scaled = pd.DataFrame(SC.transform(X_test),columns=X_test.columns)
-        scaler_dir = os.path.join(self.model_dir, 'scaler')
-        if not os.path.exists(scaler_dir):
-            os.makedirs(scaler_dir)
-        joblib.dump(SC, os.path.join(scaler_dir, 'standard_scaler.joblib'), compress=('gzip', 3))
-
-        # Linear Regression Model
-        log_reg_dir = os.path.join(self.model_dir, 'logisic_regression')
-        if not os.path.exists(log_reg_dir):
-            os.makedirs(log_reg_dir)
-        logger.info("Training Linear Regression Model")
-        train_algo_accuracy['Logistic Regression'] = 0
-        test_algo_accuracy['Logistic Regression'] = 0
-        LR = LogisticRegression()
-        LR.fit(X_train_scaled,y_train)
-        train_algo_accuracy['Logistic Regression'] = LR.score(X_train_scaled,y_train)
-        logger.info("Logistic Regression Train Accuracy: {}".format(
-            train_algo_accuracy['Logistic Regression']
-            ))
-        joblib.dump(LR, os.path.join(log_reg_dir, 'logistic_model.joblib'), compress=('gzip', 3))
-
-        y_test_pred = LR.predict(X_test_scaled)
-        cm = confusion_matrix(y_test, y_test_pred)
-        test_algo_accuracy['Logistic Regression'] = accuracy_score(y_test, y_test_pred)
-        logger.info("Logistic Regression Test Accuracy: {}\n Test confusion matrix: {}".format(
-            test_algo_accuracy['Logistic Regression'],
-            cm
-            ))
-
-        # Random Forest Model
-        random_forest_dir = os.path.join(self.model_dir, 'random_forest')
-        if not os.path.exists(random_forest_dir):
-            os.makedirs(random_forest_dir)
-        logger.info("Training Random Forest Model")
-        train_algo_accuracy['Random Forest'] = 0
-        RF = RandomForestClassifier()
-        RF.fit(X_train,y_train)
-        train_algo_accuracy['Random Forest'] = RF.score(X_train,y_train)
-        logger.info("Random Forest Train Accuracy: {}".format(
-            train_algo_accuracy['Random Forest']
-            ))
-        joblib.dump(RF, os.path.join(random_forest_dir, 'random_forest.joblib'), compress=('gzip', 3))
-
-        y_test_pred = RF.predict(X_test)
-        cm = confusion_matrix(y_test, y_test_pred)
-        test_algo_accuracy['Random Forest'] = accuracy_score(y_test, y_test_pred)
-        logger.info("Random Forest Test Accuracy: {}\n Test confusion matrix: {}".format(
-            test_algo_accuracy['Random Forest'],
-            cm
-            ))
-
-        # Lazy Classifier Models
-        X = train_df.drop('readmitted', axis=1)
-        y = train_df['readmitted']
-        X_sampled, _, y_sampled, _ = train_test_split(X, y, train_size=20000, stratify=y, random_state=42)
-        X_train, X_test, y_train, y_test = train_test_split(X_sampled, y_sampled, test_size=0.2, stratify=y_sampled, random_state=42)
+        # Models of the raw dataset see unscaled features, at inference too
+        identity_SC = StandardScaler(with_mean=False, with_std=False).fit(X_train)
 
-        # Standardizing the data
-        logger.info("Standardizing the data")
-        SC = StandardScaler()
-        X_train_scaled = pd.DataFrame(SC.fit_transform(X_train),columns=X_train.columns)
-        X_test_scaled = pd.DataFrame(SC.transform(X_test),columns=X_test.columns)
-        joblib.dump(SC, os.path.join(scaler_dir, 'lazy_standard_scaler.joblib'), compress=('gzip', 3))
-
-        lazy_classifier_dir = os.path.join(self.model_dir, 'lazy_classifier')
-        if not os.path.exists(lazy_classifier_dir):
-            os.makedirs(lazy_classifier_dir)
-        logger.info("Training Lazy Classifier Models")
-        clf = LazyClassifier(verbose=0,ignore_warnings=True, custom_metric=None)
-        models, predictions = clf.fit(X_train_scaled, X_test_scaled, y_train, y_test)
-        model_dict = clf.provide_models(X_train_scaled, X_test_scaled, y_train, y_test)
-
-        # Select top 3 models based on test accuracy
-        top_3_models = models.head(3)
-        logger.info("Top 3 models:\n{}".format(top_3_models))
-
-        # Store top 3 models and their accuracies
-        for model_name in top_3_models.index:
-            model = model_dict[model_name]
-            joblib.dump(model, os.path.join(lazy_classifier_dir, f'{model_name}.joblib'), compress=('gzip', 3))
-            train_algo_accuracy[model_name] = model.score(X_train_scaled, y_train)
-            test_algo_accuracy[model_name] = models.loc[model_name, 'Accuracy']
+        # Lazy Classifier Models are searched on a stratified sample of the data, or all of it when smaller
+        if X.shape[0] > LAZY_SAMPLE_ROWS:
+            X_sampled, _, y_sampled, _ = train_test_split(X, y, train_size=LAZY_SAMPLE_ROWS, stratify=y, random_state=42)
+        else:
+            X_sampled, y_sampled = X, y
+        X_lazy_train, X_lazy_test, y_lazy_train, y_lazy_test = train_test_split(X_sampled, y_sampled, test_size=0.2, stratify=y_sampled, random_state=42)
+
+        lazy_SC = StandardScaler()
+        X_lazy_train_scaled = pd.DataFrame(lazy_SC.fit_transform(X_lazy_train),columns=X_lazy_train.columns)
+        X_lazy_test_scaled = pd.DataFrame(lazy_SC.transform(X_lazy_test),columns=X_lazy_test.columns)
+
+        datasets = {
+            'scaled': (X_train_scaled, X_test_scaled, y_train, y_test),
+            'raw': (X_train, X_test, y_train, y_test),
+            'lazy_scaled': (X_lazy_train_scaled, X_lazy_test_scaled, y_lazy_train, y_lazy_test),
+        }
+        os.makedirs(stage_dir, exist_ok=True)
+        for dataset, (X_fit, X_eval, y_fit, y_eval) in datasets.items():
+            for split, X_part, y_part in [('train', X_fit, y_fit), ('test', X_eval, y_eval)]:
+                part_df = X_part.reset_index(drop=True).assign(**{TARGET_COLUMN: y_part.to_numpy()})
+                path = os.path.join(stage_dir, f'{dataset}_{split}.feather')
+                feather.write_feather(part_df, f"{path}.tmp", compression='uncompressed')
+                os.replace(f"{path}.tmp", path)
+        for dataset, scaler in [('scaled', SC), ('raw', identity_SC), ('lazy_scaled', lazy_SC)]:
+            dump_artifact(scaler, os.path.join(stage_dir, DATASET_SCALERS[dataset]))
+        dump_artifact(preprocessor, os.path.join(stage_dir, 'preprocessor.joblib'))
+
+        return write_stamp(stage_dir, key, rows=int(train_df.shape[0]),
+                           feature_columns=preprocessor.feature_columns,
+                           dataset_rows={dataset: int(y_fit.shape[0]) for dataset, (_, _, y_fit, _) in datasets.items()})
+
+    def load_dataset(self, dataset):
+        """Return (X_train, X_test, y_train, y_test) of a dataset written by build_features."""
+        parts = []
+        for split in ['train', 'test']:
+            part_df = feather.read_feather(os.path.join(self.stage_dir('features'), f'{dataset}_{split}.feather'))
+            parts.append((part_df.drop(TARGET_COLUMN, axis=1), part_df[TARGET_COLUMN]))
+        (X_train, y_train), (X_test, y_test) = parts
+        return X_train, X_test, y_train, y_test
+
+    def family_candidates(self, family):
+        """Return the Candidate tuples of a family, their models are dumped in the family's stage directory."""
+        family_dir = self.stage_dir('candidates', family)
+        if family == 'logistic_regression':
+            # Linear Regression Model
+            return [Candidate('Logistic Regression', LogisticRegression(), 'scaled',
+                              os.path.join(family_dir, 'logistic_model.joblib'))]
+        if family == 'random_forest':
+            # Random Forest Model
+            return [Candidate('Random Forest', RandomForestClassifier(), 'raw',
+                              os.path.join(family_dir, 'random_forest.joblib'))]
+        if not family.startswith(f'{LAZY_FAMILY_PREFIX}_') or family not in self.family_names():
+            raise ValueError(f"Unknown candidate family {family}, expected one of {self.family_names()}")
+
+        # Lazy Classifier Models, the same estimators LazyClassifier.fit runs, each fitted once
+        shard = int(family.rsplit('_', 1)[1])
+        lazy_classifiers = [(name, estimator_class) for name, estimator_class in CLASSIFIERS
+                            if name not in self.excluded_candidates]
+        candidates = []
+        for name, estimator_class in lazy_classifiers[shard::self.lazy_shards]:
+            try:
+                if "random_state" in estimator_class().get_params().keys():
+                    estimator = estimator_class(random_state=42)
+                else:
+                    estimator = estimator_class()
+            except Exception as e:
+                logger.warning(f"Skipping {name}, it cannot be built with default parameters: {e}")
+                continue
+            candidates.append(Candidate(name, estimator, 'lazy_scaled', os.path.join(family_dir, f'{name}.joblib')))
+        return candidates
+
+    def train_family(self, family):
+        """
+        Stage: train the candidates of one family, each in its own process.
+
+        Candidates that fail or exceed the time budget are recorded as such. The
+        stage fails, and is retried, only when no candidate of the family trained.
+        """
+        stage_dir = self.stage_dir('candidates', family)
+        features = read_stamp(self.stage_dir('features'))
+        if features is None:
+            raise RuntimeError("The build_features stage must run before train_family")
+        candidates = self.family_candidates(family)
+        key = fingerprint(features['fingerprint'], [(c.name, c.dataset) for c in candidates],
+                          code_version(candidates_module))
+        if is_current(stage_dir, key):
+            logger.info(f"Features are unchanged since the {family} candidates were trained, skipping")
+            return read_stamp(stage_dir)
+
+        datasets = {dataset: self.load_dataset(dataset) for dataset in {c.dataset for c in candidates}}
+        logger.info(f"Training the {family} candidates: {[c.name for c in candidates]}")
+        results = run_candidates(candidates, datasets, n_workers=self.n_workers, time_budget=self.candidate_time_budget)
+        if candidates and all('error' in metrics for metrics in results.values()):
+            raise RuntimeError(f"No candidate of the {family} family could be trained")
+
+        return write_stamp(stage_dir, key, features=features['fingerprint'], results=results,
+                           candidates={c.name: {'dataset': c.dataset, 'model_file': os.path.basename(c.model_path)}
+                                       for c in candidates})
+
+    def evaluate(self):
+        """
+        Stage: rank the trained candidates and select the best model.
+
+        Families whose stage did not complete are left out with a warning, the
+        candidates of the others still compete. The model files of the candidates
+        that are not selected (top_k LazyPredict models, LogisticRegression and
+        RandomForest) are removed.
+        """
+        stage_dir = self.stage_dir('evaluation')
+        features = read_stamp(self.stage_dir('features'))
+        if features is None:
+            raise RuntimeError("The build_features stage must run before evaluate")
+        families = {}
+        for family in self.family_names():
+            stamp = read_stamp(self.stage_dir('candidates', family))
+            if stamp is None or stamp['features'] != features['fingerprint']:
+                logger.warning(f"The {family} candidates were not trained on the current features, leaving them out")
+                continue
+            families[family] = stamp
+        key = fingerprint(sorted((family, stamp['fingerprint']) for family, stamp in families.items()), self.top_k)
+        if is_current(stage_dir, key):
+            logger.info("Candidates are unchanged since the last evaluation, skipping")
+            return read_stamp(stage_dir)
+
+        results = {}
+        trained = {}
+        for family, stamp in families.items():
+            for name, metrics in stamp['results'].items():
+                results[name] = metrics
+                if 'error' not in metrics:
+                    trained[name] = dict(metrics, family=family, **stamp['candidates'][name])
+        if not trained:
+            raise RuntimeError("No candidate model could be trained")
+
+        train_algo_accuracy = {}
+        test_algo_accuracy = {}
+        for name in ['Logistic Regression', 'Random Forest']:
+            if name in trained:
+                train_algo_accuracy[name] = trained[name]['train_accuracy']
+                test_algo_accuracy[name] = trained[name]['test_accuracy']
+                logger.info(f"{name} Train Accuracy: {train_algo_accuracy[name]} Test Accuracy: {test_algo_accuracy[name]}")
+
+        # Select top k lazy models based on balanced accuracy, as LazyClassifier ranks them
+        lazy_names = [name for name in trained if trained[name]['dataset'] == 'lazy_scaled']
+        top_k_models = sorted(lazy_names, key=lambda name: trained[name]['balanced_accuracy'], reverse=True)[:self.top_k]
+        logger.info("Top {} models:\n{}".format(self.top_k, top_k_models))
+        for model_name in top_k_models:
+            train_algo_accuracy[model_name] = trained[model_name]['train_accuracy']
+            test_algo_accuracy[model_name] = trained[model_name]['test_accuracy']
             logger.info(f"{model_name} Train Accuracy: {train_algo_accuracy[model_name]} Test Accuracy: {test_algo_accuracy[model_name]}")
 
         # Choose the best model
         best_model_name = max(test_algo_accuracy, key=test_algo_accuracy.get)
-        best_model_accuracy = test_algo_accuracy[best_model_name]
-
+        best = trained[best_model_name]
         logger.info(f"Best model: {best_model_name}")
         logger.info(f"Best model train accuracy: {train_algo_accuracy[best_model_name]}")
-        logger.info(f"Best model test accuracy: {best_model_accuracy}")
+        logger.info(f"Best model test accuracy: {test_algo_accuracy[best_model_name]}")
+
+        # Only the selected models are kept on disk, the metrics of the others stay in their family's stamp
+        for name, candidate in trained.items():
+            model_path = os.path.join(self.stage_dir('candidates', candidate['family']), candidate['model_file'])
+            if name not in train_algo_accuracy and os.path.exists(model_path):
+                os.remove(model_path)
+        best_model_path = os.path.join(self.stage_dir('candidates', best['family']), best['model_file'])
+        if not os.path.exists(best_model_path):
+            # Removed by an earlier evaluation that kept fewer models, e.g. before top_k was raised
+            logger.info(f"The {best_model_name} model was removed by an earlier evaluation, training it again")
+            candidate = next(c for c in self.family_candidates(best['family']) if c.name == best_model_name)
+            refit = run_candidates([candidate], {candidate.dataset: self.load_dataset(candidate.dataset)},
+                                   n_workers=1, time_budget=self.candidate_time_budget)
+            if 'error' in refit[best_model_name]:
+                raise RuntimeError(f"{best_model_name} could not be trained again: {refit[best_model_name]['error']}")
+
+        # Time, memory and accuracy of every candidate, promoted next to the best model
+        write_search_report(os.path.join(stage_dir, 'candidate_search.json'), results,
+                            list(train_algo_accuracy), best_model_name)
+        return write_stamp(stage_dir, key, best_model_name=best_model_name, model_path=best_model_path,
+                           scaler_path=os.path.join(self.stage_dir('features'), DATASET_SCALERS[best['dataset']]),
+                           dataset=best['dataset'], training_rows=features['dataset_rows'][best['dataset']],
+                           train_accuracy=train_algo_accuracy[best_model_name],
+                           test_accuracy=test_algo_accuracy[best_model_name],
+                           selected=list(train_algo_accuracy))
 
-        # Store the best model
+    def promote(self):
+        """
+        Stage: copy the best model, its scaler and the preprocessor into best_model.
+
+        Skipped when best_model already holds the outcome of this evaluation, with no
+        rows folded in since.
+
+        Returns:
+            dict: best_model_name, best_model_train_accuracy, best_model_test_accuracy and update_mode.
+        """
+        evaluation = read_stamp(self.stage_dir('evaluation'))
+        if evaluation is None:
+            raise RuntimeError("The evaluate stage must run before promote")
+        summary = {
+            'best_model_name': evaluation['best_model_name'],
+            'best_model_train_accuracy': evaluation['train_accuracy'],
+            'best_model_test_accuracy': evaluation['test_accuracy'],
+            'update_mode': 'full'
+        }
         best_model_dir = os.path.join(self.model_dir, 'best_model')
-        if not os.path.exists(best_model_dir):
-            os.makedirs(best_model_dir)
-
-        if best_model_name == 'Logistic Regression':
-            best_model = LR
-            source_path = os.path.join(log_reg_dir, 'logistic_model.joblib')
-            scaler_path = os.path.join(scaler_dir, 'standard_scaler.joblib')
-        elif best_model_name == 'Random Forest':
-            best_model = RF
-            source_path = os.path.join(random_forest_dir, 'random_forest.joblib')
-            scaler_path = os.path.join(scaler_dir, 'standard_scaler.joblib')
-        else:
-            best_model = model_dict[best_model_name]
-            source_path = os.path.join(lazy_classifier_dir, f'{best_model_name}.joblib')
-            scaler_path = os.path.join(scaler_dir, 'lazy_standard_scaler.joblib')
+        manifest = read_manifest(best_model_dir) if os.path.isdir(best_model_dir) else None
+        if (manifest is not None and manifest.get('pipeline_fingerprint') == evaluation['fingerprint']
+                and not manifest.get('incremental_updates')):
+            logger.info(f"{best_model_dir} already holds this evaluation's best model, skipping")
+            return summary
+        os.makedirs(best_model_dir, exist_ok=True)
+
+        self.promote_artifact(os.path.join(self.stage_dir('evaluation'), 'candidate_search.json'),
+                              os.path.join(best_model_dir, 'candidate_search.json'))
+        # Store the preprocessor and the best scaler before the model they belong to
+        self.promote_artifact(os.path.join(self.stage_dir('features'), 'preprocessor.joblib'),
+                              os.path.join(best_model_dir, 'best_preprocessor.joblib'))
+        self.promote_artifact(evaluation['scaler_path'], os.path.join(best_model_dir, 'best_scaler.joblib'))
 
         # Move the best model to the best_model directory
-        shutil.copy(source_path, os.path.join(best_model_dir, 'best_model.joblib'))
-
-        # Store the best scaler
-        shutil.copy(scaler_path, os.path.join(best_model_dir, 'best_scaler.joblib'))
-
-        # Clean up directories
-        directories_to_remove = ['logistic_regression', 'random_forest', 'lazy_classifier', 'scaler']
-        # directories_to_remove = ['logistic_regression', 'random_forest', 'scaler']
-        for dir_name in directories_to_remove:
-            dir_path = os.path.join(self.model_dir, dir_name)
-            if os.path.exists(dir_path):
-                shutil.rmtree(dir_path)
-
-        return {
-            'best_model_name': best_model_name,
-            'best_model_train_accuracy': train_algo_accuracy[best_model_name],
-            'best_model_test_accuracy': best_model_accuracy
-        }
\ No newline at end of file
+        self.promote_artifact(evaluation['model_path'], os.path.join(best_model_dir, 'best_model.joblib'))
+
+        # The manifest goes last, serving workers only load a directory that matches it
+        features = read_stamp(self.stage_dir('features'))
+        new_data = read_stamp(self.stage_dir('prepared', 'new'))
+        write_manifest(best_model_dir, {
+            'model': artifact_entry(os.path.join(best_model_dir, 'best_model.joblib')),
+            'scaler': artifact_entry(os.path.join(best_model_dir, 'best_scaler.joblib')),
+            'preprocessor': artifact_entry(os.path.join(best_model_dir, 'best_preprocessor.joblib')),
+        }, feature_columns=features['feature_columns'], model_name=evaluation['best_model_name'],
+            pipeline_fingerprint=evaluation['fingerprint'], dataset=evaluation['dataset'],
+            test_accuracy=evaluation['test_accuracy'], training_rows=evaluation['training_rows'],
+            full_retrain_at=datetime.now().isoformat(timespec='seconds'),
+            full_retrain_test_accuracy=evaluation['test_accuracy'],
+            new_data_mark=new_data['new_data_mark'], incremental_updates=0)
+        return summary
+
+    def train_and_evaluate_model(self):
+        """
+        Train and evaluate models for diabetes readmission prediction, running every stage in turn.
+
+        Process:
+        1. Data Preparation (clean_original, clean_new, build_features):
+           - Prepares data using the clean module, from CSV files or Parquet snapshots
+             (only the ingest date range), original CSV data comes from the prepared data cache
+           - Optionally combines original and new data
+           - Fits the preprocessor (fill values, category codes) on the combined data
+           - With clean_chunk_rows, does the three steps above chunk by chunk into a
+             Parquet file instead, for data that does not fit in memory
+           - Splits into train (80%) and test (20%) sets
+           - Standardizes features
+
+        2. Model Training (train_family, once per family):
+           Trains multiple models concurrently, each in its own process, cancelling
+           any that exceed the per-candidate time budget:
+           - Logistic Regression: Simple linear classifier
+           - Random Forest: Ensemble of decision trees
+           - The LazyPredict classifiers, on a 20000-row stratified sample
+
+        3. Model Evaluation (evaluate):
+           - Calculates training, test and balanced accuracy
+           - Keeps the top_k LazyPredict models by balanced accuracy, the model files
+             of the other LazyPredict candidates are removed
+           - Selects best performing model
+
+        4. Model Storage (promote):
+           - Saves best model, the scaler of the data it was trained on and the fitted
+             preprocessor, uncompressed so serving workers can memory-map them, and a
+             manifest.json describing them
+           - Saves candidate_search.json with the time, peak memory and accuracy of every candidate
+
+        Stages whose inputs did not change since the last run are skipped, their
+        outputs stay in the pipeline work directory.
+
+        Returns:
+            dict: Dictionary containing model performance metrics
+        """
+        self.clean_original()
+        self.clean_new()
+        self.build_features()
+        for family in self.family_names():
+            self.train_family(family)
+        self.evaluate()
+        return self.promote()
+
+    def update_incremental(self, drift_detected=False):
+        """
+        Fold the rows added to new_data.csv since the last update into the promoted model.
+
+        The promoted preprocessor and scaler are kept, the model is updated with the
+        strategy of its family (see incremental.py). The update is rejected when its
+        accuracy on the test set of the last full retrain is more than
+        MAX_ACCURACY_DROP below the accuracy of that retrain, however many updates
+        came in between.
+
+        Args:
+            drift_detected (bool): A drift test of the monitoring job failed, which calls for a full retrain.
+
+        Returns:
+            dict: best_model_name, best_model_test_accuracy, update_mode and rows_folded,
+                or None when a full retrain is needed instead.
+        """
+        best_model_dir = os.path.join(self.model_dir, 'best_model')
+        manifest = read_manifest(best_model_dir) if os.path.isdir(best_model_dir) else None
+        reason = full_retrain_reason(manifest, drift_detected)
+        if reason is None and (manifest.get('new_data_mark') is None or self.new_data_filename is None
+                               or is_snapshot(self.new_data_filename)):
+            reason = "incremental updates only read new rows from a new_data.csv file"
+        if reason is not None:
+            logger.info(f"Full retrain needed: {reason}")
+            return None
+
+        model = load_artifact(os.path.join(best_model_dir, manifest['artifacts']['model']['file']), mmap=False)
+        strategy = update_strategy(model)
+        if strategy is None:
+            logger.info(f"Full retrain needed: {manifest['model_name']} cannot be updated incrementally")
+            return None
+        summary = {
+            'best_model_name': manifest['model_name'],
+            'best_model_test_accuracy': manifest['test_accuracy'],
+            'update_mode': 'incremental',
+            'rows_folded': 0
+        }
+
+        if not os.path.exists(self.new_data_filename):
+            logger.info(f"No new data in {self.new_data_filename}, the model is unchanged")
+            return summary
+        new_df, skipped = read_rows_after(self.new_data_filename, manifest['new_data_mark'])
+        if skipped < manifest['new_data_mark']['rows']:
+            logger.info(f"Full retrain needed: {self.new_data_filename} was rebuilt")
+            return None
+        if new_df.shape[0] == 0:
+            logger.info(f"No rows added to {self.new_data_filename} since the last update, the model is unchanged")
+            return summary
+        new_data_mark = {'rows': skipped + int(new_df.shape[0]), 'last_id': int(new_df[ID_COLUMN].iloc[-1])}
+
+        # The batch goes through the promoted preprocessor and scaler, the model's feature space does not change
+        scaler = load_artifact(os.path.join(best_model_dir, manifest['artifacts']['scaler']['file']))
+        preprocessor = load_artifact(os.path.join(best_model_dir, manifest['artifacts']['preprocessor']['file']))
+        prepared_df = clean(df=new_df[[col for col in TRAINING_COLUMNS if col in new_df.columns]]).prepare_data()
+        batch_df = preprocessor.transform(prepared_df)
+        X_batch = batch_df.drop(TARGET_COLUMN, axis=1).astype(np.float32)
+        X_batch = pd.DataFrame(scaler.transform(X_batch), columns=X_batch.columns)
+        y_batch = batch_df[TARGET_COLUMN].reset_index(drop=True)
+        if strategy != 'partial_fit' and not has_every_class(y_batch, model.classes_):
+            # Refitting on a single class would drop the other from the model, wait for more rows
+            logger.info(f"The {y_batch.shape[0]} new rows do not hold every class yet, the model is unchanged")
+            return summary
+
+        start = time.perf_counter()
+        model = fold_batch(model, X_batch, y_batch, rows_seen=manifest['training_rows'])
+        fit_seconds = time.perf_counter() - start
+
+        # The test set of the last full retrain is still in the pipeline work directory while it is current
+        test_accuracy = None
+        evaluation = read_stamp(self.stage_dir('evaluation'))
+        if evaluation is not None and evaluation['fingerprint'] == manifest['pipeline_fingerprint']:
+            _, X_test, _, y_test = self.load_dataset(manifest['dataset'])
+            test_accuracy = float(accuracy_score(y_test, model.predict(X_test)))
+            # Checked against the last full retrain, not the previous update, so the drops do not add up
+            if test_accuracy < manifest['full_retrain_test_accuracy'] - MAX_ACCURACY_DROP:
+                logger.info(f"Full retrain needed: test accuracy dropped from {manifest['full_retrain_test_accuracy']} "
+                            f"at the last full retrain to {test_accuracy} after folding in the new rows")
+                return None
+        else:
+            logger.warning("The test set of the last full retrain is gone, the update is not checked")
+
+        # Same promotion order as a full retrain: the model file, then the manifest
+        incremental_dir = self.stage_dir('incremental')
+        os.makedirs(incremental_dir, exist_ok=True)
+        dump_artifact(model, os.path.join(incremental_dir, 'best_model.joblib'))
+        self.promote_artifact(os.path.join(incremental_dir, 'best_model.joblib'),
+                              os.path.join(best_model_dir, 'best_model.joblib'))
+        metadata = {key: value for key, value in manifest.items()
+                    if key not in ('version', 'created_at', 'feature_columns', 'artifacts')}
+        metadata.update(
+            test_accuracy=test_accuracy if test_accuracy is not None else manifest['test_accuracy'],
+            training_rows=manifest['training_rows'] + int(y_batch.shape[0]),
+            new_data_mark=new_data_mark,
+            incremental_updates=manifest.get('incremental_updates', 0) + 1,
+        )
+        write_manifest(best_model_dir, dict(manifest['artifacts'], model=artifact_entry(
+            os.path.join(best_model_dir, 'best_model.joblib'))), feature_columns=manifest['feature_columns'], **metadata)
+
+        logger.info(f"Folded {y_batch.shape[0]} new rows into {manifest['model_name']} in {fit_seconds:.1f}s, "
+                    f"test accuracy {metadata['test_accuracy']}")
+        summary.update(best_model_test_accuracy=metadata['test_accuracy'], rows_folded=int(y_batch.shape[0]))
+        return summary
+
+    def retrain(self, mode='auto', drift_detected=False):
+        """
+        Update the promoted model with the new data, incrementally when possible.
+
+        Args:
+            mode (str): 'auto' folds the new rows into the promoted model unless a full retrain
+                is due (see update_incremental), 'full' always retrains in full, 'incremental'
+                never does.
+            drift_detected (bool): A drift test of the monitoring job failed.
+
+        Returns:
+            dict: Dictionary containing model performance metrics and the update_mode used,
+                None when an incremental update was requested but is not possible.
+        """
+        if mode not in ('auto', 'full', 'incremental'):
+            raise ValueError(f"Unknown retrain mode {mode}, expected auto, full or incremental")
+        if mode != 'full':
+            result = self.update_incremental(drift_detected)
+            if result is not None or mode == 'incremental':
+                return result
+        return self.train_and_evaluate_model()
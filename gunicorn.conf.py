@@ -0,0 +1,25 @@
+"""
+gunicorn settings of the prediction API, picked up from the working directory.
+
+Points prometheus_client at a directory shared by the workers so /metrics
+aggregates all of them (see model_inference/metrics.py). The directory is
+emptied when gunicorn starts, and the live gauges of a worker are dropped
+when it exits.
+"""
+import os
+import shutil
+
+# Set before the workers import prometheus_client, they inherit it when forked
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/mediwatch_metrics')
+
+
+def on_starting(server):
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    # Values of a previous run would be summed with the new ones
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from continuous_training.airflow_local.src.model_inference.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
@@ -10,4 +10,7 @@ TRAINING_DATA_PATH = "/home/ubuntu/mediwatch_capstone_2024/continuous_training/a
 
 NEW_DATA_PATH = "/home/ubuntu/mediwatch_capstone_2024/continuous_training/airflow_local/src/new_data/new_data.csv"
 
-MODEL_PATH = "/home/ubuntu/mediwatch_capstone_2024/continuous_training/airflow_local/src/models/best_model"
\ No newline at end of file
+MODEL_PATH = "/home/ubuntu/mediwatch_capstone_2024/continuous_training/airflow_local/src/models/best_model"
+
+# Running drift aggregates and the high-water mark of the rows already reported
+MONITOR_STATE_PATH = "/home/ubuntu/mediwatch_capstone_2024/monitoring-dashboard/mediwatch/monitor_state.json"
\ No newline at end of file
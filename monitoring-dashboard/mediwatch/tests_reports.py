@@ -6,10 +6,12 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../.
 import pandas as pd
 import requests
 from requests.auth import HTTPBasicAuth
-from continuous_training.airflow_local.src.model_inference.predict import DiabetesReadmissionPredictor
+from continuous_training.airflow_local.src.model_inference.registry import get_model_registry
 from continuous_training.airflow_local.src.data_cleaning.clean import clean
-from continuous_training.airflow_local.src.lib.utils import get_reference_data, get_report, compare_dataframe_features
-from continuous_training.airflow_local.src.lib.utils import get_test_suite
+from continuous_training.airflow_local.src.lib.utils import get_reference_data, get_report
+from continuous_training.airflow_local.src.lib.new_data_store import compact_new_data
+from continuous_training.airflow_local.src.lib.drift_monitor import DriftMonitor, ID_COLUMN
+from continuous_training.airflow_local.src.lib.prediction_log import PredictionLog, PREDICTION_LOG_FILENAME
 from evidently.ui.workspace import Workspace
 from evidently import ColumnMapping
 from continuous_training.airflow_local.src.data_cleaning.common import get_numeric_features, get_categorical_features
@@ -21,13 +23,15 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-def trigger_dag(original_data_filename, new_data_filename, model_dir):
+def trigger_dag(original_data_filename, new_data_filename, model_dir, drift_detected=False):
 
     parameters = {
         "conf": {
             "original_data_filename": original_data_filename,
             "new_data_filename": new_data_filename,
-            "model_dir": model_dir
+            "model_dir": model_dir,
+            # Drift calls for a full retrain, otherwise the DAG folds the new rows into the served model when it can
+            "drift_detected": drift_detected
             # "bucket_name": cfg.BUCKET_NAME
         }
     }   
@@ -55,46 +59,37 @@ def create_column_mapping(data, target_column, prediction_column):
     
     return column_mapping
 
-def get_test_summary(tests_results):
-
-    # False for failed and True for passed
-    test_summary = []
-    logger.info("Getting test summary: False for failed and True for passed")
-    for result in tests_results:
-        if result['status'] == 'SUCCESS':
-            test_summary.append(True)
-        else:
-            test_summary.append(False)
-
-    return test_summary
-
 def main():
-    # Intialize the predictor for new data
-    print("Create Diabetes Readmission Predictor Object ........")
-    predictor = DiabetesReadmissionPredictor(cfg.NEW_DATA_PATH, cfg.MODEL_PATH)
+    # Merge the segments appended by the prediction service into new_data.csv
+    compact_new_data(cfg.NEW_DATA_PATH)
+
+    # The served artifacts give the model version to monitor and the preprocessor, nothing is scored here
+    artifacts = get_model_registry(cfg.MODEL_PATH).get()
+    # Use the preprocessor of the served model so both datasets share its category codes
+    preprocessor = artifacts.preprocessor
 
-    # Make predictions on new data
-    print("Run prediction ...........")
-    result = predictor.prediction_diabetes_readmission()
+    # The reference sketches are only rebuilt from the training data when the served model changed
+    monitor = DriftMonitor(cfg.MONITOR_STATE_PATH)
+    monitor.ensure_reference(artifacts.version, lambda: get_reference_data(cfg.TRAINING_DATA_PATH, preprocessor))
 
-    # Load the CSV file you want to make predictions on
+    # Only the rows past the high-water mark of the previous run are read and reported
     print(f"Loading new data from: {cfg.NEW_DATA_PATH}")
-    new_data = pd.read_csv(cfg.NEW_DATA_PATH)
-
-    # Check if the prediction was successful
-    if "Hospital Readmission Prediction" in result[0]:
-        predictions = result[0]["Hospital Readmission Prediction"]
-        
-        # Create a dictionary mapping patient_id to predicted_readmitted
-        prediction_dict = {item['patient_id']: item['predicted_readmitted'] for item in predictions}
-        
-        # Add the predictions as a new column
-        new_data['Predicted_readmitted'] = new_data['patient_nbr'].map(prediction_dict)
-        
-        print("Predictions added to new_data DataFrame.")
-    else:
-        print("Error: Prediction failed. Unable to add predictions to new_data. Cannot proceed ahead...")
-        sys.exit(1)
+    new_data, rows_skipped = monitor.read_new_rows(cfg.NEW_DATA_PATH)
+    if new_data.shape[0] == 0:
+        print(f"No new predictions since the last run ({rows_skipped} rows already reported). Exiting...")
+        return
+
+    # Join the predictions the service answered for these encounters, with the model version that served them
+    prediction_log = PredictionLog(os.path.join(os.path.dirname(cfg.NEW_DATA_PATH), PREDICTION_LOG_FILENAME))
+    logged = prediction_log.lookup(new_data[ID_COLUMN])
+    new_data['Predicted_readmitted'] = new_data[ID_COLUMN].map(logged['prediction'])
+    served_by = new_data[ID_COLUMN].map(logged['model_version'])
+
+    missing = int(new_data['Predicted_readmitted'].isna().sum())
+    if missing:
+        print(f"{missing} new rows have no logged prediction, they only count for drift")
+    print(f"Predictions of {new_data.shape[0] - missing} rows joined from {prediction_log.path}, "
+          f"served by model versions {served_by.dropna().unique().tolist()}")
     
     # Save the new data with predictions
     new_data_with_pred_filename = os.path.join(os.getcwd(), 'new_data_with_predictions.csv')
@@ -105,8 +100,16 @@ def main():
     # Clean new data to include features we used for training and inference
     # Mapping of readmitted is also achieved
     print("Invoking cleaning module to clean new data and leave only features used for training and inference ..........")
-    cleanObj = clean(new_data_with_pred_filename)
-    new_data_with_pred = cleanObj.clean_data()
+    cleanObj = clean(df=new_data)
+    new_data_with_pred = cleanObj.clean_data(preprocessor=preprocessor)
+    # The preprocessor only outputs model features, cleaning keeps the row index so predictions line up
+    new_data_with_pred['Predicted_readmitted'] = new_data['Predicted_readmitted']
+    served_by = served_by.loc[new_data_with_pred.index]
+
+    # Merge the new rows into the running aggregates, this also moves the high-water mark
+    batch_results = monitor.update(new_data_with_pred, rows_read=rows_skipped + new_data.shape[0],
+                                   last_id=new_data[ID_COLUMN].iloc[-1], model_versions=served_by)
+    test_results = monitor.run_tests()
 
     # Create the column mapping for Evidently, this depends on what exactly was used for training and prediction
     target_column = "readmitted"
@@ -127,42 +130,36 @@ def main():
 
     existing_projects = ws.search_project(project_name=cfg.PROJECT_NAME)
     project = existing_projects[0]
-    
-    # Reference data is the original training data training data with predicted_readmitted
-    reference_data = get_reference_data(cfg.TRAINING_DATA_PATH)
-
-    if reference_data is None:
-        print("Error: Reference data not found. Please provide a valid reference data path.")
-        sys.exit(1)
 
-    # Both reference data and new data are cleaned and have the same features
-    print("Comparing reference data and new data features to ensure they are the same.")
-    result = compare_dataframe_features(reference_data, new_data_with_pred)
-    
-    if result:
-        print("The original and new data could be used to generate Evidently reports ... Proceeding ...")
-    else:
-        print("Error: Please address the differences in the datasets before proceeding.....")
-        sys.exit(1)
-
-    report = get_report(reference_data, new_data_with_pred, column_mapping=column_mapping)
+    # The report only covers this batch, the dashboard sums the rows of all reports
+    metadata = {
+        "model_version": artifacts.version,
+        "rows_reported": str(monitor.state['rows_reported']),
+        "tests": {format_test_name(test): f"{test['value']}" for test in test_results},
+    }
+    # Evidently needs a prediction on every row it evaluates
+    reported_data = new_data_with_pred.dropna(subset=[prediction_column]).astype({prediction_column: int})
+    report = get_report(None, reported_data, column_mapping=column_mapping, metadata=metadata)
     ws.add_report(project.id, report)
 
-    test_suite = get_test_suite(reference_data, new_data_with_pred, column_mapping)
-    ws.add_test_suite(project.id, test_suite)
-
-
-    test_summary = get_test_summary(test_suite.as_dict()['tests'])
+    test_summary = [test['passed'] for test in test_results]
 
     print(f"Test summary:--------------\n {test_summary}")
-    print(f"Tests: {test_suite.as_dict()['tests']}")
+    print(f"Tests since model version {artifacts.version} was promoted: {test_results}")
+    print(f"Tests of this batch: {batch_results}")
 
     if not all(test_summary):
-        print("Error: One or more tests failed. Triggering model retraining...")
-        trigger_dag(cfg.TRAINING_DATA_PATH, cfg.NEW_DATA_PATH, cfg.MODEL_PATH)
+        # Drift tests are the ones on a column, accuracy and precision are not
+        drift_detected = any(not test['passed'] for test in test_results if test['column'])
+        print(f"Error: One or more tests failed. Triggering model retraining (drift detected: {drift_detected})...")
+        trigger_dag(cfg.TRAINING_DATA_PATH, cfg.NEW_DATA_PATH, cfg.MODEL_PATH, drift_detected=drift_detected)
 
     else:
         print("All tests have passed. Not retraining the model.")
 
+
+def format_test_name(test):
+    return f"{test['name']}({test['column']})" if test['column'] else test['name']
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""
+Shared fixtures: a small synthetic dataset and a promoted model trained on it.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import os
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+from benchmarks.bench_clean import load_dataset
+from benchmarks.synthetic import generate_chunk
+from continuous_training.airflow_local.src.data_cleaning.clean import clean
+from continuous_training.airflow_local.src.data_cleaning.common import PROFILE_OFF
+from continuous_training.airflow_local.src.data_cleaning.preprocessor import DiabetesPreprocessor
+from continuous_training.airflow_local.src.data_cleaning.schema import read_raw_csv
+from continuous_training.airflow_local.src.lib.artifacts import dump_artifact, write_manifest
+
+# Rows of the synthetic dataset, enough for both classes and most categories
+DATASET_ROWS = 2000
+
+
+@pytest.fixture(scope='session')
+def raw_csv(tmp_path_factory):
+    """Path of a synthetic diabetic_data.csv of DATASET_ROWS rows."""
+    path = tmp_path_factory.mktemp('data') / 'diabetic_data.csv'
+    generate_chunk(load_dataset(), DATASET_ROWS, np.random.default_rng(7), 1, DATASET_ROWS).to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def raw_df(raw_csv):
+    """The synthetic dataset as the prediction service parses it."""
+    return read_raw_csv(raw_csv)
+
+
+def train_artifacts(raw_df):
+    """Fit a preprocessor, a scaler and a LogisticRegression on raw rows."""
+    prepared_df = clean(df=raw_df, profile_level=PROFILE_OFF).prepare_data()
+    preprocessor = DiabetesPreprocessor().fit(prepared_df)
+    train_df = preprocessor.transform(prepared_df)
+    X = train_df.drop('readmitted', axis=1).astype(np.float32)
+    y = train_df['readmitted']
+    scaler = StandardScaler().fit(X)
+    model = LogisticRegression(max_iter=500).fit(scaler.transform(X), y)
+    return model, scaler, preprocessor
+
+
+def promote_artifacts(model_dir, model, scaler, preprocessor, **metadata):
+    """Write the artifacts and their manifest the way the trainer promotes them."""
+    os.makedirs(model_dir, exist_ok=True)
+    artifacts = {
+        'model': dump_artifact(model, os.path.join(model_dir, 'best_model.joblib')),
+        'scaler': dump_artifact(scaler, os.path.join(model_dir, 'best_scaler.joblib')),
+        'preprocessor': dump_artifact(preprocessor, os.path.join(model_dir, 'best_preprocessor.joblib')),
+    }
+    return write_manifest(model_dir, artifacts, feature_columns=preprocessor.feature_columns, **metadata)
+
+
+@pytest.fixture
+def model_dir(tmp_path, raw_df):
+    """A src/models/best_model directory holding a promoted model, with src/new_data next to it."""
+    model_dir = str(tmp_path / 'src' / 'models' / 'best_model')
+    promote_artifacts(model_dir, *train_artifacts(raw_df), model_name='Logistic Regression')
+    return model_dir
@@ -0,0 +1,64 @@
+from continuous_training.airflow_local.src.lib.drift_monitor import (
+    DRIFT_TESTS, ID_COLUMN, PREDICTION_COLUMN, TARGET_COLUMN, DriftMonitor)
+
+DRIFT_COLUMNS = [column for column, _, _ in DRIFT_TESTS]
+
+
+def reported(new_df):
+    """New rows as the monitoring job reports them: the drift columns, a binary target and a prediction."""
+    report_df = new_df[DRIFT_COLUMNS].astype(float)
+    report_df[TARGET_COLUMN] = (new_df[TARGET_COLUMN] == '<30').astype(int)
+    report_df[PREDICTION_COLUMN] = report_df[TARGET_COLUMN]
+    return report_df
+
+
+def report_new_rows(monitor, new_data_path):
+    new_df, skipped = monitor.read_new_rows(new_data_path)
+    if new_df.shape[0]:
+        monitor.update(reported(new_df), skipped + new_df.shape[0], new_df[ID_COLUMN].iloc[-1])
+    return new_df
+
+
+def test_each_row_is_reported_once(tmp_path, raw_df):
+    state_path = str(tmp_path / 'monitor_state.json')
+    new_data_path = str(tmp_path / 'new_data.csv')
+    monitor = DriftMonitor(state_path)
+    monitor.ensure_reference('v1', lambda: raw_df[DRIFT_COLUMNS])
+
+    raw_df.iloc[:100].to_csv(new_data_path, index=False)
+    assert report_new_rows(monitor, new_data_path).shape[0] == 100
+
+    # The next run, from the saved state, only reads the rows appended since
+    raw_df.iloc[100:130].to_csv(new_data_path, mode='a', header=False, index=False)
+    monitor = DriftMonitor(state_path)
+    new_df = report_new_rows(monitor, new_data_path)
+    assert new_df[ID_COLUMN].tolist() == raw_df[ID_COLUMN].iloc[100:130].tolist()
+    assert report_new_rows(monitor, new_data_path).shape[0] == 0
+    assert monitor.state['rows_reported'] == 130
+    assert monitor.high_water_mark == {'rows': 130, 'last_id': int(raw_df[ID_COLUMN].iloc[129])}
+    assert sum(monitor.state['confusion'][0]) + sum(monitor.state['confusion'][1]) == 130
+
+
+def test_new_model_version_keeps_the_high_water_mark(tmp_path, raw_df):
+    new_data_path = str(tmp_path / 'new_data.csv')
+    monitor = DriftMonitor(str(tmp_path / 'monitor_state.json'))
+    monitor.ensure_reference('v1', lambda: raw_df[DRIFT_COLUMNS])
+    raw_df.iloc[:100].to_csv(new_data_path, index=False)
+    report_new_rows(monitor, new_data_path)
+
+    # The counts start over for the new model, the rows reported for v1 are not read again
+    monitor.ensure_reference('v2', lambda: raw_df[DRIFT_COLUMNS])
+    assert monitor.state['rows_reported'] == 0
+    assert report_new_rows(monitor, new_data_path).shape[0] == 0
+
+
+def test_rebuilt_new_data_is_reported_again(tmp_path, raw_df):
+    new_data_path = str(tmp_path / 'new_data.csv')
+    monitor = DriftMonitor(str(tmp_path / 'monitor_state.json'))
+    monitor.ensure_reference('v1', lambda: raw_df[DRIFT_COLUMNS])
+    raw_df.iloc[:100].to_csv(new_data_path, index=False)
+    report_new_rows(monitor, new_data_path)
+
+    raw_df.iloc[200:250].to_csv(new_data_path, index=False)
+    assert report_new_rows(monitor, new_data_path).shape[0] == 50
+    assert monitor.state['rows_reported'] == 50
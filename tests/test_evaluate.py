@@ -0,0 +1,54 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+from continuous_training.airflow_local.src.data_cleaning.clean import clean
+from continuous_training.airflow_local.src.data_cleaning.common import PROFILE_OFF
+from continuous_training.airflow_local.src.model_training import train
+from continuous_training.airflow_local.src.model_training.stages import write_stamp
+from conftest import train_artifacts
+
+FEATURES_FINGERPRINT = 'f' * 16
+# name: (balanced accuracy, test accuracy), the best ranked is not the most accurate
+LAZY_METRICS = {'GaussianNB': (0.7, 0.8), 'BernoulliNB': (0.6, 0.9), 'NearestCentroid': (0.5, 0.7)}
+
+
+def trained_lazy_family(trainer, raw_df):
+    """Write the features and a lazy_classifier_0 stage as train_family leaves them, with a model file per candidate."""
+    _, scaler, preprocessor = train_artifacts(raw_df)
+    train_df = preprocessor.transform(clean(df=raw_df, profile_level=PROFILE_OFF).prepare_data())
+    X = pd.DataFrame(scaler.transform(train_df.drop('readmitted', axis=1).astype(np.float32)),
+                     columns=preprocessor.feature_columns)
+    features_dir = trainer.stage_dir('features')
+    os.makedirs(features_dir, exist_ok=True)
+    for split in ['train', 'test']:
+        feather.write_feather(X.assign(readmitted=train_df['readmitted'].to_numpy()),
+                              os.path.join(features_dir, f'lazy_scaled_{split}.feather'))
+    write_stamp(features_dir, FEATURES_FINGERPRINT, dataset_rows={'lazy_scaled': int(X.shape[0])})
+
+    family_dir = trainer.stage_dir('candidates', f'{train.LAZY_FAMILY_PREFIX}_0')
+    os.makedirs(family_dir, exist_ok=True)
+    for name in LAZY_METRICS:
+        open(os.path.join(family_dir, f'{name}.joblib'), 'wb').close()
+    results = {name: {'train_accuracy': test_accuracy, 'test_accuracy': test_accuracy,
+                      'balanced_accuracy': balanced_accuracy, 'fit_seconds': 0.1, 'peak_memory_mb': 1.0}
+               for name, (balanced_accuracy, test_accuracy) in LAZY_METRICS.items()}
+    write_stamp(family_dir, 'c' * 16, features=FEATURES_FINGERPRINT, results=results,
+                candidates={name: {'dataset': 'lazy_scaled', 'model_file': f'{name}.joblib'} for name in LAZY_METRICS})
+    return family_dir
+
+
+def test_only_selected_models_are_kept(tmp_path, raw_csv, raw_df):
+    trainer = train.DiabetesReadmissionTrainer(raw_csv, model_dir=str(tmp_path / 'models'), top_k=1)
+    family_dir = trained_lazy_family(trainer, raw_df)
+
+    evaluation = trainer.evaluate()
+    assert evaluation['selected'] == ['GaussianNB']
+    assert sorted(os.listdir(family_dir)) == ['GaussianNB.joblib', 'stamp.json']
+
+    # A larger top_k selects a model removed by the previous evaluation, it is trained again
+    trainer.top_k = 2
+    evaluation = trainer.evaluate()
+    assert evaluation['best_model_name'] == 'BernoulliNB'
+    assert os.path.getsize(evaluation['model_path']) > 0
+    assert not os.path.exists(os.path.join(family_dir, 'NearestCentroid.joblib'))
@@ -0,0 +1,75 @@
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+from sklearn.linear_model import SGDClassifier
+from continuous_training.airflow_local.src.data_cleaning.clean import clean
+from continuous_training.airflow_local.src.data_cleaning.common import PROFILE_OFF
+from continuous_training.airflow_local.src.data_cleaning.schema import read_raw_csv
+from continuous_training.airflow_local.src.lib.artifacts import read_manifest
+from continuous_training.airflow_local.src.lib.new_data_store import high_water_mark
+from continuous_training.airflow_local.src.model_training import train
+from continuous_training.airflow_local.src.model_training.incremental import MAX_ACCURACY_DROP, full_retrain_reason
+from continuous_training.airflow_local.src.model_training.stages import write_stamp
+from conftest import train_artifacts, promote_artifacts
+
+FULL_RETRAIN_ACCURACY = 0.9
+PIPELINE_FINGERPRINT = 'f' * 16
+BATCH_ROWS = 200
+
+
+def promote_full_retrain(trainer, raw_df, new_data_path):
+    """Promote an SGDClassifier as a full retrain would, with its test set in the pipeline work directory."""
+    _, scaler, preprocessor = train_artifacts(raw_df)
+    prepared_df = clean(df=raw_df, profile_level=PROFILE_OFF).prepare_data()
+    train_df = preprocessor.transform(prepared_df)
+    X = pd.DataFrame(scaler.transform(train_df.drop('readmitted', axis=1).astype(np.float32)),
+                     columns=preprocessor.feature_columns)
+    y = train_df['readmitted'].to_numpy()
+    model = SGDClassifier(random_state=0).fit(X, y)
+
+    features_dir = trainer.stage_dir('features')
+    os.makedirs(features_dir, exist_ok=True)
+    for split in ['train', 'test']:
+        feather.write_feather(X.assign(readmitted=y), os.path.join(features_dir, f'scaled_{split}.feather'))
+    write_stamp(trainer.stage_dir('evaluation'), PIPELINE_FINGERPRINT)
+    promote_artifacts(os.path.join(trainer.model_dir, 'best_model'), model, scaler, preprocessor,
+                      model_name='SGDClassifier', pipeline_fingerprint=PIPELINE_FINGERPRINT, dataset='scaled',
+                      test_accuracy=FULL_RETRAIN_ACCURACY, full_retrain_test_accuracy=FULL_RETRAIN_ACCURACY,
+                      training_rows=int(y.shape[0]), full_retrain_at=datetime.now().isoformat(timespec='seconds'),
+                      new_data_mark=high_water_mark(new_data_path), incremental_updates=0)
+
+
+def test_consecutive_degrading_updates_are_stopped(tmp_path, raw_csv, monkeypatch):
+    raw_df = read_raw_csv(raw_csv)
+    new_data_path = str(tmp_path / 'new_data.csv')
+    raw_df.iloc[:BATCH_ROWS].to_csv(new_data_path, index=False)
+    trainer = train.DiabetesReadmissionTrainer(raw_csv, new_data_path, str(tmp_path / 'models'))
+    promote_full_retrain(trainer, raw_df.iloc[BATCH_ROWS:], new_data_path)
+
+    # Every update loses a bit more than half of the allowed drop on the test set
+    step = 0.6 * MAX_ACCURACY_DROP
+    accuracies = iter(FULL_RETRAIN_ACCURACY - step * i for i in range(1, 4))
+    monkeypatch.setattr(train, 'accuracy_score', lambda y_true, y_pred: next(accuracies))
+
+    results = []
+    for i in range(1, 4):
+        raw_df.iloc[i * BATCH_ROWS:(i + 1) * BATCH_ROWS].to_csv(new_data_path, mode='a', header=False, index=False)
+        results.append(trainer.update_incremental())
+
+    # The first update stays within the drop, the next ones add up to more than allowed
+    assert results[0]['update_mode'] == 'incremental' and results[0]['rows_folded'] > 0
+    assert results[1:] == [None, None]
+    manifest = read_manifest(os.path.join(trainer.model_dir, 'best_model'))
+    assert manifest['incremental_updates'] == 1
+    assert manifest['full_retrain_test_accuracy'] == FULL_RETRAIN_ACCURACY
+    assert manifest['test_accuracy'] == FULL_RETRAIN_ACCURACY - step
+
+
+def test_full_retrain_reason():
+    manifest = {'full_retrain_at': '2026-10-01T00:00:00', 'full_retrain_test_accuracy': FULL_RETRAIN_ACCURACY}
+    assert full_retrain_reason(manifest, now=datetime(2026, 10, 10)) is None
+    assert full_retrain_reason(manifest, drift_detected=True, now=datetime(2026, 10, 10)) is not None
+    assert full_retrain_reason(manifest, now=datetime(2026, 12, 1)) is not None
+    assert full_retrain_reason(None) is not None
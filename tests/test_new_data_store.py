@@ -0,0 +1,64 @@
+import os
+import pandas as pd
+from continuous_training.airflow_local.src.data_cleaning.schema import read_raw_csv
+from continuous_training.airflow_local.src.lib.new_data_store import (
+    ID_COLUMN, NewDataStore, high_water_mark, read_rows_after)
+
+
+def test_append_stores_each_encounter_once(tmp_path, raw_df):
+    store = NewDataStore(str(tmp_path / 'new_data'))
+    assert store.append(raw_df.iloc[:10]) == 10
+    # Overlapping resubmission, only the unseen encounters are appended
+    assert store.append(raw_df.iloc[5:15]) == 5
+    assert store.append(raw_df.iloc[:15]) == 0
+
+    new_data_path = store.compact()
+    assert store.pending_segments() == []
+    assert high_water_mark(new_data_path) == {'rows': 15, 'last_id': int(raw_df[ID_COLUMN].iloc[14])}
+
+    # A store opened on an existing new_data.csv without an index seeds it from the file
+    os.remove(store.index_path)
+    assert NewDataStore(store.root_dir).append(raw_df.iloc[10:20]) == 5
+
+
+def test_read_rows_after_the_high_water_mark(tmp_path, raw_df):
+    store = NewDataStore(str(tmp_path / 'new_data'))
+    store.append(raw_df.iloc[:10])
+    new_data_path = store.compact()
+    mark = high_water_mark(new_data_path)
+
+    store.append(raw_df.iloc[10:25])
+    store.compact()
+    new_df, skipped = read_rows_after(new_data_path, mark)
+    assert skipped == 10
+    assert new_df[ID_COLUMN].tolist() == raw_df[ID_COLUMN].iloc[10:25].tolist()
+
+    # Nothing past the end of the file
+    new_df, skipped = read_rows_after(new_data_path, high_water_mark(new_data_path))
+    assert (new_df.shape[0], skipped) == (0, 25)
+
+
+def test_read_rows_after_a_rebuilt_file(tmp_path, raw_df):
+    new_data_path = str(tmp_path / 'new_data.csv')
+    raw_df.iloc[:20].to_csv(new_data_path, index=False)
+    mark = high_water_mark(new_data_path)
+
+    # Rebuilt with other rows: the row at the mark is another encounter, every row is read again
+    raw_df.iloc[20:50].to_csv(new_data_path, index=False)
+    new_df, skipped = read_rows_after(new_data_path, mark)
+    assert skipped == 0
+    assert new_df[ID_COLUMN].tolist() == raw_df[ID_COLUMN].iloc[20:50].tolist()
+
+
+def test_compaction_keeps_every_value(tmp_path, raw_df):
+    store = NewDataStore(str(tmp_path / 'new_data'))
+    store.append(raw_df.iloc[:100])
+    store.compact()
+    # Merged with the schema dtypes: other categories in the new segment and a counter with missing values
+    batch_df = raw_df.iloc[100:200].astype({'number_diagnoses': 'float32'})
+    batch_df.loc[batch_df.index[::3], 'number_diagnoses'] = None
+    store.append(batch_df)
+
+    compacted_df = read_raw_csv(store.compact())
+    expected_df = pd.concat([raw_df.iloc[:100], batch_df])
+    assert compacted_df.to_csv(index=False) == expected_df.to_csv(index=False)
@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+from continuous_training.airflow_local.src.model_inference.predict import DiabetesReadmissionPredictor
+
+
+def make_predictor(model_dir, prediction_cache):
+    return DiabetesReadmissionPredictor(model_dir=model_dir, micro_batching=False,
+                                        prediction_cache=prediction_cache, prediction_log=False)
+
+
+def invalid_rows(raw_df, rows, first_encounter_id):
+    """Copies of raw rows with a gender the cleaning step drops and unseen encounter ids."""
+    invalid_df = raw_df.iloc[:rows].copy()
+    invalid_df['gender'] = invalid_df['gender'].cat.add_categories(['Unknown/Invalid'])
+    invalid_df['gender'] = 'Unknown/Invalid'
+    invalid_df['encounter_id'] = range(first_encounter_id, first_encounter_id + rows)
+    return invalid_df
+
+
+@pytest.mark.parametrize('prediction_cache', [True, False])
+def test_batch_with_every_miss_dropped_by_cleaning(model_dir, raw_df, prediction_cache):
+    predictor = make_predictor(model_dir, prediction_cache)
+    predictor.score_chunk(raw_df.iloc[:1])
+
+    # One row answered from the cache, the only miss dropped by the cleaning step
+    batch_df = pd.concat([raw_df.iloc[:1], invalid_rows(raw_df, 1, 10 ** 9)], ignore_index=True)
+    for _ in range(2):
+        # A dropped row is never cached, resubmitting the batch takes the same path
+        result_df = predictor.score_chunk(batch_df)
+        assert result_df['encounter_id'].tolist() == [raw_df['encounter_id'].iloc[0]]
+
+
+@pytest.mark.parametrize('prediction_cache', [True, False])
+def test_chunk_with_every_row_dropped_by_cleaning(model_dir, raw_df, prediction_cache):
+    predictor = make_predictor(model_dir, prediction_cache)
+    chunks = [raw_df.iloc[:5], invalid_rows(raw_df, 3, 10 ** 9), raw_df.iloc[5:8]]
+    results = list(predictor.score_chunks(chunks))
+    assert [result_df.shape[0] for result_df in results] == [5, 0, 3]
+    assert list(results[1].columns) == ['encounter_id', 'patient_id', 'readmitted', 'predicted_readmitted']
+
+
+def test_cache_hits_and_misses_match_the_uncached_path(model_dir, raw_df):
+    expected_df = make_predictor(model_dir, prediction_cache=False).score_chunk(raw_df)
+
+    predictor = make_predictor(model_dir, prediction_cache=True)
+    # Half of the rows cached first, the full batch then mixes hits and misses, a rerun is all hits
+    predictor.score_chunk(raw_df.iloc[::2])
+    mixed_df = predictor.score_chunk(raw_df)
+    cached_df = predictor.score_chunk(raw_df)
+    # Every row kept by the cleaning step is cached after the mixed batch
+    keys = predictor.prediction_cache.row_keys(raw_df.loc[expected_df.index])
+    assert len(predictor.prediction_cache.lookup(predictor.registry.get().version, keys)) == expected_df.shape[0]
+
+    for result_df in [mixed_df, cached_df]:
+        pd.testing.assert_frame_equal(result_df, expected_df)
@@ -0,0 +1,41 @@
+import numpy as np
+from continuous_training.airflow_local.src.model_inference.prediction_cache import PredictionCache
+
+
+def test_lookup_returns_stored_predictions(tmp_path, raw_df):
+    cache = PredictionCache(str(tmp_path / 'prediction_cache.sqlite'))
+    keys = cache.row_keys(raw_df.iloc[:10])
+    assert cache.lookup('v1', keys) == {}
+
+    predictions = np.arange(10) % 2
+    cache.store('v1', keys, predictions)
+    assert cache.lookup('v1', keys) == dict(zip(keys.tolist(), predictions.tolist()))
+    assert (cache.hits, cache.misses) == (10, 10)
+
+    # Another worker sharing the database sees the entries and the shared counters
+    stats = PredictionCache(cache.path).stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (10, 10, 10)
+
+
+def test_row_keys_ignore_identifiers(raw_df):
+    rows = raw_df.iloc[:3]
+    resubmitted = rows.assign(encounter_id=rows['encounter_id'] + 10 ** 9, patient_nbr=0)
+    assert PredictionCache.row_keys(rows).tolist() == PredictionCache.row_keys(resubmitted).tolist()
+
+
+def test_new_model_version_drops_other_entries(tmp_path, raw_df):
+    cache = PredictionCache(str(tmp_path / 'prediction_cache.sqlite'))
+    keys = cache.row_keys(raw_df.iloc[:10])
+    cache.store('v1', keys, np.ones(10))
+
+    # The first request of the new version, from any worker, invalidates the old entries
+    assert PredictionCache(cache.path).lookup('v2', keys) == {}
+    assert cache.stats()['entries'] == 0
+    assert cache.lookup('v1', keys) == {}
+
+
+def test_expired_entries_are_misses(tmp_path, raw_df):
+    cache = PredictionCache(str(tmp_path / 'prediction_cache.sqlite'), ttl=-1)
+    keys = cache.row_keys(raw_df.iloc[:10])
+    cache.store('v1', keys, np.ones(10))
+    assert cache.lookup('v1', keys) == {}
@@ -0,0 +1,33 @@
+import os
+from continuous_training.airflow_local.src.model_inference.registry import ModelRegistry, get_model_registry
+from conftest import train_artifacts, promote_artifacts
+
+
+def test_promoted_model_is_swapped_in(model_dir, raw_df):
+    registry = ModelRegistry(model_dir, check_interval=0)
+    first = registry.get()
+    assert registry.get() is first
+
+    # A retrain promotes another model, files and manifest replaced in place
+    model, scaler, preprocessor = train_artifacts(raw_df)
+    model.coef_ = -model.coef_
+    manifest = promote_artifacts(model_dir, model, scaler, preprocessor, model_name='Logistic Regression')
+
+    second = registry.get()
+    assert second.version == manifest['version'] != first.version
+    assert (second.model.coef_ == model.coef_).all()
+
+
+def test_failed_reload_keeps_serving(model_dir):
+    registry = ModelRegistry(model_dir, check_interval=0)
+    first = registry.get()
+
+    # A retrain still moving files into place: the model no longer matches its manifest
+    with open(os.path.join(model_dir, 'best_model.joblib'), 'ab') as f:
+        f.write(b'partial')
+    assert registry.get() is first
+
+
+def test_one_registry_per_model_dir(model_dir):
+    registry = get_model_registry(model_dir)
+    assert get_model_registry(os.path.join(model_dir, '..', 'best_model')) is registry